@@ -0,0 +1,114 @@
+"""
+Measures adding observations to the archive, and the range queries over it, against
+reading every row of the same columns.
+
+Run with: python benchmarks/bench_archive.py [-rows 1000000] [-cities 1000] [-output results.json]
+"""
+import argparse
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import weather_archive  # pylint: disable=wrong-import-position
+from weather_stub_server import SAMPLE_WEATHER  # pylint: disable=wrong-import-position
+
+
+DAY = 24 * 60 * 60
+
+
+def fill(archive, rows, cities):
+    """
+    Adds an observation for every city every hour, in the order they would be fetched
+    :return: The dt of the last observation
+    """
+    weather_json = copy.deepcopy(SAMPLE_WEATHER)
+    interval = 60 * 60
+    observed = SAMPLE_WEATHER["dt"]
+    for row in range(rows):
+        if row % cities == 0:
+            observed += interval
+        weather_json["id"] = row % cities
+        weather_json["dt"] = observed
+        weather_json["main"]["pressure"] = 980 + (row * 7919) % 60
+        weather_json["main"]["humidity"] = (row * 104729) % 100
+        archive.add(weather_json)
+    return observed
+
+
+def timed(work, repeats=5):
+    """
+    :return: The result of the work, and the fastest of its times in ms
+    """
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = work()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    """
+    Fills an archive, then times a city's last 30 days and the cities above a pressure on
+    one day, each with the archive's indexes and by reading every row
+    """
+    command_parser = argparse.ArgumentParser(description="Weather archive benchmark")
+    command_parser.add_argument("-rows", type=int, default=1000000, help="Rows to add")
+    command_parser.add_argument("-cities", type=int, default=1000,
+                                help="Cities the rows are spread over")
+    command_parser.add_argument("-output", help="Write the results to this JSON file")
+    options = command_parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        archive = weather_archive.ObservationArchive(os.path.join(directory, "archive"))
+        started = time.perf_counter()
+        newest = fill(archive, options.rows, options.cities)
+        archive.flush()
+        add_us = (time.perf_counter() - started) * 1e6 / options.rows
+        day_start = newest - 3 * DAY - newest % DAY
+        month_start = newest - 30 * DAY
+
+        results = {"rows": options.rows, "add_us": add_us,
+                   "numpy": weather_archive.numpy is not None}
+        queries = {
+            "history": (lambda: archive.history(7, "humidity", month_start),
+                        lambda: [(observed, value) for city, observed, value
+                                 in archive.select("humidity", month_start, 2 ** 62)
+                                 if city == 7]),
+            "select": (lambda: archive.select("pressure", day_start, day_start + DAY,
+                                              above=1035),) * 2}
+        may_match = weather_archive._may_match  # pylint: disable=protected-access
+        for name, (indexed, scan) in sorted(queries.items()):
+            found, indexed_ms = timed(indexed)
+            # Without the zone maps, every block is read
+            weather_archive._may_match = lambda *args: True  # pylint: disable=protected-access
+            scanned, scan_ms = timed(scan, repeats=1)
+            weather_archive._may_match = may_match  # pylint: disable=protected-access
+            results[name] = {"found": len(found), "indexed_ms": indexed_ms,
+                             "full_scan_ms": scan_ms, "same": scanned == found}
+        archive.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print("%d rows, %.1f us an add, numpy %s" % (results["rows"], results["add_us"],
+                                                 results["numpy"]))
+    for name in ["history", "select"]:
+        print("%-8s found %6d  indexed %9.2f ms  full scan %9.2f ms"
+              % (name, results[name]["found"], results[name]["indexed_ms"],
+                 results[name]["full_scan_ms"]))
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Compares rendering a million responses one at a time with format_weather against the
+NumPy bulk path in weather_columnar, checking the strings are identical.
+The responses are made and rendered in chunks so they don't all have to be in memory.
+
+Run with: python benchmarks/bench_columnar.py [responses] [chunk size]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_render import ALL_FLAGS, make_responses  # pylint: disable=wrong-import-position
+import weather_columnar  # pylint: disable=wrong-import-position
+import weather_forecast  # pylint: disable=wrong-import-position
+
+
+def main(count, chunk_size):
+    """
+    Renders the responses both ways, in chunks, timing only the rendering
+    :param count: How many responses to render
+    :param chunk_size: How many responses are in memory at once
+    """
+    scalar_seconds = bulk_seconds = render_seconds = 0.0
+    for seed, start in enumerate(range(0, count, chunk_size)):
+        responses = make_responses(min(chunk_size, count - start), seed)
+
+        began = time.perf_counter()
+        expected = [weather_forecast.format_weather(weather_json, ALL_FLAGS)
+                    for weather_json in responses]
+        scalar_seconds += time.perf_counter() - began
+
+        began = time.perf_counter()
+        columns = weather_columnar.collect(responses, ALL_FLAGS)
+        collected = time.perf_counter()
+        rendered = weather_columnar.render_columns(columns, ALL_FLAGS, len(responses))
+        bulk_seconds += time.perf_counter() - began
+        render_seconds += time.perf_counter() - collected
+
+        assert rendered == expected
+
+    for name, seconds in [("format_weather", scalar_seconds),
+                          ("collect + render_columns", bulk_seconds),
+                          ("render_columns only", render_seconds)]:
+        print("%-26s %7.2fs  %7.1f ns/response  %5.2fx" % (
+            name, seconds, seconds / count * 1e9, scalar_seconds / seconds))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
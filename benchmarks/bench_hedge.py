@@ -0,0 +1,85 @@
+"""
+Measures how hedging requests changes the latency of queries against the local stub api,
+when a small share of its answers are much slower than the rest, as the real api's are.
+
+Run with: python benchmarks/bench_hedge.py [-requests 500] [-tail 0.02] [-output results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_suite import summarise  # pylint: disable=wrong-import-position
+import weather_forecast  # pylint: disable=wrong-import-position
+from weather_stub_server import StubServer  # pylint: disable=wrong-import-position
+
+
+def bench_client(stub, requests, hedge_delay, hedge_budget):
+    """
+    Fetches the same query many times in a row through one client
+    :param stub: A running StubServer
+    :param requests: How many queries to fetch
+    :param hedge_delay: The client's hedge_delay
+    :param hedge_budget: The client's hedge_budget
+    :return: A summary of the latencies, with the hedges sent and won
+    """
+    client = weather_forecast.WeatherClient(retries=0, coalesce=False, hedge_delay=hedge_delay,
+                                            hedge_budget=hedge_budget)
+    parser = weather_forecast.InputParser(client=client)
+    parser.user_input = {"api": "test", "cid": "2643743", "pressure": True}
+    seconds = []
+    for number in range(requests):
+        url = stub.url("id=" + str(number) + "&APPID=test")
+        started = time.perf_counter()
+        parser.get_from_url(url)
+        seconds.append(time.perf_counter() - started)
+    stats = client.stats()
+    client.close()
+    summary = summarise(seconds)
+    summary.update(sent=stats["requests"], hedged=stats["hedged"],
+                   hedge_wins=stats["hedge_wins"])
+    return summary
+
+
+def main():
+    """
+    Runs the same queries without hedging, with a fixed delay and with the observed p95
+    """
+    command_parser = argparse.ArgumentParser(description="Weather hedging benchmark")
+    command_parser.add_argument("-requests", type=int, default=500,
+                                help="Queries fetched for each setting")
+    command_parser.add_argument("-latency", type=float, default=0.02,
+                                help="Seconds the stub usually waits before answering")
+    command_parser.add_argument("-tail", type=float, default=0.02,
+                                help="Share of requests the stub answers slowly")
+    command_parser.add_argument("-slow", type=float, default=1.0,
+                                help="Seconds the stub waits on a slow request")
+    command_parser.add_argument("-delay", type=float, default=0.1,
+                                help="Fixed hedge delay to compare, in seconds")
+    command_parser.add_argument("-budget", type=float, default=0.05,
+                                help="Share of requests that may be hedged")
+    command_parser.add_argument("-output", help="Write the results to this JSON file")
+    options = command_parser.parse_args()
+
+    results = {}
+    for name, hedge_delay in [("no_hedge", None), ("fixed", options.delay),
+                              ("p95", weather_forecast.HEDGE_P95)]:
+        with StubServer(latency=options.latency, tail_rate=options.tail,
+                        tail_latency=options.slow, seed=0) as stub:
+            results[name] = bench_client(stub, options.requests, hedge_delay, options.budget)
+
+    for name, summary in sorted(results.items()):
+        print("%-9s p50 %8.1f ms  p99 %8.1f ms  max %8.1f ms  sent %5d  hedged %4d  won %4d"
+              % (name, summary["p50_ms"], summary["p99_ms"], summary["max_ms"], summary["sent"],
+                 summary["hedged"], summary["hedge_wins"]))
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
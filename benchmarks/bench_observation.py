@@ -0,0 +1,86 @@
+"""
+Compares the memory held by decoded responses against Observations made from them,
+measured with tracemalloc.  The responses are full /weather responses, decoded from JSON
+text as they would be from the network.
+
+Run with: python benchmarks/bench_observation.py [responses]
+"""
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_render import ALL_FLAGS  # pylint: disable=wrong-import-position
+import weather_forecast  # pylint: disable=wrong-import-position
+from weather_observation import Observation  # pylint: disable=wrong-import-position
+from weather_stub_server import SAMPLE_WEATHER  # pylint: disable=wrong-import-position
+
+
+def make_texts(count, seed=0):
+    """
+    Makes varied responses in the shape of SAMPLE_WEATHER, as JSON text
+    :param count: How many to make
+    :param seed: The random seed, so runs can be compared
+    :return: A list of JSON strings
+    """
+    generator = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        weather_json = json.loads(json.dumps(SAMPLE_WEATHER))
+        weather_json["id"] = generator.randint(1, 10 ** 7)
+        weather_json["dt"] = generator.randint(0, 2 ** 31)
+        weather_json["sys"]["sunrise"] = generator.randint(0, 2 ** 31)
+        weather_json["sys"]["sunset"] = weather_json["sys"]["sunrise"] + 40000
+        for key in ("temp", "temp_min", "temp_max"):
+            weather_json["main"][key] = round(generator.uniform(230, 320), 2)
+        weather_json["wind"]["speed"] = round(generator.uniform(0, 40), 2)
+        weather_json["coord"] = {"lon": round(generator.uniform(-180, 180), 2),
+                                 "lat": round(generator.uniform(-90, 90), 2)}
+        texts.append(json.dumps(weather_json))
+    return texts
+
+
+def measure(texts, convert):
+    """
+    :param texts: The responses as JSON text
+    :param convert: What is kept for each decoded response
+    :return: The bytes held by what was kept
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [convert(json.loads(text)) for text in texts]
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return held
+
+
+def main(count):
+    """
+    Checks both forms give the same strings, then measures them
+    :param count: How many responses to keep
+    """
+    texts = make_texts(count)
+    for text in texts[:1000]:
+        weather_json = json.loads(text)
+        assert weather_forecast.format_weather(Observation.from_json(weather_json), ALL_FLAGS) \
+            == weather_forecast.format_weather(weather_json, ALL_FLAGS)
+
+    sizes = {
+        "decoded dict": lambda weather_json: weather_json,
+        "observation": Observation.from_json,
+        "temp only": lambda weather_json: Observation.from_json(weather_json, {"temp": True}),
+    }
+    full = None
+    for name, convert in sizes.items():
+        held = measure(texts, convert)
+        full = full or held
+        print("%-13s %10.1f MB %7.0f bytes/response  %5.1fx smaller" %
+              (name, held / 1e6, held / count, full / held))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,142 @@
+"""
+Compares rendering responses with a compiled render plan against checking the flags
+for every response, as get_from_url used to.
+
+Run with: python benchmarks/bench_render.py [responses]
+"""
+import datetime
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import weather_forecast  # pylint: disable=wrong-import-position
+from weather_stub_server import SAMPLE_WEATHER  # pylint: disable=wrong-import-position
+
+
+ALL_FLAGS = {"api": "test", "cid": "2643743", "time": True, "sunrise": True, "sunset": True,
+             "pressure": True, "cloud": True, "humidity": True, "wind": True,
+             "temp": "fahrenheit"}
+
+
+def legacy_format_weather(weather_json, user_input):
+    """
+    The formatter as it was before render plans, checking every flag for every response
+    :param weather_json: The decoded JSON response
+    :param user_input: The arguments given, which say what information is wanted
+    :return: The string with all the data the user wants
+    """
+
+    output_string = ""
+
+    # Get the timezone difference from UTC in hours
+    if "time" in user_input:
+        time_offset = weather_json["timezone"]//3600
+        # The following statement contains "ternary" operations (or as close as can
+        # get in python, which is just for the grammar of the response
+        output_string += "The timezone is " + str(abs(time_offset)) + " hour" \
+                         + ["s ", " "][abs(time_offset) == 1] + \
+                         ["before", "past"][time_offset > 0] + " GMT.  "
+
+    if "sunrise" in user_input:
+        time_up = weather_json["sys"]["sunrise"]
+        output_string += "The sun rises at " \
+                         + str(datetime.datetime.utcfromtimestamp(time_up).strftime("%H:%M "))\
+                         + "GMT.  "
+
+    if "sunset" in user_input:
+        time_dn = weather_json["sys"]["sunset"]
+        output_string += "The sun sets at " \
+                         + str(datetime.datetime.utcfromtimestamp(time_dn).strftime("%H:%M ")) \
+                         + "GMT.  "
+
+    if "pressure" in user_input:
+        pressure = weather_json["main"]["pressure"]  # Get the pressure (in hPa)
+        output_string += "The pressure is " + str(pressure) + "hPa.  "
+
+    if "cloud" in user_input:
+        cloudiness = weather_json["clouds"]["all"]  # Get the percentage chance of clouds
+        output_string += "There is a " + str(cloudiness) + "% chance of clouds.  "
+
+    if "humidity" in user_input:
+        humidity = weather_json["main"]["humidity"]
+        output_string += "The humidity is at " + str(humidity) + "%.  "
+
+    if "wind" in user_input:
+        wind = weather_json["wind"]
+        # Get the wind, convert it from m/s to k/h
+        output_string += "The wind is moving at " + str(wind["speed"]*3.6) + "km/h, "
+        output_string += "in a direction of " + str(wind["deg"]) + " degrees.  "
+
+    if "temp" in user_input:
+        temp_max = (weather_json["main"]["temp_max"] - 273.15)
+        temp_min = (weather_json["main"]["temp_min"] - 273.15)
+
+        temp_max = [(lambda temperature: temperature * 9/5 + 32)(temp_max),
+                    temp_max][user_input["temp"].lower() == "celsius"]
+        temp_min = [(lambda temperature: temperature * 9 / 5 + 32)(temp_min),
+                    temp_min][user_input["temp"].lower() == "celsius"]
+
+
+        output_string += "The temperature has a high of " + str(round(temp_max, 1)) + \
+                         " and a low of "+  str(round(temp_min, 1)) + " degrees " + \
+                         user_input["temp"].lower() + ".  "
+
+    return output_string
+
+
+def make_responses(count, seed=0):
+    """
+    Makes varied responses in the shape of SAMPLE_WEATHER
+    :param count: How many to make
+    :param seed: The random seed, so runs can be compared
+    :return: A list of decoded JSON responses
+    """
+    generator = random.Random(seed)
+    responses = []
+    for _ in range(count):
+        sunrise = generator.randint(0, 2 ** 31)
+        responses.append({
+            "timezone": generator.randrange(-12, 15) * 3600,
+            "sys": {"sunrise": sunrise, "sunset": sunrise + generator.randint(0, 86400)},
+            "main": {"pressure": generator.randint(950, 1050),
+                     "humidity": generator.randint(0, 100),
+                     "temp_max": round(generator.uniform(230, 320), 2),
+                     "temp_min": round(generator.uniform(230, 320), 2)},
+            "clouds": {"all": generator.randint(0, 100)},
+            "wind": {"speed": round(generator.uniform(0, 40), 2), "deg": generator.randint(0, 360)}
+        })
+    return responses
+
+
+def main(count):
+    """
+    Checks both ways give the same strings, then times them
+    :param count: How many responses to render
+    """
+    responses = make_responses(count) + [SAMPLE_WEATHER]
+    plan = weather_forecast.compile_render_plan(ALL_FLAGS)
+    for weather_json in responses:
+        assert weather_forecast.render(plan, weather_json) == \
+            legacy_format_weather(weather_json, ALL_FLAGS)
+
+    timings = {
+        "legacy": lambda: [legacy_format_weather(weather_json, ALL_FLAGS)
+                           for weather_json in responses],
+        "format_weather": lambda: [weather_forecast.format_weather(weather_json, ALL_FLAGS)
+                                   for weather_json in responses],
+        "compiled plan": lambda: [weather_forecast.render(plan, weather_json)
+                                  for weather_json in responses],
+    }
+    legacy = None
+    for name, run in timings.items():
+        seconds = min(timeit.repeat(run, number=1, repeat=5))
+        legacy = legacy or seconds
+        print("%-15s %8.1f ns/response  %5.2fx" % (name, seconds / len(responses) * 1e9,
+                                                   legacy / seconds))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
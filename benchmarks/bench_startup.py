@@ -0,0 +1,107 @@
+"""
+Measures how long the program takes to start, and which modules it imports on the way,
+for asking for help, a query with a mistake in it and a real query sent to the local stub
+api.  Import times come from python's -X importtime.  Modules loaded through importlib
+aren't listed there under their own name, only their submodules are, so a watched module
+counts as imported when it or any of its submodules is listed.
+
+Run with: python benchmarks/bench_startup.py [-runs 10] [-output results.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from weather_stub_server import StubServer  # pylint: disable=wrong-import-position
+
+
+SCENARIOS = [("help", ["-help"]),
+             ("invalid", ["-api", "test"]),
+             ("query", ["-api", "test", "-cid", "2643743", "-temp", "-pressure", "-wind"])]
+
+# Modules worth knowing whether each run imported
+WATCHED = ["requests", "argparse", "concurrent.futures", "weather_cache", "weather_index"]
+
+
+def parse_importtime(text):
+    """
+    :param text: What -X importtime wrote to stderr
+    :return: A dictionary of module name to its own import time, in microseconds
+    """
+    modules = {}
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(own)
+    return modules
+
+
+def run_once(args, environment):
+    """
+    :param args: The arguments to start the program with
+    :param environment: The environment to start it in
+    :return: The wall clock seconds it took, and the import times of the modules
+    """
+    started = time.perf_counter()
+    finished = subprocess.run([sys.executable, "-X", "importtime",
+                               os.path.join(ROOT, "weather_forecast.py")] + args,
+                              env=environment, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE)
+    return time.perf_counter() - started, parse_importtime(finished.stderr.decode("utf-8"))
+
+
+def bench_scenario(args, environment, runs):
+    """
+    :param args: The arguments to start the program with
+    :param environment: The environment to start it in
+    :param runs: How many times to start it
+    :return: A dictionary of the median wall clock and import times, and which of the
+     watched modules were imported
+    """
+    walls, totals, imported = [], [], set()
+    for _ in range(runs):
+        wall, modules = run_once(args, environment)
+        walls.append(wall)
+        totals.append(sum(modules.values()))
+        imported.update(name for name in WATCHED for module in modules
+                        if module == name or module.startswith(name + "."))
+    middle = runs // 2
+    return {"wall_ms": sorted(walls)[middle] * 1000,
+            "imports_ms": sorted(totals)[middle] / 1000,
+            "imported": sorted(imported)}
+
+
+def main():
+    """
+    Runs every scenario and prints the results
+    """
+    command_parser = argparse.ArgumentParser(description="Weather startup benchmark")
+    command_parser.add_argument("-runs", type=int, default=10,
+                                help="Times each scenario is started")
+    command_parser.add_argument("-output", help="Write the results to this JSON file")
+    options = command_parser.parse_args()
+
+    results = {}
+    with StubServer(seed=0) as stub:
+        environment = dict(os.environ, HTTP_PROXY=stub.address, http_proxy=stub.address,
+                           NO_PROXY="", no_proxy="")
+        for name, args in SCENARIOS:
+            results[name] = bench_scenario(args, environment, options.runs)
+
+    for name, result in sorted(results.items()):
+        print("%-8s wall %8.1f ms  imports %8.1f ms  %s" % (
+            name, result["wall_ms"], result["imports_ms"],
+            " ".join(result["imported"])))
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
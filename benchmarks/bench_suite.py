@@ -0,0 +1,211 @@
+"""
+Measures the program end to end against the local stub api, so that changes to startup,
+request synthesis, fetching and formatting can be compared between runs.
+
+Covers starting the program, InputParser construction, is_valid and synthesise_request,
+and get_from_url throughput and latency at several levels of concurrency, with the stub
+failing a share of requests the way the real api does.  The results are written as JSON.
+
+Run with: python benchmarks/bench_suite.py [-output results.json] [-compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import weather_forecast  # pylint: disable=wrong-import-position
+from weather_stub_server import StubServer  # pylint: disable=wrong-import-position
+
+
+QUERY = ["-api", "test", "-cid", "2643743", "-temp", "-pressure", "-wind"]
+
+
+def summarise(seconds):
+    """
+    :param seconds: How long each run took
+    :return: A dictionary of the count, mean and percentiles, in milliseconds
+    """
+    ordered = sorted(seconds)
+
+    def percentile(share):
+        return ordered[min(len(ordered) - 1, int(share * len(ordered)))] * 1000
+    return {"count": len(ordered), "mean_ms": sum(ordered) / len(ordered) * 1000,
+            "min_ms": ordered[0] * 1000, "p50_ms": percentile(0.5),
+            "p99_ms": percentile(0.99), "max_ms": ordered[-1] * 1000}
+
+
+def time_each(run, repeats):
+    """
+    :param run: A function with no arguments
+    :param repeats: How many times to run it
+    :return: A list of the seconds each run took
+    """
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def bench_command_line(stub, runs):
+    """
+    Runs the program as a user would, once for help and once for a real query, sent to
+    the stub by using it as the HTTP proxy
+    :param stub: A running StubServer
+    :param runs: How many times to run each
+    :return: A dictionary of summaries by what was run
+    """
+    environment = dict(os.environ, HTTP_PROXY=stub.address, http_proxy=stub.address,
+                       NO_PROXY="", no_proxy="")
+    program = [sys.executable, os.path.join(ROOT, "weather_forecast.py")]
+    results = {}
+    for name, args in [("cli_help", ["-help"]), ("cli_query", QUERY)]:
+        results[name] = summarise(time_each(
+            lambda args=args: subprocess.run(program + args, env=environment, check=True,
+                                             stdout=subprocess.DEVNULL), runs))
+    return results
+
+
+def bench_parsing(repeats):
+    """
+    Times the steps before anything is fetched
+    :param repeats: How many times to run each step
+    :return: A dictionary of summaries by step
+    """
+    parser = weather_forecast.InputParser()
+    parser.get_input(QUERY)
+    return {"input_parser": summarise(time_each(weather_forecast.InputParser, repeats)),
+            "get_input": summarise(time_each(lambda: parser.get_input(QUERY), repeats)),
+            "is_valid": summarise(time_each(parser.is_valid, repeats)),
+            "synthesise_request": summarise(time_each(parser.synthesise_request, repeats))}
+
+
+def bench_get_from_url(stub, concurrency, requests_each):
+    """
+    Fetches and formats from many threads at once over one shared client
+    :param stub: A running StubServer
+    :param concurrency: The number of threads
+    :param requests_each: How many queries each thread runs
+    :return: A summary of the latencies, with the throughput and how each query ended
+    """
+    client = weather_forecast.WeatherClient(pool_size=concurrency, retries=0,
+                                            coalesce=False)
+    seconds, outcomes = [], {}
+    lock = threading.Lock()
+
+    def worker(number):
+        parser = weather_forecast.InputParser(client=client)
+        parser.get_input(QUERY)
+        for request in range(requests_each):
+            # Different URLs, so nothing is shared between the threads
+            url = stub.url("id=" + str(number * requests_each + request) + "&APPID=test")
+            started = time.perf_counter()
+            result = parser.get_from_url(url)
+            took = time.perf_counter() - started
+            # Errors are status codes or names like BAD_API, and output is a sentence
+            outcome = "ok" if isinstance(result, str) and not result.isupper() else str(result)
+            with lock:
+                seconds.append(took)
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(number,))
+               for number in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    client.close()
+
+    summary = summarise(seconds)
+    summary["concurrency"] = concurrency
+    summary["requests_per_second"] = len(seconds) / elapsed
+    summary["outcomes"] = outcomes
+    return summary
+
+
+def compare(results, old_results):
+    """
+    Prints how each median changed since an earlier run
+    :param results: The results of this run
+    :param old_results: The results of the earlier run
+    """
+    for name, summary in sorted(results.items()):
+        old = old_results.get(name)
+        if old and old.get("p50_ms"):
+            print("%-24s p50 %9.3f ms -> %9.3f ms  %6.2fx" %
+                  (name, old["p50_ms"], summary["p50_ms"], old["p50_ms"] / summary["p50_ms"]))
+
+
+def parse_error_rates(text):
+    """
+    :param text: e.g. '401=0.01,429=0.05'
+    :return: A dictionary of status code to share of requests
+    """
+    rates = {}
+    for part in filter(None, text.split(",")):
+        status, _, rate = part.partition("=")
+        rates[int(status)] = float(rate)
+    return rates
+
+
+def main():
+    """
+    Runs every benchmark and writes the results
+    """
+    command_parser = argparse.ArgumentParser(description="Weather benchmarks")
+    command_parser.add_argument("-output", help="Write the results to this JSON file")
+    command_parser.add_argument("-compare", help="Compare against an earlier results file")
+    command_parser.add_argument("-latency", type=float, default=0.005,
+                                help="Seconds the stub waits before answering")
+    command_parser.add_argument("-errors", default="401=0.01,404=0.01,429=0.02,500=0.01",
+                                help="Share of requests the stub fails, by status code")
+    command_parser.add_argument("-padding", type=int, default=0,
+                                help="Extra bytes in each stub response")
+    command_parser.add_argument("-concurrency", default="1,4,16,64",
+                                help="Numbers of threads to fetch with")
+    command_parser.add_argument("-requests", type=int, default=400,
+                                help="Queries fetched at each level of concurrency")
+    command_parser.add_argument("-runs", type=int, default=10,
+                                help="Times the program is started")
+    command_parser.add_argument("-repeats", type=int, default=2000,
+                                help="Times each parsing step is run")
+    options = command_parser.parse_args()
+
+    config = {"latency": options.latency, "error_rates": parse_error_rates(options.errors),
+              "padding": options.padding, "requests": options.requests}
+    results = {}
+    results.update(bench_parsing(options.repeats))
+    with StubServer(latency=options.latency, error_rates=config["error_rates"],
+                    padding=options.padding, seed=0) as stub:
+        results.update(bench_command_line(stub, options.runs))
+        for concurrency in [int(level) for level in options.concurrency.split(",")]:
+            results["get_from_url_x" + str(concurrency)] = bench_get_from_url(
+                stub, concurrency, max(1, options.requests // concurrency))
+
+    for name, summary in sorted(results.items()):
+        print("%-24s p50 %9.3f ms  p99 %9.3f ms" % (name, summary["p50_ms"],
+                                                    summary["p99_ms"]) +
+              ("  %8.1f req/s" % summary["requests_per_second"]
+               if "requests_per_second" in summary else ""))
+    if options.compare:
+        with open(options.compare, encoding="utf-8") as old_file:
+            compare(results, json.load(old_file)["results"])
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as output_file:
+            json.dump({"python": platform.python_version(), "platform": platform.platform(),
+                       "time": time.time(), "config": config, "results": results},
+                      output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# This will test the archive of every observation fetched, and queries over its history
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import weather_archive
+from weather_archive import ArchiveLocked, ObservationArchive
+from weather_forecast import InputParser, make_archive, make_client
+from weather_stub_server import SAMPLE_WEATHER, StubServer
+
+
+DAY = 24 * 60 * 60
+
+
+def observed(city_id, dt, **main):
+    """
+    :return: A copy of the sample response for another city and time, with new main values
+    """
+    weather_json = copy.deepcopy(SAMPLE_WEATHER)
+    weather_json["id"] = city_id
+    weather_json["dt"] = dt
+    weather_json["main"].update(main)
+    return weather_json
+
+
+class ObservationArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "archive")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_history(self):
+        archive = ObservationArchive(self.path)
+        for day in range(5):
+            archive.add(observed(1, day * DAY, humidity=50 + day))
+            archive.add(observed(2, day * DAY, humidity=90))
+        self.assertTrue(archive.history(1, "humidity") ==
+                        [(day * DAY, 50.0 + day) for day in range(5)])
+        # From the second day, up to but not including the fourth
+        self.assertTrue(archive.history(1, "humidity", DAY, 3 * DAY) ==
+                        [(DAY, 51.0), (2 * DAY, 52.0)])
+        self.assertTrue(archive.history(3, "humidity") == [])
+        with self.assertRaises(ValueError):
+            archive.history(1, "rain")
+        archive.close()
+
+    def test_skips_repeats(self):
+        # The same observation fetched again, or an older one, isn't added twice
+        archive = ObservationArchive(self.path)
+        self.assertTrue(archive.add(observed(1, DAY)) == 1)
+        self.assertTrue(archive.add(observed(1, DAY)) == 0)
+        self.assertTrue(archive.add(observed(1, 0)) == 0)
+        self.assertTrue(archive.add({"cod": 200}) == 0)
+        self.assertTrue(archive.stats() == {"rows": 1, "cities": 1, "blocks": 1, "skipped": 3})
+        archive.close()
+
+    def test_group_and_missing(self):
+        # A group response adds each city, and a value not in the response is None
+        archive = ObservationArchive(self.path)
+        first, second = observed(1, DAY), observed(2, DAY)
+        del second["wind"], second["timezone"]
+        second["sys"]["timezone"] = 3600
+        self.assertTrue(archive.add({"cnt": 2, "list": [first, second]}) == 2)
+        self.assertTrue(archive.history(2, "wind_speed") == [(DAY, None)])
+        self.assertTrue(archive.history(2, "timezone") == [(DAY, 3600.0)])
+        self.assertTrue(archive.history(1, "wind_speed") == [(DAY, 4.1)])
+        archive.close()
+
+    def test_select(self):
+        archive = ObservationArchive(self.path)
+        for day in range(3):
+            for city_id in range(1, 5):
+                archive.add(observed(city_id, day * DAY + city_id, pressure=1000 + 10 * city_id))
+        self.assertTrue(archive.select("pressure", DAY, 2 * DAY, above=1025) ==
+                        [(3, DAY + 3, 1030.0), (4, DAY + 4, 1040.0)])
+        self.assertTrue(archive.select("pressure", 0, 3 * DAY, below=1015) ==
+                        [(1, 1, 1010.0), (1, DAY + 1, 1010.0), (1, 2 * DAY + 1, 1010.0)])
+        self.assertTrue(archive.select("pressure", 5 * DAY, 6 * DAY) == [])
+        archive.close()
+
+    def test_select_without_numpy(self):
+        # The same answers from the python scan, and blocks that can't match are skipped
+        expected = [(row, row * 60, 1000.0 + row) for row in range(12, 20)]
+        with patch.object(weather_archive, "BLOCK_ROWS", 10):
+            archive = ObservationArchive(self.path)
+            for row in range(30):
+                archive.add(observed(row, row * 60, pressure=1000 + row))
+            self.assertTrue(len(archive.blocks) == 3)
+            self.assertTrue(archive.select("pressure", 0, 20 * 60, above=1011) == expected)
+            with patch.object(weather_archive, "numpy", None), \
+                    patch.object(weather_archive, "_scan", wraps=weather_archive._scan) as scan:
+                self.assertTrue(archive.select("pressure", 0, 20 * 60, above=1011) == expected)
+                # Only the second block has pressures above 1011 before minute 20
+                self.assertTrue(scan.call_count == 1)
+            archive.close()
+
+    def test_reopen(self):
+        archive = ObservationArchive(self.path, flush_rows=2)
+        for day in range(3):
+            archive.add(observed(1, day * DAY, humidity=60 + day))
+        archive.close()
+        archive = ObservationArchive(self.path)
+        self.assertTrue(archive.history(1, "humidity") ==
+                        [(0, 60.0), (DAY, 61.0), (2 * DAY, 62.0)])
+        archive.add(observed(1, 3 * DAY, humidity=63))
+        self.assertTrue(archive.history(1, "humidity", 2 * DAY) == [(2 * DAY, 62.0),
+                                                                    (3 * DAY, 63.0)])
+        archive.close()
+        archive.close()  # Closing again does nothing
+
+    def test_recover(self):
+        # Rows written after the index was saved are indexed again, and half a row dropped
+        archive = ObservationArchive(self.path, flush_rows=1)
+        archive.add(observed(1, 0, humidity=60))
+        archive.flush_rows = 100
+        archive.add(observed(1, DAY, humidity=61))
+        archive.add(observed(2, DAY, humidity=70))
+        for column_file in archive._files.values():
+            column_file.flush()  # Written, but the index wasn't
+        archive._lock_file.close()  # As if the process had been killed
+        with open(os.path.join(self.path, "dt.col"), "ab") as column_file:
+            column_file.write(b"\x01\x02\x03")
+        archive = ObservationArchive(self.path)
+        self.assertTrue(archive.rows == 3)
+        self.assertTrue(archive.history(1, "humidity") == [(0, 60.0), (DAY, 61.0)])
+        self.assertTrue(archive.select("humidity", 0, 2 * DAY, above=65) == [(2, DAY, 70.0)])
+        self.assertTrue(os.path.getsize(os.path.join(self.path, "dt.col")) == 3 * 8)
+        archive.close()
+
+    def test_incremental_index(self):
+        # Flushing doesn't write the index again, only the zone map of a finished block and
+        # a checkpoint, and the rows after them are indexed from the columns when reopened
+        def checkpoint_rows():
+            return weather_archive._read_checkpoint(
+                os.path.join(self.path, weather_archive.LATEST_FILE), self.path)[0]
+        with patch.object(weather_archive, "BLOCK_ROWS", 10):
+            archive = ObservationArchive(self.path, flush_rows=1)
+            for row in range(25):
+                archive.add(observed(row % 4, row * 60, pressure=1000 + row))
+            with open(os.path.join(self.path, weather_archive.BLOCKS_FILE)) as blocks_file:
+                self.assertTrue(len(blocks_file.readlines()) == 2)
+            self.assertTrue(checkpoint_rows() == 20)
+            with open(os.path.join(self.path, weather_archive.BLOCKS_FILE), "a") as blocks_file:
+                blocks_file.write('{"dt": [')  # Half of a zone map
+            archive._lock_file.close()  # As if the process had been killed
+            archive = ObservationArchive(self.path)
+            self.assertTrue(archive.stats()["rows"] == 25 and len(archive.blocks) == 3)
+            self.assertTrue(archive.history(1, "pressure", 20 * 60) ==
+                            [(21 * 60, 1021.0)])
+            self.assertTrue(archive.select("pressure", 0, 30 * 60, above=1022) ==
+                            [(3, 23 * 60, 1023.0), (0, 24 * 60, 1024.0)])
+            self.assertTrue(checkpoint_rows() == 25)
+            archive.close()
+            with open(os.path.join(self.path, weather_archive.BLOCKS_FILE)) as blocks_file:
+                self.assertTrue(len(blocks_file.readlines()) == 2)
+
+    def test_one_writer(self):
+        # A second writer is refused while the first has the archive open, so their rows
+        # and indexes can't be mixed up, but readers aren't
+        archive = ObservationArchive(self.path)
+        archive.add(observed(1, 100, humidity=10))
+        with self.assertRaises(ArchiveLocked):
+            ObservationArchive(self.path)
+        archive.add(observed(1, 200, humidity=11))
+        archive.flush()
+        reader = ObservationArchive(self.path, read_only=True)
+        self.assertTrue(reader.history(1, "humidity") == [(100, 10.0), (200, 11.0)])
+        with self.assertRaises(ValueError):
+            reader.add(observed(2, 100))
+        reader.close()
+        archive.close()
+        # Once the first has closed it, the next writer carries on from its rows
+        second = ObservationArchive(self.path)
+        second.add(observed(2, 100, humidity=20))
+        second.add(observed(2, 200, humidity=21))
+        second.close()
+        archive = ObservationArchive(self.path, read_only=True)
+        self.assertTrue(archive.history(1, "humidity") == [(100, 10.0), (200, 11.0)])
+        self.assertTrue(archive.history(2, "humidity") == [(100, 20.0), (200, 21.0)])
+        archive.close()
+
+    def test_fetch_locked(self):
+        # A query whose archive is being written by another process still runs
+        writer = ObservationArchive(self.path)
+        user_input = {"api": "test", "cid": "2643743", "pressure": True, "archive": self.path}
+        with patch("sys.stderr"):
+            self.assertTrue(make_archive(user_input) is None)
+        writer.close()
+        archive = make_archive(user_input)
+        self.assertTrue(archive is not None)
+        archive.close()
+
+    def test_fetch_adds(self):
+        # Every response fetched with [-archive] is added
+        user_input = {"api": "test", "cid": "2643743", "pressure": True, "archive": self.path}
+        with StubServer() as stub:
+            parser = InputParser(client=make_client(user_input))
+            parser.user_input = user_input
+            parser.get_from_url(stub.url("id=2643743&APPID=test"))
+            parser.client.close()
+        archive = ObservationArchive(self.path)
+        self.assertTrue(archive.history(SAMPLE_WEATHER["id"], "pressure") ==
+                        [(SAMPLE_WEATHER["dt"], 1012.0)])
+        archive.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
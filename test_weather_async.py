@@ -0,0 +1,94 @@
+# This will test the asyncio engine against the local stub server
+import asyncio
+import socket
+import threading
+import time
+import unittest
+
+from weather_async import AsyncWeatherClient, get_many
+from weather_forecast import InputParser
+from weather_stub_server import StubServer
+
+
+ALL_FLAGS = {"api": "test", "cid": "2643743", "time": True, "sunrise": True, "sunset": True,
+             "pressure": True, "cloud": True, "humidity": True, "wind": True,
+             "temp": "fahrenheit"}
+
+
+class AsyncWeatherClientTests(unittest.TestCase):
+
+    def test_same_output_as_blocking(self):
+        with StubServer() as server:
+            test_parser = InputParser()
+            test_parser.user_input = ALL_FLAGS
+            expected = test_parser.get_from_url(server.url())
+            self.assertTrue(get_many([(server.url(), ALL_FLAGS)]) == [expected])
+
+    def test_status_codes(self):
+        for status, expected in [(401, "BAD_API"), (404, "LOCATION_UNKNOWN"), (500, 500)]:
+            with StubServer(status=status, payload={"cod": status}) as server:
+                self.assertTrue(get_many([(server.url(), ALL_FLAGS)]) == [expected])
+
+    def test_concurrent(self):
+        with StubServer(latency=0.2) as server:
+            queries = [(server.url("id=" + str(city) + "&APPID=test"), {"pressure": True})
+                       for city in range(50)]
+            start = time.monotonic()
+            results = get_many(queries, concurrency=50)
+            # 50 requests of 0.2s each would take 10s one at a time
+            self.assertTrue(time.monotonic() - start < 2)
+            self.assertTrue(results == ["The pressure is 1012hPa.  "] * 50)
+            self.assertTrue(len(server.paths) == 50)
+
+    def test_concurrency_limit(self):
+        with StubServer(latency=0.2) as server:
+            queries = [(server.url(), {"pressure": True})] * 4
+            start = time.monotonic()
+            get_many(queries, concurrency=1)
+            self.assertTrue(time.monotonic() - start >= 0.8)  # One at a time
+
+    def test_timeout(self):
+        with StubServer(latency=0.5) as server:
+            self.assertTrue(get_many([(server.url(), ALL_FLAGS)], timeout=0.1) == ["TIMEOUT"])
+
+    def test_connection_error(self):
+        # A server that can't be reached, or doesn't answer in HTTP, is an error for its
+        # own query only
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        closed_url = "http://127.0.0.1:%d/data/2.5/weather?id=1&APPID=test" % \
+            closed.getsockname()[1]
+        closed.close()
+        garbage = socket.socket()
+        garbage.bind(("127.0.0.1", 0))
+        garbage.listen(1)
+        garbage_url = "http://127.0.0.1:%d/data/2.5/weather?id=1&APPID=test" % \
+            garbage.getsockname()[1]
+
+        def answer_garbage():
+            connection, _ = garbage.accept()
+            connection.recv(1024)
+            connection.sendall(b"not http\r\n")
+            connection.close()
+        threading.Thread(target=answer_garbage, daemon=True).start()
+        with StubServer() as server:
+            self.assertTrue(get_many([(closed_url, {"pressure": True}),
+                                      (server.url(), {"pressure": True}),
+                                      (garbage_url, {"pressure": True})]) ==
+                            ["CONNECTION_ERROR", "The pressure is 1012hPa.  ",
+                             "CONNECTION_ERROR"])
+        garbage.close()
+
+    def test_cancel(self):
+        with StubServer(latency=0.5) as server:
+            loop = asyncio.new_event_loop()
+            client = AsyncWeatherClient()
+            task = loop.create_task(client.get_many([(server.url(), ALL_FLAGS)] * 3))
+            loop.call_later(0.1, task.cancel)
+            with self.assertRaises(asyncio.CancelledError):
+                loop.run_until_complete(task)
+            loop.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# This will test the response cache
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from weather_cache import ResponseCache, cache_key
+
+
+def _fill_cache(path, worker):
+    # Run in another process, to check processes can share the cache file
+    cache = ResponseCache(path)
+    for number in range(50):
+        url = "http://api.openweathermap.org/data/2.5/weather?id=" + str(number)
+        cache.put(url, {"worker": worker})
+        cache.get(url)
+
+
+class ResponseCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cache_key(self):
+        # The api key and the order of the arguments don't matter
+        self.assertTrue(cache_key("http://API.openweathermap.org/data/2.5/weather?id=5&APPID=a")
+                        == cache_key("http://api.openweathermap.org/data/2.5/weather?appid=b&id=5"))
+        self.assertTrue(cache_key("http://api.openweathermap.org/data/2.5/weather?id=5")
+                        != cache_key("http://api.openweathermap.org/data/2.5/weather?id=6"))
+
+    def test_hit_and_miss(self):
+        cache = ResponseCache(self.path)
+        self.assertTrue(cache.get("http://a/weather?id=5&APPID=1") is None)
+        cache.put("http://a/weather?id=5&APPID=1", {"main": {"pressure": 1000}})
+        self.assertTrue(cache.get("http://a/weather?id=5&APPID=2") == {"main": {"pressure": 1000}})
+        stats = cache.stats()
+        self.assertTrue((stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1))
+
+    @patch('weather_cache.time')
+    def test_expiry(self, mock_time):
+        cache = ResponseCache(self.path, ttl=600)
+        mock_time.time.return_value = 1000
+        cache.put("http://a/weather?id=5", {"test": 0})
+        mock_time.time.return_value = 1599
+        self.assertTrue(cache.get("http://a/weather?id=5") == {"test": 0})
+        mock_time.time.return_value = 1601
+        self.assertTrue(cache.get("http://a/weather?id=5") is None)
+
+    @patch('weather_cache.time')
+    def test_stale(self, mock_time):
+        cache = ResponseCache(self.path, ttl=600, max_stale=300)
+        mock_time.time.return_value = 1000
+        cache.put("http://a/weather?id=5", {"test": 0})
+        mock_time.time.return_value = 1300
+        self.assertTrue(cache.get_stale("http://a/weather?id=5") == ({"test": 0}, 300))
+        mock_time.time.return_value = 1700  # Expired, but still within max_stale
+        self.assertTrue(cache.get("http://a/weather?id=5") is None)
+        self.assertTrue(cache.get_stale("http://a/weather?id=5") == ({"test": 0}, 700))
+        mock_time.time.return_value = 1901  # Too old to be shown at all
+        self.assertTrue(cache.get_stale("http://a/weather?id=5") == (None, None))
+        self.assertTrue(cache.stats()["stale"] == 2)
+        # Stale responses aren't served unless asked for
+        self.assertTrue(ResponseCache(self.path).get_stale("http://a/weather?id=5") ==
+                        (None, None))
+
+    @patch('weather_cache.time')
+    def test_lru_eviction(self, mock_time):
+        cache = ResponseCache(self.path, max_entries=2)
+        for now, city in [(1, "1"), (2, "2")]:
+            mock_time.time.return_value = now
+            cache.put("http://a/weather?id=" + city, {"id": city})
+        mock_time.time.return_value = 3
+        cache.get("http://a/weather?id=1")  # 2 is now the least recently used
+        mock_time.time.return_value = 4
+        cache.put("http://a/weather?id=3", {"id": "3"})
+        self.assertTrue(cache.get("http://a/weather?id=2") is None)
+        self.assertTrue(cache.get("http://a/weather?id=1") == {"id": "1"})
+        self.assertTrue(cache.stats()["evictions"] == 1)
+
+    def test_shared_between_processes(self):
+        ResponseCache(self.path)  # Create the file before the processes race to
+        processes = [multiprocessing.Process(target=_fill_cache, args=(self.path, worker))
+                     for worker in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertTrue(process.exitcode == 0)
+        stats = ResponseCache(self.path).stats()
+        self.assertTrue(stats["entries"] == 50)
+        self.assertTrue(stats["hits"] == 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+# This will test the NumPy bulk rendering path against format_weather
+import random
+import unittest
+from unittest.mock import patch
+
+import weather_columnar
+from weather_forecast import format_weather
+from weather_stub_server import SAMPLE_WEATHER
+
+
+def make_response(generator):
+    # A response with a mix of ints and floats, as the api sends
+    return {"timezone": generator.choice([-18000, 0, 3600, 7200, 19800.0]),
+            "sys": {"sunrise": generator.randint(-86400, 2 ** 31),
+                    "sunset": generator.choice([1571182970, 1571182970.5])},
+            "main": {"pressure": generator.choice([1012, 1013.5]),
+                     "humidity": generator.randint(0, 100),
+                     "temp_max": generator.choice([300, 273.2, generator.uniform(230, 320)]),
+                     "temp_min": generator.uniform(230, 320)},
+            "clouds": {"all": generator.randint(0, 100)},
+            "wind": {"speed": generator.choice([20, generator.uniform(0, 40)]),
+                     "deg": generator.randint(0, 360)}}
+
+
+@unittest.skipIf(weather_columnar.numpy is None, "numpy is not installed")
+class ColumnarTests(unittest.TestCase):
+
+    def test_same_as_format_weather(self):
+        generator = random.Random(0)
+        responses = [make_response(generator) for _ in range(2000)] + [SAMPLE_WEATHER]
+        for user_input in [{"time": True, "sunrise": True, "sunset": True, "pressure": True,
+                            "cloud": True, "humidity": True, "wind": True, "temp": "Fahrenheit"},
+                           {"temp": "celsius"}, {"sunset": True}, {"api": "test"}]:
+            self.assertTrue(weather_columnar.render_bulk(responses, user_input) ==
+                            [format_weather(weather_json, user_input)
+                             for weather_json in responses])
+
+    def test_round_ties(self):
+        # Values that are exactly half way after scaling by 10 are where NumPy and python
+        # can disagree
+        values = [0.15, 0.25, 0.35, 2.675, -0.15, 26.85, 1e15 + 0.25] + \
+                 [tenth / 100 + 0.05 for tenth in range(-1000, 1000)]
+        rounded = weather_columnar.round_1(weather_columnar.numpy.array(values)).tolist()
+        self.assertTrue(rounded == [round(value, 1) for value in values])
+
+    def test_only_needed_columns(self):
+        columns = weather_columnar.collect([{"main": {"pressure": 1000}}], {"pressure": True})
+        self.assertTrue(list(columns) == ["pressure"])
+
+
+class ColumnarWithoutNumpyTests(unittest.TestCase):
+
+    @patch('weather_columnar.numpy', None)
+    def test_needs_numpy(self):
+        with self.assertRaises(ImportError):
+            weather_columnar.render_bulk([SAMPLE_WEATHER], {"time": True})
+
+
+if __name__ == "__main__":
+    unittest.main()
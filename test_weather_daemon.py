@@ -0,0 +1,134 @@
+# This will test the long running server and its client
+import errno
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+from weather_daemon import forward, make_server, parse_address
+from weather_forecast import InputParser, add_api_key, run_query
+
+
+class WeatherDaemonTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, "weather.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def start(self, address, run):
+        server = make_server(address, run)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_parse_address(self):
+        self.assertTrue(parse_address("127.0.0.1:8080")[1] == ("127.0.0.1", 8080))
+        self.assertTrue(parse_address("/tmp/weather.sock")[1] == "/tmp/weather.sock")
+
+    def test_forward_unix(self):
+        self.start(self.address, lambda args: " ".join(args))
+        self.assertTrue(forward(self.address, ["-cid", "5", "-time"]) == "-cid 5 -time")
+
+    def test_address_in_use(self):
+        # A file that isn't a socket, or the socket of a server still running, is left alone
+        with open(self.address, "w", encoding="utf-8") as other_file:
+            other_file.write("keep me")
+        with self.assertRaises(OSError) as raised:
+            make_server(self.address, lambda args: "")
+        self.assertTrue(raised.exception.errno == errno.EADDRINUSE)
+        with open(self.address, encoding="utf-8") as other_file:
+            self.assertTrue(other_file.read() == "keep me")
+        os.remove(self.address)
+        self.start(self.address, lambda args: "first")
+        with self.assertRaises(OSError) as raised:
+            make_server(self.address, lambda args: "second")
+        self.assertTrue(raised.exception.errno == errno.EADDRINUSE)
+        self.assertTrue(forward(self.address, []) == "first")
+
+    def test_stale_socket(self):
+        # A socket nothing is listening on any more is replaced
+        left_over = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        left_over.bind(self.address)
+        left_over.close()
+        self.start(self.address, lambda args: "new")
+        self.assertTrue(forward(self.address, []) == "new")
+
+    def test_query_errors(self):
+        # A query that fails while running isn't reported as a request that can't be read
+        def broken(args):
+            raise KeyError(args[0])
+        self.start(self.address, broken)
+        self.assertTrue(forward(self.address, ["-cid"]) ==
+                        "ERROR: The query could not be run (KeyError)")
+        family, address = parse_address(self.address)
+        with socket.socket(family, socket.SOCK_STREAM) as connection:
+            connection.connect(address)
+            connection.sendall(b'{"argz": []}\n')
+            with connection.makefile("rb") as answer:
+                self.assertTrue(answer.readline() == b'{"output": "ERROR: The request to the '
+                                                     b'server could not be read"}\n')
+
+    def test_forward_tcp(self):
+        server = self.start("127.0.0.1:0", lambda args: " ".join(args))
+        address = "127.0.0.1:" + str(server.server_address[1])
+        self.assertTrue(forward(address, ["-help"]) == "-help")
+
+    def test_concurrent_clients(self):
+        def slow(args):
+            time.sleep(0.2)
+            return args[0]
+        self.start(self.address, slow)
+        results = {}
+        threads = [threading.Thread(target=lambda number=number: results.update(
+            {number: forward(self.address, [str(number)])})) for number in range(10)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(time.monotonic() - start < 1)  # Not one after another
+        self.assertTrue(results == {number: str(number) for number in range(10)})
+
+    @patch('weather_forecast.requests')
+    def test_runs_queries(self, mock_requests):
+        test_mock = Mock()
+        test_mock.status_code = 200
+        test_mock.json.return_value = {"main": {"pressure": 1000}}
+        mock_requests.get.return_value = test_mock
+        shared = InputParser()
+        self.start(self.address, lambda args: run_query(add_api_key(args, "test"), shared))
+        self.assertTrue(forward(self.address, ["-cid", "5", "-pressure"]) ==
+                        "The pressure is 1000hPa.  ")
+        self.assertTrue(forward(self.address, ["-cid", "5"]).startswith("ERROR"))
+
+    def test_command_line(self):
+        folder = os.path.dirname(os.path.abspath(__file__))
+        server = subprocess.Popen([sys.executable, os.path.join(folder, "weather_forecast.py"),
+                                   "-api", "test", "-serve", self.address])
+        try:
+            for _ in range(100):  # Wait for the server to start listening
+                if os.path.exists(self.address):
+                    break
+                time.sleep(0.05)
+            output = subprocess.check_output([sys.executable,
+                                              os.path.join(folder, "weather_daemon.py"),
+                                              self.address, "-help"])
+            self.assertTrue(output.decode("utf-8").startswith("usage:"))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,20 @@
 # This will test the weather forecasting file
 from weather_forecast import *
+import argparse
+import datetime
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
+import weather_forecast
 from unittest.mock import patch
 from unittest.mock import Mock
+from weather_cache import ResponseCache
+from weather_stub_server import StubServer, SAMPLE_WEATHER
+import threading
+import time
 
 
 class WeatherForecastTests(unittest.TestCase):
@@ -245,6 +257,527 @@ class WeatherForecastTests(unittest.TestCase):
                                                        "26.9 and a low of 6.9 degrees celsius.  ")
 
 
+    @patch('weather_forecast.requests')
+    def test_run_batch(self, mock_requests):
+        test_mock = Mock()
+        test_mock.status_code = 200
+        test_mock.json.return_value = {"main": {"pressure": 1000}}
+        mock_requests.get.return_value = test_mock
+        results = dict(run_batch(["-cid 5 -pressure", "-city 'New York' -pressure", "-cid 5"],
+                                 "test", workers=2, group=False))
+        self.assertTrue(results["-cid 5 -pressure"] == "The pressure is 1000hPa.  ")
+        self.assertTrue(results["-city 'New York' -pressure"] == "The pressure is 1000hPa.  ")
+        self.assertTrue(results["-cid 5"].startswith("ERROR"))  # No information flags
+        mock_requests.get.assert_any_call(
+            url="http://api.openweathermap.org/data/2.5/weather?q=New York&APPID=test",
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+
+    @patch('weather_forecast.requests')
+    def test_run_batch_unreadable(self, mock_requests):
+        # A line with a quote that isn't closed is an error, and the rest still run
+        test_mock = Mock()
+        test_mock.status_code = 200
+        test_mock.json.return_value = {"main": {"pressure": 1000}}
+        mock_requests.get.return_value = test_mock
+        lines = ['-city "New York -pressure', "-cid 5 -pressure", "-cid 6 -pressure"]
+        results = dict(run_batch(lines, "test", workers=2, group=False))
+        self.assertTrue(results == {'-city "New York -pressure':
+                                    "ERROR: The arguments could not be read",
+                                    "-cid 5 -pressure": "The pressure is 1000hPa.  ",
+                                    "-cid 6 -pressure": "The pressure is 1000hPa.  "})
+
+    @patch('weather_forecast.requests')
+    def test_run_batch_bad_response(self, mock_requests):
+        # A response that can't be decoded, or lacks what a line asks for, is an error for
+        # the lines that needed it, and the rest of the batch still runs
+        good, undecodable = Mock(status_code=200), Mock(status_code=200)
+        good.json.return_value = {"main": {"pressure": 1000}}
+        undecodable.json.side_effect = ValueError("Not JSON")
+        mock_requests.get.side_effect = lambda url, **_: undecodable if "q=Bad" in url \
+            else good
+        lines = ["-city Bad -pressure", "-city Good -pressure", "-city Good -wind"]
+        results = dict(run_batch(lines, "test", workers=2, group=False))
+        self.assertTrue(results == {"-city Bad -pressure": UNREADABLE_RESPONSE,
+                                    "-city Good -pressure": "The pressure is 1000hPa.  ",
+                                    "-city Good -wind": UNREADABLE_RESPONSE})
+
+    @patch('weather_forecast.requests')
+    def test_run_group_bad_response(self, mock_requests):
+        group = Mock(status_code=200)
+        group.json.return_value = {"list": [{"id": 1, "main": {"pressure": 1001}},
+                                            {"id": 2}]}
+        mock_requests.get.return_value = group
+        results = dict(run_batch(["-cid 1 -pressure", "-cid 2 -pressure"], "test", workers=2))
+        self.assertTrue(results == {"-cid 1 -pressure": "The pressure is 1001hPa.  ",
+                                    "-cid 2 -pressure": UNREADABLE_RESPONSE})
+        group.json.side_effect = ValueError("Not JSON")
+        results = dict(run_batch(["-cid 1 -pressure", "-cid 2 -pressure"], "test", workers=2))
+        self.assertTrue(results == {"-cid 1 -pressure": UNREADABLE_RESPONSE,
+                                    "-cid 2 -pressure": UNREADABLE_RESPONSE})
+
+    def test_workers(self):
+        for args in [["-api", "test", "-batch", "-", "-workers", "0"],
+                     ["-api", "test", "-batch", "-", "-workers", "-2"]]:
+            with patch("sys.stderr"), self.assertRaises(SystemExit):
+                InputParser().get_input(args)
+        self.assertTrue(InputParser().get_input(["-api", "test", "-batch", "-", "-workers",
+                                                 "1"])["workers"] == 1)
+
+    def test_read_batch(self):
+        lines = list(read_batch(["-cid 5 -time\n", "\n", "# a comment\n", " -z 1234 -wind \n"]))
+        self.assertTrue(lines == ["-cid 5 -time", "-z 1234 -wind"])
+
+    def test_describe_result(self):
+        self.assertTrue(describe_result("BAD_API") == "The api key is invalid!")
+        self.assertTrue(describe_result("LOCATION_UNKNOWN") ==
+                        "The location entered cannot be found!")
+        self.assertTrue(describe_result(500) == "A value was entered incorrectly")
+        self.assertTrue(describe_result("The pressure is 1000hPa.  ") ==
+                        "The pressure is 1000hPa.  ")
+
+    @patch('weather_forecast.requests')
+    def test_get_from_url_cached(self, mock_requests):
+        test_mock = Mock()
+        test_mock.status_code = 200
+        test_mock.json.return_value = {"main": {"pressure": 1000}}
+        mock_requests.get.return_value = test_mock
+        cache = Mock()
+        cache.get.return_value = None
+        cache.get_stale.return_value = (None, None)
+        test_parser = InputParser(cache)
+        test_parser.user_input = {"api": "test", "cid": "5", "pressure": True}
+        self.assertTrue(test_parser.get_from_url("url") == "The pressure is 1000hPa.  ")
+        cache.put.assert_called_once_with("url", {"main": {"pressure": 1000}})
+
+        cache.get.return_value = {"main": {"pressure": 900}}  # Now it is cached
+        self.assertTrue(test_parser.get_from_url("url") == "The pressure is 900hPa.  ")
+        self.assertTrue(mock_requests.get.call_count == 1)
+
+    def test_get_from_url_stale(self):
+        directory = tempfile.mkdtemp()
+        cache = ResponseCache(os.path.join(directory, "cache.sqlite"), ttl=0, max_stale=60)
+        client = WeatherClient(retries=0)
+        try:
+            with StubServer() as server:
+                test_parser = InputParser(cache, client)
+                test_parser.user_input = {"api": "test", "cid": "5", "pressure": True}
+                self.assertTrue(test_parser.get_from_url(server.url()) ==
+                                "The pressure is 1012hPa.  ")
+                # Expired at once, so the next query is answered from the cache, marked
+                # as old, while it is fetched again in the background
+                server.status = 500
+                self.assertTrue(test_parser.get_from_url(server.url()) ==
+                                "The pressure is 1012hPa.  "
+                                "This is from 0 minutes ago and is being updated.  ")
+                for _ in range(100):
+                    if len(server.paths) == 2:
+                        break
+                    time.sleep(0.01)
+                self.assertTrue(len(server.paths) == 2)
+            # With the server gone, the last good response is still shown
+            self.assertTrue(test_parser.get_from_url(server.url()).endswith(
+                "is being updated.  "))
+            self.assertTrue(cache.stats()["stale"] == 2)
+            for _ in range(100):  # Let the last refresh give up before closing the client
+                if not weather_forecast._REVALIDATING:
+                    break
+                time.sleep(0.01)
+        finally:
+            client.close()
+            shutil.rmtree(directory)
+
+    def test_revalidate_bounded(self):
+        # Many stale responses are refreshed a few at a time, and past a limit not at all
+        lock = threading.Lock()
+        running = [0, 0]  # Now, and the most at once
+
+        def slow_fetch(*_):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+        with patch.object(weather_forecast, "fetch", side_effect=slow_fetch), \
+                patch.object(weather_forecast, "MAX_REVALIDATE_QUEUE", 12):
+            refreshes = [revalidate("url" + str(number)) for number in range(15)]
+            self.assertTrue(revalidate("url0") is None)  # Already being refreshed
+            self.assertTrue(refreshes[12:] == [None] * 3)
+            for refresh in refreshes[:12]:
+                refresh.result(timeout=5)
+        self.assertTrue(running[1] == weather_forecast.MAX_REVALIDATING)
+        self.assertTrue(not weather_forecast._REVALIDATING)
+
+    def test_revalidate_exit(self):
+        # The program waits at exit for a quick refresh, but not long for a slow one
+        release = threading.Event()
+
+        def fetch_after(url, *_):
+            if url == "slow":
+                release.wait(5)
+        with patch.object(weather_forecast, "fetch", side_effect=fetch_after), \
+                patch.object(weather_forecast, "REVALIDATE_EXIT_WAIT", 0.2):
+            quick = revalidate("quick")
+            slow = revalidate("slow")
+            started = time.perf_counter()
+            weather_forecast._finish_revalidating()
+            self.assertTrue(time.perf_counter() - started < 1)
+            self.assertTrue(quick.done() and not slow.done())
+            release.set()
+            slow.result(timeout=5)
+        self.assertTrue(not weather_forecast._REVALIDATING)
+
+    def test_client_reuses_connections(self):
+        with StubServer() as server:
+            client = WeatherClient(pool_size=2)
+            test_parser = InputParser(client=client)
+            test_parser.user_input = {"api": "test", "cid": "5", "pressure": True}
+            for _ in range(5):
+                self.assertTrue(test_parser.get_from_url(server.url()) ==
+                                "The pressure is 1012hPa.  ")
+            self.assertTrue(client.stats() ==
+                            {"requests": 5, "retries": 0, "connections": 1, "reused": 4,
+                             "coalesced": 0, "hedged": 0, "hedge_wins": 0})
+            client.close()
+
+    def test_client_hedge(self):
+        class FirstSlow(StubServer):
+            def delay(self):
+                return 0.3 if len(self.paths) == 1 else 0  # Only the first request is slow
+
+        user_input = {"api": "test", "cid": "5", "pressure": True}
+        with FirstSlow() as server:
+            client = WeatherClient(hedge_delay=0.02, hedge_budget=1.0)
+            test_parser = InputParser(client=client)
+            test_parser.user_input = user_input
+            started = time.monotonic()
+            self.assertTrue(test_parser.get_from_url(server.url()) == "The pressure is 1012hPa.  ")
+            self.assertTrue(time.monotonic() - started < 0.25)  # The hedge answered first
+            stats = client.stats()
+            self.assertTrue((stats["requests"], stats["hedged"], stats["hedge_wins"]) == (2, 1, 1))
+            client.close()
+
+        # Without budget, or without quota to spare, the slow request is waited for.  The
+        # default budget doesn't allow hedging the first request
+        quota = weather_quota.QuotaScheduler(rate=60, burst=1, max_wait=0)
+        for client in [WeatherClient(hedge_delay=0.02, hedge_budget=0),
+                       WeatherClient(hedge_delay=0.02),
+                       WeatherClient(hedge_delay=0.02, hedge_budget=1.0, quota=quota)]:
+            with FirstSlow() as server:
+                test_parser = InputParser(client=client)
+                test_parser.user_input = user_input
+                self.assertTrue(test_parser.get_from_url(server.url()) ==
+                                "The pressure is 1012hPa.  ")
+                self.assertTrue(client.stats()["hedged"] == 0)
+                self.assertTrue(len(server.paths) == 1)
+                client.close()
+
+    def test_hedge_budget(self):
+        # A hedge is only sent if, counting it, hedges stay within the budget's share
+        client = WeatherClient(hedge_delay=0.02, hedge_budget=0.05)
+        client.request_count = 18
+        self.assertTrue(not client._may_hedge("test"))
+        client.request_count = 19
+        self.assertTrue(client._may_hedge("test"))
+        self.assertTrue((client.hedge_count, client.request_count) == (1, 20))
+        self.assertTrue(not client._may_hedge("test"))
+        client.close()
+
+    def test_hedge_p95(self):
+        client = WeatherClient(hedge_delay=HEDGE_P95)
+        self.assertTrue(client._hedge_after() is None)  # Too few requests seen to know
+        client._latencies.extend([number / 100 for number in range(1, 21)])
+        self.assertTrue(client._hedge_after() == 0.2)
+        client._latencies.extend([0.01] * 180)
+        self.assertTrue(client._hedge_after() == 0.11)
+        self.assertTrue(WeatherClient(hedge_delay=0.5)._hedge_after() == 0.5)
+        self.assertTrue(parse_hedge_delay("p95") == HEDGE_P95)
+        self.assertTrue(parse_hedge_delay("1.5") == 1.5)
+
+    def test_client_quota(self):
+        with StubServer() as server:
+            quota = weather_quota.QuotaScheduler(rate=60, burst=2, max_wait=0)
+            test_parser = InputParser(client=WeatherClient(quota=quota))
+            test_parser.user_input = {"api": "test", "cid": "5", "pressure": True}
+            for _ in range(2):
+                self.assertTrue(test_parser.get_from_url(server.url()) ==
+                                "The pressure is 1012hPa.  ")
+            # The limit is used up, so the third call fails without reaching the server
+            self.assertTrue(test_parser.get_from_url(server.url()) == "QUOTA_EXCEEDED")
+            self.assertTrue(len(server.paths) == 2)
+            self.assertTrue(describe_result("QUOTA_EXCEEDED") ==
+                            "The api key's call limit has been reached, try again later!")
+            self.assertTrue(url_api_key(server.url("id=5&APPID=secret")) == "secret")
+
+    def test_stub_errors(self):
+        # The stub fails requests like the real api, which the client reports by name
+        test_parser = InputParser(client=WeatherClient(retries=0))
+        test_parser.user_input = {"api": "test", "cid": "5", "pressure": True}
+        for status, result in [(401, "BAD_API"), (404, "LOCATION_UNKNOWN"), (429, 429),
+                               (500, 500)]:
+            with StubServer(error_rates={status: 1.0}) as server:
+                self.assertTrue(test_parser.get_from_url(server.url()) == result)
+        with StubServer(error_rates={500: 0.5}, padding=5000, seed=1) as server:
+            results = [test_parser.get_from_url(server.url()) for _ in range(40)]
+            self.assertTrue(0 < results.count(500) < 40)
+            self.assertTrue(results.count("The pressure is 1012hPa.  ") + results.count(500) == 40)
+
+    def test_client_timeout(self):
+        with StubServer(latency=0.5) as server:
+            test_parser = InputParser(client=WeatherClient(read_timeout=0.1))
+            test_parser.user_input = {"api": "test", "cid": "5", "pressure": True}
+            self.assertTrue(test_parser.get_from_url(server.url()) == "TIMEOUT")
+
+    @patch('weather_forecast.time')
+    def test_client_retries(self, mock_time):
+        busy = Mock(status_code=429, headers={"Retry-After": "2"})
+        failed = Mock(status_code=503, headers={})
+        okay = Mock(status_code=200, headers={})
+        client = WeatherClient(retries=3, backoff=0.5)
+        client.session = Mock()
+        client.session.get.side_effect = [busy, failed, okay]
+        self.assertTrue(client.get("url") is okay)
+        self.assertTrue(client.retry_count == 2)
+        delays = [call[0][0] for call in mock_time.sleep.call_args_list]
+        self.assertTrue(delays[0] == 2)  # Retry-After is honoured
+        self.assertTrue(0.5 <= delays[1] <= 1.5)  # Second retry backs off from 1 second
+
+        client.session.get.side_effect = [failed] * 5
+        self.assertTrue(client.get("url") is failed)  # Gives up after the last retry
+        self.assertTrue(client.session.get.call_count == 7)
+
+        # A server asking for a wait longer than MAX_RETRY_WAIT gets its answer back at once
+        mock_time.sleep.reset_mock()
+        closed = Mock(status_code=429, headers={"Retry-After": "3600"})
+        client.session.get.side_effect = [closed, okay]
+        self.assertTrue(client.get("url") is closed)
+        self.assertTrue(not mock_time.sleep.called)
+        # Backing off never waits longer than it either
+        client = WeatherClient(retries=3, backoff=MAX_RETRY_WAIT)
+        client.session = Mock()
+        client.session.get.side_effect = [failed, failed, okay]
+        self.assertTrue(client.get("url") is okay)
+        self.assertTrue(all(call[0][0] <= MAX_RETRY_WAIT
+                            for call in mock_time.sleep.call_args_list))
+
+    def test_plan_groups(self):
+        city_ids = [str(city) for city in range(45)] + ["3", "7"]  # Repeats are fetched once
+        groups = plan_groups(city_ids)
+        self.assertTrue([len(group) for group in groups] == [20, 20, 5])
+        self.assertTrue(group_url(groups[2], "test") ==
+                        "http://api.openweathermap.org/data/2.5/group?id=40,41,42,43,44&APPID=test")
+
+    def test_split_group(self):
+        group_json = {"cnt": 2, "list": [{"id": 5, "sys": {"timezone": 3600}},
+                                         {"id": 6, "timezone": 0, "sys": {}}]}
+        responses = split_group(group_json)
+        self.assertTrue(sorted(responses) == ["5", "6"])
+        self.assertTrue(responses["5"]["timezone"] == 3600)
+
+    @patch('weather_forecast.requests')
+    def test_run_batch_group(self, mock_requests):
+        test_mock = Mock()
+        test_mock.status_code = 200
+        test_mock.json.side_effect = lambda: {"list": [
+            {"id": city, "main": {"pressure": 1000 + city}, "timezone": 3600}
+            for city in range(1, 30)]}
+        mock_requests.get.return_value = test_mock
+        lines = ["-cid " + str(city) + " -pressure" for city in range(1, 26)] + \
+                ["-cid 1 -time", "-cid 99 -time"]
+        results = dict(run_batch(lines, "test", workers=2))
+        self.assertTrue(mock_requests.get.call_count == 2)  # 26 cities in 2 calls
+        self.assertTrue(results["-cid 25 -pressure"] == "The pressure is 1025hPa.  ")
+        self.assertTrue(results["-cid 1 -time"] == "The timezone is 1 hour past GMT.  ")
+        self.assertTrue(results["-cid 99 -time"] == "The location entered cannot be found!")
+
+    @patch('weather_forecast.requests')
+    def test_run_batch_group_bad_id(self, mock_requests):
+        # An ID that isn't a number is sent on its own, not in the group call
+        group, unknown = Mock(status_code=200), Mock(status_code=404)
+        group.json.side_effect = lambda: {"list": [
+            {"id": city, "main": {"pressure": 1000 + city}} for city in range(1, 3)]}
+        mock_requests.get.side_effect = lambda url, **_: group if url.startswith(GROUP_URL) \
+            else unknown
+        results = dict(run_batch(["-cid 1 -pressure", "-cid abc -pressure", "-cid 2 -pressure"],
+                                 "test", workers=2))
+        self.assertTrue(results["-cid 2 -pressure"] == "The pressure is 1002hPa.  ")
+        self.assertTrue(results["-cid abc -pressure"] == "The location entered cannot be found!")
+        urls = sorted(call[1]["url"] for call in mock_requests.get.call_args_list)
+        self.assertTrue(urls == [GROUP_URL + "id=1,2&APPID=test",
+                                 BASE_URL + "id=abc&APPID=test"])
+
+    @patch('weather_forecast.argparse')
+    def test_synthesise_request_city_index(self, mock_argparse):
+        self.myMock.parse_args.return_value = argparse.Namespace(api='test', city='London,GB',
+                                                                 time=True)
+        mock_argparse.ArgumentParser.return_value = self.myMock
+        city_index = Mock()
+        city_index.resolve.return_value = 2643743
+        test_parser = InputParser(city_index=city_index)
+        test_parser.get_input()
+        self.assertTrue(test_parser.synthesise_request()[1] ==
+                        "http://api.openweathermap.org/data/2.5/weather?id=2643743&APPID=test")
+        city_index.resolve.return_value = None  # Unknown or ambiguous, so leave it to the api
+        self.assertTrue(test_parser.synthesise_request()[1] ==
+                        "http://api.openweathermap.org/data/2.5/weather?q=London,GB&APPID=test")
+
+    @patch('weather_forecast.argparse')
+    def test_synthesise_request_snap(self, mock_argparse):
+        self.myMock.parse_args.return_value = argparse.Namespace(api='test', gc='51.5,-0.12',
+                                                                 time=True)
+        mock_argparse.ArgumentParser.return_value = self.myMock
+        spatial_index = Mock()
+        spatial_index.snap.return_value = 2643743
+        test_parser = InputParser(spatial_index=spatial_index)
+        test_parser.get_input()
+        self.assertTrue(test_parser.synthesise_request()[1] ==
+                        "http://api.openweathermap.org/data/2.5/weather?id=2643743&APPID=test")
+        spatial_index.snap.assert_called_once_with(51.5, -0.12)
+        spatial_index.snap.return_value = None  # No city close enough
+        self.assertTrue(test_parser.synthesise_request()[1] ==
+                        "http://api.openweathermap.org/data/2.5/weather?lat=51.5&lon=-0.12"
+                        "&APPID=test")
+
+    def test_single_flight(self):
+        flights = SingleFlight()
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.2)
+            return "result"
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flights.do("key", work)))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(len(calls) == 1)
+        self.assertTrue(results == ["result"] * 10)
+        self.assertTrue(flights.coalesced == 9)
+        self.assertTrue(flights.do("key", lambda: "again") == "again")  # Not kept once done
+
+    def test_single_flight_error(self):
+        flights = SingleFlight()
+        errors = []
+
+        def work():
+            time.sleep(0.2)
+            raise ValueError("failed")
+
+        def call():
+            try:
+                flights.do("key", work)
+            except ValueError as error:
+                errors.append(str(error))
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(errors == ["failed"] * 3)
+
+    def test_client_coalesces(self):
+        with StubServer(latency=0.3) as server:
+            client = WeatherClient()
+            results = {}
+
+            def query(flag):
+                test_parser = InputParser(client=client)
+                test_parser.user_input = {"api": "test", "cid": "5", flag: True}
+                results[flag] = test_parser.get_from_url(server.url())
+            threads = [threading.Thread(target=query, args=(flag,))
+                       for flag in ["pressure", "humidity", "cloud"]]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertTrue(len(server.paths) == 1)  # Only one request reached the server
+            self.assertTrue(results == {"pressure": "The pressure is 1012hPa.  ",
+                                        "humidity": "The humidity is at 81%.  ",
+                                        "cloud": "There is a 90% chance of clouds.  "})
+            self.assertTrue(client.stats()["coalesced"] == 2)
+
+    def test_render_plan(self):
+        user_input = {"api": "test", "cid": "5", "time": True, "sunrise": True, "sunset": True,
+                      "pressure": True, "cloud": True, "humidity": True, "wind": True,
+                      "temp": "Fahrenheit"}
+        plan = compile_render_plan(user_input)
+        self.assertTrue(len(plan) == 8)
+        self.assertTrue(render(plan, SAMPLE_WEATHER) ==
+                        "The timezone is 0 hours before GMT.  The sun rises at 07:40 GMT.  "
+                        "The sun sets at 16:47 GMT.  The pressure is 1012hPa.  "
+                        "There is a 90% chance of clouds.  The humidity is at 81%.  "
+                        "The wind is moving at 14.76km/h, in a direction of 80 degrees.  "
+                        "The temperature has a high of 46.4 and a low of 42.8 degrees "
+                        "fahrenheit.  ")
+        self.assertTrue(render_plan_for(user_input) is render_plan_for(dict(user_input)))
+        self.assertTrue(format_weather({"timezone": -18000}, {"time": True}) ==
+                        "The timezone is 5 hours before GMT.  ")
+
+    def test_render_observation(self):
+        # A compact Observation renders exactly like the response it came from
+        user_input = {"api": "test", "cid": "5", "time": True, "sunrise": True, "sunset": True,
+                      "pressure": True, "cloud": True, "humidity": True, "wind": True,
+                      "temp": "celsius"}
+        self.assertTrue(format_weather(Observation.from_json(SAMPLE_WEATHER), user_input) ==
+                        format_weather(SAMPLE_WEATHER, user_input))
+        self.assertTrue(format_weather(Observation.from_json(SAMPLE_WEATHER, {"wind": True}),
+                                       {"wind": True}) ==
+                        "The wind is moving at 14.76km/h, in a direction of 80 degrees.  ")
+
+    def test_render_clock(self):
+        # Whole seconds skip datetime, so check they agree with it, including before 1970
+        for timestamp in [0, 59, 1571192970, -1, -86399, 2 ** 31 + 12345]:
+            self.assertTrue(format_weather({"sys": {"sunrise": timestamp}}, {"sunrise": True}) ==
+                            "The sun rises at " + datetime.datetime.utcfromtimestamp(timestamp)
+                            .strftime("%H:%M ") + "GMT.  ")
+        self.assertTrue(format_weather({"sys": {"sunset": 1571182970.5}}, {"sunset": True}) ==
+                        "The sun sets at 23:42 GMT.  ")
+
+    def test_quick_parse(self):
+        # The quick parser has to agree with argparse on everything it accepts
+        for args in [["-api", "test", "-city", "London"], ["-help"],
+                     ["-api", "test", "-cid", "5", "-temp", "-wind"],
+                     ["-api", "test", "-temp", "fahrenheit", "-stats"],
+                     ["-api", "test", "-gc", "51.5,-0.1", "-stats", "prometheus"],
+                     ["-api", "test", "-batch", "queries.txt", "-workers", "4", "-ttl", "60",
+                      "-cache", "cache.sqlite", "-retries", "0", "-nogroup"]]:
+            quick = quick_parse(args)
+            self.assertTrue(quick is not None)
+            self.assertTrue(quick == vars(command_parser().parse_args(args)))
+
+        # Anything unusual is left to argparse
+        for args in [["-api", "test", "-city"], ["-api", "test", "-unknown"],
+                     ["-api", "a", "-api", "b"], ["-api", "test", "-help"], ["-city", "Paris"],
+                     ["-api", "-x"], ["-api", "test", "-workers", "many"],
+                     ["-api", "test", "-cache"], ["-api", "test", "-stats", "xml"], ["London"]]:
+            self.assertTrue(quick_parse(args) is None)
+
+        # Every option argparse knows is known to the quick parser too
+        quick_names = set(weather_forecast._QUICK_FLAGS) | set(weather_forecast._QUICK_VALUES) | \
+            set(weather_forecast._QUICK_OPTIONAL)
+        for action in command_parser()._actions:
+            for option in action.option_strings:
+                self.assertTrue(option[1:] in quick_names)
+
+    def test_lazy_imports(self):
+        # Asking for help, or making a mistake, doesn't need the network libraries
+        folder = os.path.dirname(os.path.abspath(__file__))
+        check = ("import runpy, sys\n"
+                 "sys.argv = ['weather_forecast.py'] + sys.argv[1:]\n"
+                 "try:\n"
+                 "    runpy.run_path(%r, run_name='__main__')\n"
+                 "except SystemExit:\n"
+                 "    pass\n"
+                 "sys.stderr.write('requests' in sys.modules and 'IMPORTED' or 'LAZY')\n"
+                 % os.path.join(folder, "weather_forecast.py"))
+        for args in [["-help"], ["-api", "test"]]:
+            finished = subprocess.run([sys.executable, "-c", check] + args,
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.assertTrue(finished.stderr.decode("utf-8").endswith("LAZY"))
+
 
 if __name__ == "__main__":
     unittest.main()
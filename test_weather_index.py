@@ -0,0 +1,83 @@
+# This will test the offline city index
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from weather_index import CityIndex, build_index, build_index_from_file, normalise
+
+
+CITIES = [
+    {"id": 2643743, "name": "London", "state": "", "country": "GB",
+     "coord": {"lon": -0.12574, "lat": 51.50853}},
+    {"id": 6058560, "name": "London", "state": "", "country": "CA",
+     "coord": {"lon": -81.23304, "lat": 42.983391}},
+    {"id": 2643741, "name": "City of London", "state": "", "country": "GB",
+     "coord": {"lon": -0.09184, "lat": 51.51279}},
+    {"id": 2644210, "name": "Liverpool", "state": "", "country": "GB",
+     "coord": {"lon": -2.97794, "lat": 53.410580}},
+    {"id": 3448439, "name": "São Paulo", "state": "", "country": "BR",
+     "coord": {"lon": -46.636108, "lat": -23.547501}},
+    {"id": 2950159, "name": "Berlin", "state": "", "country": "DE",
+     "coord": {"lon": 13.41053, "lat": 52.524368}},
+]
+
+
+class CityIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "city.index")
+        build_index(CITIES, self.path)
+        self.index = CityIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def test_normalise(self):
+        self.assertTrue(normalise("  SÃO   Paulo ") == "sao paulo")
+
+    def test_lookup(self):
+        self.assertTrue(self.index.lookup("london", "gb") == [2643743])
+        self.assertTrue(sorted(self.index.lookup("LONDON")) == [2643743, 6058560])
+        self.assertTrue(self.index.lookup("Sao Paulo", "BR") == [3448439])
+        self.assertTrue(self.index.lookup("Lond") == [])  # Only whole names match
+        self.assertTrue(self.index.lookup("Paris") == [])
+
+    def test_prefix(self):
+        self.assertTrue(self.index.prefix("l") == [("liverpool", "gb", 2644210),
+                                                   ("london", "ca", 6058560),
+                                                   ("london", "gb", 2643743)])
+        self.assertTrue(self.index.prefix("l", "GB", limit=1) == [("liverpool", "gb", 2644210)])
+
+    def test_resolve(self):
+        self.assertTrue(self.index.resolve("London,GB") == 2643743)
+        self.assertTrue(self.index.resolve("Berlin") == 2950159)
+        self.assertTrue(self.index.resolve("London") is None)  # Could be either London
+
+    def test_columns(self):
+        self.assertTrue(len(self.index) == len(CITIES))
+        self.assertTrue(sorted(self.index.column("ids")) == sorted(city["id"] for city in CITIES))
+        self.assertTrue(len(self.index.column("latitudes")) == len(CITIES))
+
+    def test_build_from_gzip(self):
+        gzip_path = os.path.join(self.directory, "city.list.json.gz")
+        with gzip.open(gzip_path, "wt", encoding="utf-8") as city_list:
+            json.dump(CITIES, city_list)
+        self.assertTrue(build_index_from_file(gzip_path, self.path + "2") == len(CITIES))
+        index = CityIndex(self.path + "2")
+        self.assertTrue(index.resolve("Liverpool,GB") == 2644210)
+        index.close()
+
+    def test_not_an_index(self):
+        with open(self.path + "2", "wb") as not_index:
+            not_index.write(b"0" * 64)
+        with self.assertRaises(ValueError):
+            CityIndex(self.path + "2")
+
+
+if __name__ == "__main__":
+    unittest.main()
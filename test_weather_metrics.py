@@ -0,0 +1,86 @@
+# This will test the per phase timings
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+import weather_forecast
+import weather_metrics
+from weather_forecast import InputParser, WeatherClient
+from weather_stub_server import StubServer
+
+
+class MetricsTests(unittest.TestCase):
+
+    def tearDown(self):
+        weather_metrics.disable()
+
+    def test_off_by_default(self):
+        self.assertTrue(weather_metrics.active() is None)
+        self.assertTrue(weather_metrics.start() is None)
+        weather_metrics.record("render", None)  # Does nothing
+
+    def test_histogram(self):
+        metrics = weather_metrics.Metrics(buckets=(0.1, 1.0))
+        for seconds in [0.05, 0.5, 0.5, 5]:
+            metrics.observe("request", seconds, 200)
+        metrics.observe("render", 0.01)
+        snapshot = metrics.snapshot()
+        self.assertTrue(snapshot["request"]["200"]["count"] == 4)
+        self.assertTrue(snapshot["request"]["200"]["buckets"] == [1, 3])
+        self.assertTrue(abs(snapshot["request"]["200"]["sum"] - 6.05) < 1e-9)
+        self.assertTrue(snapshot["render"][""]["buckets"] == [1, 1])
+        self.assertTrue(json.loads(metrics.export("json"))["buckets"] == [0.1, 1.0])
+
+    def test_prometheus(self):
+        metrics = weather_metrics.Metrics(buckets=(0.1, 1.0))
+        metrics.observe("request", 0.5, 404)
+        lines = metrics.export("prometheus").splitlines()
+        self.assertTrue("# TYPE weather_phase_seconds histogram" in lines)
+        self.assertTrue('weather_phase_seconds_bucket{phase="request",status="404",le="0.1"} 0'
+                        in lines)
+        self.assertTrue('weather_phase_seconds_bucket{phase="request",status="404",le="1.0"} 1'
+                        in lines)
+        self.assertTrue('weather_phase_seconds_bucket{phase="request",status="404",le="+Inf"} 1'
+                        in lines)
+        self.assertTrue('weather_phase_seconds_count{phase="request",status="404"} 1' in lines)
+        with self.assertRaises(ValueError):
+            metrics.export("xml")
+
+    def test_query_phases(self):
+        metrics = weather_metrics.enable()
+        test_parser = InputParser(client=WeatherClient(retries=0))
+        test_parser.get_input(["-api", "test", "-cid", "5", "-pressure", "-stats"])
+        self.assertTrue(test_parser.synthesise_request()[0] == "SUCCESS")
+        with StubServer() as server:
+            test_parser.get_from_url(server.url())
+        with StubServer(status=404) as server:
+            test_parser.get_from_url(server.url())
+        phases = metrics.snapshot()
+        for phase in ["parse_args", "is_valid", "synthesise_request", "decode", "render"]:
+            self.assertTrue(phases[phase][""]["count"] == 1)
+        self.assertTrue(phases["request"]["200"]["count"] == 1)
+        self.assertTrue(phases["request"]["404"]["count"] == 1)
+        self.assertTrue(phases["response"]["404"]["count"] == 1)
+
+    def test_stats_forms(self):
+        # Every form argparse accepts turns timing on, not only -stats on its own
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weather_forecast.py")
+        for stats in ["-stats", "-stats=json", "-stat"]:
+            finished = subprocess.run([sys.executable, script, "-api", "test", "-cid", "5",
+                                       stats], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.assertTrue(finished.returncode == 0)
+            phases = json.loads(finished.stderr.decode("utf-8"))["phases"]
+            self.assertTrue(phases["is_valid"]["invalid"]["count"] == 1)
+
+    def test_parser_setup(self):
+        metrics = weather_metrics.enable()
+        weather_forecast._COMMAND_PARSER.clear()  # So it is built again
+        weather_forecast.command_parser()
+        weather_forecast.command_parser()  # Already built
+        self.assertTrue(metrics.snapshot()["parser_setup"][""]["count"] == 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+# This will test the compact observation record
+import unittest
+
+from weather_observation import Observation, ResponseView
+from weather_stub_server import SAMPLE_WEATHER
+
+
+class ObservationTests(unittest.TestCase):
+
+    def test_from_json(self):
+        self.assertTrue(Observation.from_json(SAMPLE_WEATHER) ==
+                        Observation(timezone=0, sunrise=1485762037, sunset=1485794875,
+                                    pressure=1012, clouds=90, humidity=81, wind_speed=4.1,
+                                    wind_deg=80, temp_max=281.15, temp_min=279.15))
+
+    def test_only_wanted_sections(self):
+        # Sections that weren't asked for are skipped, so they needn't be in the response
+        observation = Observation.from_json({"main": {"temp_max": 300, "temp_min": 290}},
+                                            {"api": "test", "temp": "celsius"})
+        self.assertTrue(observation == Observation(temp_max=300, temp_min=290))
+        with self.assertRaises(KeyError):
+            Observation.from_json({"main": {}}, {"pressure": True})
+
+    def test_missing_sections(self):
+        # Without flags, whatever the response has is taken
+        self.assertTrue(Observation.from_json({"wind": {"speed": 2}, "timezone": 3600}) ==
+                        Observation(timezone=3600, wind_speed=2))
+
+    def test_compact(self):
+        observation = Observation.from_json(SAMPLE_WEATHER)
+        self.assertFalse(hasattr(observation, "__dict__"))
+        with self.assertRaises(AttributeError):
+            observation.visibility = 10000
+
+    def test_view(self):
+        view = ResponseView(SAMPLE_WEATHER)
+        observation = Observation.from_json(SAMPLE_WEATHER)
+        for name in Observation.__slots__:
+            self.assertTrue(getattr(view, name) == getattr(observation, name))
+
+
+if __name__ == "__main__":
+    unittest.main()
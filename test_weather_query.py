@@ -0,0 +1,90 @@
+# This will test queries given as values instead of command line arguments
+import unittest
+from unittest.mock import patch
+from unittest.mock import Mock
+
+from weather_forecast import InputParser, get_weather
+from weather_query import InvalidArgumentException, WeatherQuery
+from weather_stub_server import SAMPLE_WEATHER
+
+
+class WeatherQueryTests(unittest.TestCase):
+
+    def test_url(self):
+        self.assertTrue(WeatherQuery("test", "cid", 5, ["time"]).url() ==
+                        "http://api.openweathermap.org/data/2.5/weather?id=5&APPID=test")
+        self.assertTrue(WeatherQuery("test", "city", "London,GB", temp="celsius").url() ==
+                        "http://api.openweathermap.org/data/2.5/weather?q=London,GB&APPID=test")
+        self.assertTrue(WeatherQuery("test", "gc", "51.5,-0.12", ["wind"]).url() ==
+                        "http://api.openweathermap.org/data/2.5/weather?lat=51.5&lon=-0.12"
+                        "&APPID=test")
+        self.assertTrue(WeatherQuery("test", "z", "94040,us", ["cloud"]).url() ==
+                        "http://api.openweathermap.org/data/2.5/weather?zip=94040,us&APPID=test")
+
+    def test_invalid(self):
+        for args, kwargs in [(("", "cid", "5", ["time"]), {}),  # No api key
+                             (("test", "country", "GB", ["time"]), {}),
+                             (("test", "cid", "5"), {}),  # No information asked for
+                             (("test", "cid", "5", ["rain"]), {}),
+                             (("test", "cid", "5"), {"temp": "kelvin"}),
+                             (("test", "gc", "51.5", ["time"]), {})]:
+            with self.assertRaises(InvalidArgumentException):
+                WeatherQuery(*args, **kwargs)
+
+    def test_hashable(self):
+        # The order of the fields and the case of the unit don't make a different query
+        query = WeatherQuery("test", "cid", "5", ["time", "wind"], "Celsius")
+        same = WeatherQuery("test", "cid", 5, ("wind", "time"), "celsius")
+        self.assertTrue(query == same)
+        self.assertTrue(hash(query) == hash(same))
+        self.assertTrue(len({query: 1, same: 2}) == 1)
+        self.assertTrue(query != WeatherQuery("test", "cid", "5", ["time"], "celsius"))
+        with self.assertRaises(AttributeError):
+            query.api = "other"
+        # A changed copy is checked, and hashable, like any other query
+        self.assertTrue(query._replace(fields=["wind"]) ==
+                        WeatherQuery("test", "cid", "5", ["wind"], "celsius"))
+        hash(query._replace(fields=["wind"]))
+        for changes in [{"fields": ["rain"]}, {"api": ""}, {"temp": "kelvin"}]:
+            with self.assertRaises(InvalidArgumentException):
+                query._replace(**changes)
+        with self.assertRaises(InvalidArgumentException):
+            WeatherQuery._make(["test", "gc", "51.5", ["time"], None])
+
+    def test_from_input(self):
+        user_input = {"api": "test", "cid": "5", "time": True, "temp": "fahrenheit",
+                      "workers": 4, "cache": "cache.sqlite"}
+        query = WeatherQuery.from_input(user_input)
+        self.assertTrue(query == WeatherQuery("test", "cid", "5", ["time"], "fahrenheit"))
+        self.assertTrue(query.to_input() == {"api": "test", "cid": "5", "time": True,
+                                             "temp": "fahrenheit"})
+        self.assertTrue(WeatherQuery.from_input(query.to_input()) == query)
+        # The same rules, and messages, as the command line
+        for user_input in [{"api": "test", "cid": "5", "city": "London", "time": True},
+                           {"api": "test", "cid": "5"}, {"help": True}]:
+            with self.assertRaises(InvalidArgumentException) as raised:
+                WeatherQuery.from_input(user_input)
+            parser = InputParser()
+            parser.user_input = user_input
+            if "help" not in user_input:
+                with self.assertRaises(InvalidArgumentException) as checked:
+                    parser.is_valid()
+                self.assertTrue(str(raised.exception) == str(checked.exception))
+
+    @patch('weather_forecast.requests')
+    def test_get_weather(self, mock_requests):
+        response = Mock()
+        response.status_code = 200
+        response.json.return_value = SAMPLE_WEATHER
+        mock_requests.get.return_value = response
+        query = WeatherQuery("test", "cid", "2643743", ["pressure"], "celsius")
+        self.assertTrue(get_weather(query) == "The pressure is 1012hPa.  The temperature has "
+                                              "a high of 8.0 and a low of 6.0 degrees celsius.  ")
+        self.assertTrue(mock_requests.get.call_args[1]["url"] ==
+                        "http://api.openweathermap.org/data/2.5/weather?id=2643743&APPID=test")
+        response.status_code = 401
+        self.assertTrue(get_weather(query) == "BAD_API")
+
+
+if __name__ == "__main__":
+    unittest.main()
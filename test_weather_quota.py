@@ -0,0 +1,70 @@
+# This will test the api call limit
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from weather_quota import QuotaScheduler, QuotaExceeded, INTERACTIVE, BACKGROUND
+
+
+class QuotaTests(unittest.TestCase):
+
+    def test_burst_then_fail_fast(self):
+        quota = QuotaScheduler(rate=60, burst=3, max_wait=0)
+        for _ in range(3):
+            quota.acquire("test")
+        started = time.time()
+        with self.assertRaises(QuotaExceeded) as raised:
+            quota.acquire("test")
+        self.assertTrue(time.time() - started < 0.1)  # It didn't wait for the token
+        self.assertTrue(0 < raised.exception.wait <= 1)
+        self.assertTrue(quota.stats() == {"granted": 3, "rejected": 1})
+
+    def test_waits_for_refill(self):
+        quota = QuotaScheduler(rate=600, burst=1, max_wait=1)  # A token every 0.1 seconds
+        started = time.time()
+        for _ in range(4):
+            quota.acquire("test")
+        self.assertTrue(0.25 <= time.time() - started < 1)
+
+    def test_keys_are_separate(self):
+        quota = QuotaScheduler(rate=60, burst=1, max_wait=0)
+        quota.acquire("first")
+        quota.acquire("second")
+        with self.assertRaises(QuotaExceeded):
+            quota.acquire("first")
+
+    def test_priority(self):
+        quota = QuotaScheduler(rate=120, burst=1, max_wait=5)  # A token every 0.5 seconds
+        quota.acquire("test")
+        order = []
+
+        def call(priority):
+            quota.acquire("test", priority)
+            order.append(priority)
+        background = threading.Thread(target=call, args=(BACKGROUND,))
+        background.start()
+        time.sleep(0.1)  # The batch call is already waiting when the single query arrives
+        interactive = threading.Thread(target=call, args=(INTERACTIVE,))
+        interactive.start()
+        background.join()
+        interactive.join()
+        self.assertTrue(order == [INTERACTIVE, BACKGROUND])
+
+    def test_shared_file(self):
+        # Two schedulers on one file stand in for two processes sharing the limit
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "quota.json")
+            first = QuotaScheduler(rate=60, burst=2, path=path, max_wait=0)
+            second = QuotaScheduler(rate=60, burst=2, path=path, max_wait=0)
+            first.acquire("test")
+            second.acquire("test")
+            with self.assertRaises(QuotaExceeded):
+                first.acquire("test")
+            with open(path, encoding="utf-8") as quota_file:
+                self.assertFalse("test" in quota_file.read())  # Only a hash of the key
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+# This will test snapping coordinates to the nearest city
+import os
+import shutil
+import tempfile
+import unittest
+
+from weather_index import CityIndex, build_index
+from weather_spatial import SpatialIndex, distance_km
+
+
+LATITUDES = [51.50853, 51.51279, 53.41058, 52.524368, -16.5, -16.6]
+LONGITUDES = [-0.12574, -0.09184, -2.97794, 13.41053, 179.9, -179.9]
+CITY_IDS = [2643743, 2643741, 2644210, 2950159, 1, 2]
+
+
+class SpatialIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = SpatialIndex.build(LATITUDES, LONGITUDES, CITY_IDS, cell_degrees=0.1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_distance(self):
+        # London to Berlin is about 930km
+        self.assertTrue(925 < distance_km(51.50853, -0.12574, 52.524368, 13.41053) < 935)
+
+    def test_snap(self):
+        self.assertTrue(self.index.snap(51.509, -0.12) == 2643743)
+        self.assertTrue(self.index.snap(51.5125, -0.095) == 2643741)
+        self.assertTrue(self.index.snap(53.0, -3.0, radius_km=50) == 2644210)
+
+    def test_out_of_range(self):
+        self.assertTrue(self.index.snap(53.0, -3.0, radius_km=10) is None)
+        self.assertTrue(self.index.snap(0, 0) is None)
+
+    def test_across_date_line(self):
+        self.assertTrue(self.index.snap(-16.59, 179.99, radius_km=20) == 2)
+
+    def test_save_and_load(self):
+        path = os.path.join(self.directory, "spatial.index")
+        self.index.save(path)
+        loaded = SpatialIndex.load(path, radius_km=5)
+        self.assertTrue(loaded.radius_km == 5)
+        self.assertTrue(loaded.snap(51.509, -0.12) == 2643743)
+
+    def test_from_city_index(self):
+        path = os.path.join(self.directory, "city.index")
+        build_index([{"id": city_id, "name": str(city_id), "country": "GB",
+                      "coord": {"lat": latitude, "lon": longitude}}
+                     for latitude, longitude, city_id in zip(LATITUDES, LONGITUDES, CITY_IDS)],
+                    path)
+        city_index = CityIndex(path)
+        self.assertTrue(SpatialIndex.from_city_index(city_index).snap(52.52, 13.4) == 2950159)
+        city_index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
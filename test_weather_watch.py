@@ -0,0 +1,148 @@
+# This will test watch mode, which only shows what changed between refreshes
+import copy
+import io
+import json
+import unittest
+
+from weather_forecast import InputParser, format_weather, watch_targets
+from weather_stub_server import SAMPLE_WEATHER
+from weather_watch import Watcher
+
+
+URL = "http://api.openweathermap.org/data/2.5/weather?id=2643743&APPID=test"
+
+
+def later(weather_json, minutes, **main):
+    """
+    :return: A copy of the response observed some minutes later, with new main values
+    """
+    weather_json = copy.deepcopy(weather_json)
+    weather_json["dt"] += minutes * 60
+    weather_json["main"].update(main)
+    return weather_json
+
+
+class WatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.responses = []
+        self.fetched = []
+
+    def fetch(self, url):
+        self.fetched.append(url)
+        return self.responses.pop(0)
+
+    def test_only_changes(self):
+        user_input = {"api": "test", "cid": "2643743", "pressure": True, "temp": "celsius"}
+        watcher = Watcher([("London", URL, user_input)], self.fetch, format_weather)
+        self.responses = [(None, SAMPLE_WEATHER), (None, SAMPLE_WEATHER),
+                          (None, later(SAMPLE_WEATHER, 10, pressure=1009)),
+                          (None, later(SAMPLE_WEATHER, 20, pressure=1009))]
+        # Everything is new the first time
+        self.assertTrue(watcher.poll() == ["London: The pressure is 1012hPa.  The temperature "
+                                           "has a high of 8.0 and a low of 6.0 degrees "
+                                           "celsius."])
+        # The same observation again is skipped
+        self.assertTrue(watcher.poll() == [])
+        self.assertTrue(watcher.unchanged == 1)
+        # Only the pressure changed
+        self.assertTrue(watcher.poll() == ["London: The pressure is 1009hPa."])
+        # A newer observation with the same values has nothing to show
+        self.assertTrue(watcher.poll() == [])
+        self.assertTrue(watcher.unchanged == 1)
+
+    def test_older_observation(self):
+        # A response older than the last one, e.g. from a stale server, is skipped
+        user_input = {"api": "test", "cid": "2643743", "pressure": True}
+        watcher = Watcher([("London", URL, user_input)], self.fetch, format_weather)
+        self.responses = [(None, later(SAMPLE_WEATHER, 10, pressure=1009)),
+                          (None, SAMPLE_WEATHER)]
+        self.assertTrue(len(watcher.poll()) == 1)
+        self.assertTrue(watcher.poll() == [])
+        self.assertTrue(watcher.unchanged == 1)
+
+    def test_json_lines(self):
+        user_input = {"api": "test", "cid": "2643743", "wind": True, "humidity": True}
+        watcher = Watcher([("London", URL, user_input)], self.fetch, format_weather, "json")
+        changed = later(SAMPLE_WEATHER, 10, humidity=70)
+        changed["wind"]["speed"] = 5.2
+        self.responses = [(None, SAMPLE_WEATHER), (None, changed)]
+        first = json.loads(watcher.poll()[0])
+        self.assertTrue(first == {"location": "London", "dt": 1485789600,
+                                  "changes": {"humidity": {"old": None, "new": 81},
+                                              "wind_speed": {"old": None, "new": 4.1},
+                                              "wind_deg": {"old": None, "new": 80}}})
+        second = json.loads(watcher.poll()[0])
+        self.assertTrue(second == {"location": "London", "dt": 1485790200,
+                                   "changes": {"humidity": {"old": 81, "new": 70},
+                                               "wind_speed": {"old": 4.1, "new": 5.2}}})
+
+    def test_errors(self):
+        # An error is shown when it starts, not on every refresh
+        user_input = {"api": "test", "cid": "2643743", "pressure": True}
+        watcher = Watcher([("London", URL, user_input)], self.fetch, format_weather)
+        error = ("The weather service could not be reached!", None)
+        self.responses = [(None, SAMPLE_WEATHER), error, error, (None, SAMPLE_WEATHER)]
+        self.assertTrue(len(watcher.poll()) == 1)
+        self.assertTrue(watcher.poll() == ["London: The weather service could not be reached!"])
+        self.assertTrue(watcher.poll() == [])
+        self.assertTrue(watcher.poll() == [])  # Back, and still the same observation
+
+    def test_bad_responses(self):
+        # A response that can't be decoded, or is missing what was asked for, is an error
+        # for its own location, and the others keep refreshing
+        user_input = {"api": "test", "cid": "2643743", "pressure": True}
+        missing = copy.deepcopy(SAMPLE_WEATHER)
+        del missing["main"]
+        responses = {"good": [(None, SAMPLE_WEATHER),
+                              (None, later(SAMPLE_WEATHER, 10, pressure=1009))],
+                     "missing": [(None, missing), (None, SAMPLE_WEATHER)]}
+
+        def fetch(url):
+            if url == "undecodable":
+                raise ValueError("Expecting value")
+            return responses[url].pop(0)
+        watcher = Watcher([(url, url, user_input) for url in ["undecodable", "missing", "good"]],
+                          fetch, format_weather)
+        self.assertTrue(watcher.poll() == ["undecodable: The response could not be read",
+                                           "missing: The response could not be read",
+                                           "good: The pressure is 1012hPa."])
+        self.assertTrue(watcher.poll() == ["missing: The pressure is 1012hPa.",
+                                           "good: The pressure is 1009hPa."])
+
+    def test_shared_url(self):
+        # Two queries for the same location are fetched once each refresh
+        watcher = Watcher([("a", URL, {"api": "test", "cid": "2643743", "pressure": True}),
+                           ("b", URL, {"api": "test", "cid": "2643743", "time": True})],
+                          self.fetch, format_weather)
+        self.responses = [(None, SAMPLE_WEATHER)]
+        self.assertTrue(watcher.poll() == ["a: The pressure is 1012hPa.",
+                                           "b: The timezone is 0 hours before GMT."])
+        self.assertTrue(self.fetched == [URL])
+
+    def test_run(self):
+        watcher = Watcher([("London", URL, {"api": "test", "cid": "2643743", "cloud": True})],
+                          self.fetch, format_weather)
+        self.responses = [(None, SAMPLE_WEATHER), (None, SAMPLE_WEATHER)]
+        output = io.StringIO()
+        watcher.run(0, rounds=2, output=output)
+        self.assertTrue(output.getvalue() == "London: There is a 90% chance of clouds.\n")
+
+    def test_watch_targets(self):
+        shared = InputParser()
+        shared.get_input(["-api", "test", "-cid", "2643743", "-time", "-watch", "60"])
+        self.assertTrue(watch_targets(shared) == ([("2643743", URL, shared.user_input)], []))
+        targets, errors = watch_targets(shared, ["-cid 5 -wind", "-cid 6"])
+        self.assertTrue([target[:2] for target in targets] ==
+                        [("-cid 5 -wind", "http://api.openweathermap.org/data/2.5/weather?"
+                                          "id=5&APPID=test")])
+        self.assertTrue(len(errors) == 1 and errors[0].startswith("-cid 6\tERROR: "))
+        # A line with a quote that isn't closed is an error, not the end of the watch
+        targets, errors = watch_targets(shared, ['-city "New York -wind', "-cid 5 -wind"])
+        self.assertTrue(len(targets) == 1)
+        self.assertTrue(errors == ['-city "New York -wind\tERROR: The arguments could not be '
+                                   'read'])
+
+
+if __name__ == "__main__":
+    unittest.main()
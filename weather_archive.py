@@ -0,0 +1,511 @@
+"""
+An append-only archive of every observation fetched, kept by column so that questions
+about a long history, such as one city's humidity over the last 30 days or every city
+above some pressure on one day, only read the rows that can answer them.
+
+Each column is a file of fixed-width values, one for each row, and is read through mmap,
+so the archive can be much larger than memory.  Rows are found in two ways:
+ - Each row holds the number of the previous row for the same city, so one city's history
+   is read by walking back from its newest row, without reading anyone else's
+ - Rows are grouped into blocks of BLOCK_ROWS, and the index keeps the smallest and
+   largest value of every column in each block, so a range query skips every block that
+   can't hold a match
+Both are kept without rewriting the index as rows are added: each finished block's zone map
+is appended to the blocks file, and each city's newest row is saved in a fixed-width
+checkpoint when a block finishes and when the archive is closed.  Rows after the last
+checkpoint or finished block, e.g. from a process that was killed, are read from the
+columns and indexed again when the archive is next opened.
+One process writes to an archive at a time, holding a lock on its lock file for as long as
+it has the archive open.  Any number may open it read only
+
+NumPy makes scanning a block much faster, but isn't needed: pip install numpy
+
+Query it with: python weather_archive.py archive -cid 2643743 -field humidity -days 30
+           or: python weather_archive.py archive -field pressure -above 1030 -date 2017-01-30
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows, where an archive can only be read
+    fcntl = None
+
+try:
+    import numpy
+except ImportError:  # Optional, blocks are scanned in python without it
+    numpy = None
+
+from weather_observation import Observation
+
+
+VERSION = 2
+BLOCKS_FILE = "blocks.jsonl"  # A line of JSON with the zone map of each finished block
+LATEST_FILE = "latest.bin"  # The checkpoint of each city's newest row
+LOCK_FILE = "lock"  # Locked by the process writing to the archive
+BLOCK_ROWS = 65536  # Rows in each block of the zone maps
+FLUSH_ROWS = 4096  # Rows added before the columns are written out
+NO_ROW = -1  # The previous row of a city's first row
+FIELD_COLUMNS = list(Observation.__slots__)  # The values, with NaN for a missing value
+# Every column, and the struct format of its values.  A row takes 104 bytes
+COLUMNS = [("dt", "q"), ("city", "q"), ("previous", "q")] + \
+    [(name, "d") for name in FIELD_COLUMNS]
+_STRUCTS = {name: struct.Struct("<" + code) for name, code in COLUMNS}
+_NUMPY_TYPES = {name: {"q": "<i8", "d": "<f8"}[code] for name, code in COLUMNS}
+# The checkpoint is the version and the rows it covers, then a city ID, its newest row and
+# that row's dt for every city
+_CHECKPOINT_HEADER = struct.Struct("<qq")
+_CHECKPOINT_CITY = struct.Struct("<qqq")
+
+
+class ArchiveLocked(Exception):
+    """
+    Raised when an archive is opened for writing while another process is writing to it
+    """
+    def __init__(self, path):
+        Exception.__init__(self)
+        self.path = path
+
+    def __str__(self):
+        return "The archive " + self.path + " is being written by another process"
+
+
+def _number(value):
+    """
+    :return: The value as a float for a field column, or NaN if it isn't a number
+    """
+    if value is None or isinstance(value, bool):
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class ObservationArchive:
+    """
+    Adds observations to the columns, and answers time range queries over them
+    """
+    def __init__(self, path, flush_rows=FLUSH_ROWS, read_only=False):
+        """
+        Opens the archive in a directory, making it if it doesn't exist and is to be
+        written to
+        :param path: The directory holding the columns and the index
+        :param flush_rows: Rows added before they are written out
+        :param read_only: Only query the archive, which doesn't need its lock
+        :raises ArchiveLocked: If another process is writing to the archive
+        :raises ValueError: If the directory holds an archive of another version, or the
+         archive can't be locked on this system
+        """
+        self.path = path
+        self.flush_rows = flush_rows
+        self.read_only = read_only
+        self._lock_file = None
+        self._files = None
+        if not read_only:
+            if fcntl is None:
+                raise ValueError("Writing to an archive needs fcntl")
+            os.makedirs(path, exist_ok=True)
+            self._lock_file = open(os.path.join(path, LOCK_FILE), "a", encoding="utf-8")  # pylint: disable=consider-using-with
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise ArchiveLocked(path) from None
+        self.rows = 0
+        self.latest = {}  # City ID to a (newest row, its dt) tuple
+        self.blocks = []  # For each block, column name to [smallest, largest]
+        self.skipped = 0  # Observations no newer than the last for their city, or with no city
+        self._lock = threading.RLock()
+        self._pending = 0  # Rows added since the last flush
+        self._saved_blocks = 0  # Finished blocks in the blocks file
+        self._checkpoint_rows = 0  # Rows the checkpoint covers
+        self._maps = {}  # Column name to the mmap being read
+        self._mapped_rows = 0
+        self._recover()
+        if not read_only:
+            # Open for as long as the archive is, until close
+            self._files = {name: open(self._column_path(name), "ab")  # pylint: disable=consider-using-with
+                           for name, _ in COLUMNS}
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + ".col")
+
+    def _recover(self):
+        """
+        Reads the checkpoint and the finished blocks' zone maps, then indexes the rows
+        written after them, and cuts off a row or zone map that was only partly written.
+        Read only, the rows are only indexed in memory, and a row still being written is
+        left alone
+        :raises ValueError: If the directory holds an archive of another version
+        """
+        checkpoint_rows, self.latest = _read_checkpoint(os.path.join(self.path, LATEST_FILE),
+                                                        self.path)
+        sizes = [os.path.getsize(self._column_path(name))
+                 if os.path.exists(self._column_path(name)) else 0 for name, _ in COLUMNS]
+        self.rows = min(size // _STRUCTS[name].size for size, (name, _) in zip(sizes, COLUMNS))
+        for size, (name, _) in zip(sizes, COLUMNS):
+            if size > self.rows * _STRUCTS[name].size and not self.read_only:
+                with open(self._column_path(name), "r+b") as column_file:
+                    column_file.truncate(self.rows * _STRUCTS[name].size)
+        if checkpoint_rows > self.rows:  # For rows that are gone, so start it again
+            checkpoint_rows, self.latest = 0, {}
+        self._checkpoint_rows = checkpoint_rows
+        self.blocks = self._read_blocks(self.rows // BLOCK_ROWS)
+        self._saved_blocks = len(self.blocks)
+        if not self.rows:
+            return
+        views = self._views()
+        for row in range(len(self.blocks) * BLOCK_ROWS, self.rows):
+            self._widen(row, [(name, views[name][row]) for name in ["dt"] + FIELD_COLUMNS])
+        cities, dts = views["city"], views["dt"]
+        for row in range(checkpoint_rows, self.rows):
+            self.latest[cities[row]] = (row, dts[row])
+        if not self.read_only:
+            self._save_index()
+
+    def _read_blocks(self, finished):
+        """
+        :param finished: The blocks the columns fill
+        :return: The zone maps of the finished blocks that were saved, up to that many
+        """
+        blocks_path = os.path.join(self.path, BLOCKS_FILE)
+        blocks, good = [], 0
+        if os.path.exists(blocks_path):
+            with open(blocks_path, "rb") as blocks_file:
+                for line in blocks_file:
+                    if len(blocks) == finished or not line.endswith(b"\n"):
+                        break
+                    try:
+                        blocks.append(json.loads(line.decode("utf-8")))
+                    except ValueError:  # Only partly written
+                        break
+                    good += len(line)
+            if not self.read_only and os.path.getsize(blocks_path) > good:
+                with open(blocks_path, "r+b") as blocks_file:
+                    blocks_file.truncate(good)
+        return blocks
+
+    def add(self, weather_json):
+        """
+        Adds the observation in a decoded response, or each one in a group call's response.
+        An observation that is no newer than the last one for its city is skipped, so the
+        same observation fetched twice is only kept once
+        :param weather_json: The decoded JSON response
+        :return: How many rows were added
+        :raises ValueError: If the archive was opened read only, or has been closed
+        """
+        added = 0
+        with self._lock:
+            if self._files is None:
+                raise ValueError("The archive " + self.path + " isn't open for writing")
+            for one in weather_json.get("list", [weather_json]):
+                added += self._add(one)
+            if self._pending >= self.flush_rows:
+                self._flush()
+        return added
+
+    def _add(self, weather_json):
+        city, observed = weather_json.get("id"), weather_json.get("dt")
+        if not isinstance(city, int) or not isinstance(observed, int) or \
+                (city in self.latest and observed <= self.latest[city][1]):
+            self.skipped += 1
+            return 0
+        observation = Observation.from_json(weather_json)
+        if observation.timezone is None:  # Group responses keep it with the sunrise
+            observation.timezone = weather_json.get("sys", {}).get("timezone")
+        values = [("dt", observed)] + [(name, _number(getattr(observation, name)))
+                                       for name in FIELD_COLUMNS]
+        row = self.rows
+        previous = self.latest[city][0] if city in self.latest else NO_ROW
+        for name, value in [("city", city), ("previous", previous)] + values:
+            self._files[name].write(_STRUCTS[name].pack(value))
+        self.rows += 1
+        self._pending += 1
+        self.latest[city] = (row, observed)
+        self._widen(row, values)
+        return 1
+
+    def _widen(self, row, values):
+        """
+        Widens the row's block's zone map to take it in
+        :param values: A list of (column name, value) tuples
+        """
+        if row // BLOCK_ROWS == len(self.blocks):
+            self.blocks.append({})
+        zone = self.blocks[row // BLOCK_ROWS]
+        for name, value in values:
+            if math.isnan(value):  # Missing, so nothing to widen
+                continue
+            bounds = zone.get(name)
+            if bounds is None:
+                zone[name] = [value, value]
+            elif value < bounds[0]:
+                bounds[0] = value
+            elif value > bounds[1]:
+                bounds[1] = value
+
+    def flush(self):
+        """
+        Writes out the rows added so far, so other processes can read them
+        """
+        with self._lock:
+            if self._files is not None:
+                self._flush()
+
+    def _flush(self):
+        """
+        Writes out the columns, and once a block has finished, its zone map and a new
+        checkpoint.  Otherwise the index isn't written, as it can be found again from the
+        columns
+        """
+        for column_file in self._files.values():
+            column_file.flush()
+        self._pending = 0
+        if self.rows // BLOCK_ROWS > self._saved_blocks:
+            self._save_index()
+
+    def _save_index(self):
+        """
+        Appends the zone maps of the blocks finished since they were last saved, and writes
+        the checkpoint if rows were added since it was.  The columns must have been written
+        out first
+        """
+        finished = self.rows // BLOCK_ROWS
+        if finished > self._saved_blocks:
+            with open(os.path.join(self.path, BLOCKS_FILE), "ab") as blocks_file:
+                blocks_file.write(b"".join(json.dumps(zone).encode("utf-8") + b"\n"
+                                           for zone in self.blocks[self._saved_blocks:finished]))
+            self._saved_blocks = finished
+        if self._checkpoint_rows == self.rows:
+            return
+        latest_path = os.path.join(self.path, LATEST_FILE)
+        with open(latest_path + ".tmp", "wb") as latest_file:
+            latest_file.write(_CHECKPOINT_HEADER.pack(VERSION, self.rows) +
+                              b"".join(_CHECKPOINT_CITY.pack(city, row, observed)
+                                       for city, (row, observed) in self.latest.items()))
+        os.replace(latest_path + ".tmp", latest_path)  # So a reader never sees half of it
+        self._checkpoint_rows = self.rows
+
+    def close(self):
+        """
+        Writes out what was added, closes the columns and lets another process write to
+        the archive.  Closing twice does nothing
+        """
+        with self._lock:
+            if self._files is not None:
+                self._flush()
+                self._save_index()
+                for column_file in self._files.values():
+                    column_file.close()
+                self._files = None
+            if self._lock_file is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
+            self._unmap()
+
+    def _views(self):
+        """
+        Maps the columns for reading, again if rows have been added since they were mapped
+        :return: A dictionary of column name to a memoryview of its values
+        """
+        if self._pending and self._files is not None:
+            self._flush()
+        if self._mapped_rows != self.rows:
+            self._unmap()
+            for name, _ in COLUMNS:
+                with open(self._column_path(name), "rb") as column_file:
+                    self._maps[name] = mmap.mmap(column_file.fileno(),
+                                                 self.rows * _STRUCTS[name].size,
+                                                 access=mmap.ACCESS_READ)
+            self._mapped_rows = self.rows
+        return {name: memoryview(self._maps[name]).cast(code) for name, code in COLUMNS}
+
+    def _unmap(self):
+        for column_map in self._maps.values():
+            try:
+                column_map.close()
+            except BufferError:  # Still being read somewhere, so left for the collector
+                pass
+        self._maps = {}
+        self._mapped_rows = 0
+
+    def history(self, city_id, field, start=None, end=None):
+        """
+        One city's values of a field over a time range, read by walking back through its
+        rows from the newest
+        :param city_id: The open weather city ID
+        :param field: The column, e.g. "humidity"
+        :param start: The earliest dt wanted, or None for the whole history
+        :param end: The dt the range ends before, or None for no end
+        :return: A list of (dt, value) tuples, oldest first, where a missing value is None
+        :raises ValueError: If there is no such field
+        """
+        _check_field(field)
+        with self._lock:
+            if city_id not in self.latest:
+                return []
+            views = self._views()
+            dts, previous, values = views["dt"], views["previous"], views[field]
+            found = []
+            row = self.latest[city_id][0]
+            # A city's rows are added in the order they were observed, so the walk stops
+            # at the first one before the start
+            while row != NO_ROW:
+                observed = dts[row]
+                if start is not None and observed < start:
+                    break
+                if end is None or observed < end:
+                    value = values[row]
+                    found.append((observed, None if math.isnan(value) else value))
+                row = previous[row]
+        found.reverse()
+        return found
+
+    def select(self, field, start, end, above=None, below=None):
+        """
+        Every city's values of a field over a time range, e.g. all locations above some
+        pressure on one day.  Blocks that can't hold a match aren't read
+        :param field: The column, e.g. "pressure"
+        :param start: The earliest dt wanted
+        :param end: The dt the range ends before
+        :param above: Only values greater than this, if given
+        :param below: Only values less than this, if given
+        :return: A list of (city ID, dt, value) tuples in the order they were added.
+         Observations without the field are left out
+        :raises ValueError: If there is no such field
+        """
+        _check_field(field)
+        found = []
+        with self._lock:
+            if not self.rows:
+                return found
+            views = self._views()
+            for block, zone in enumerate(self.blocks):
+                if not _may_match(zone, field, start, end, above, below):
+                    continue
+                first = block * BLOCK_ROWS
+                last = min(self.rows, first + BLOCK_ROWS)
+                if numpy is not None:
+                    found.extend(self._scan_numpy(first, last, field, start, end, above, below))
+                else:
+                    found.extend(_scan(views, first, last, field, start, end, above, below))
+        return found
+
+    def _scan_numpy(self, first, last, field, start, end, above, below):
+        def column(name):
+            return numpy.frombuffer(self._maps[name], dtype=_NUMPY_TYPES[name],
+                                    count=last - first, offset=first * _STRUCTS[name].size)
+        dts, values = column("dt"), column(field)
+        wanted = (dts >= start) & (dts < end) & ~numpy.isnan(values)
+        if above is not None:
+            wanted &= values > above
+        if below is not None:
+            wanted &= values < below
+        rows = numpy.flatnonzero(wanted)
+        return list(zip(column("city")[rows].tolist(), dts[rows].tolist(),
+                        values[rows].tolist()))
+
+    def stats(self):
+        """
+        :return: A dictionary of rows, cities, blocks and observations skipped
+        """
+        with self._lock:
+            return {"rows": self.rows, "cities": len(self.latest), "blocks": len(self.blocks),
+                    "skipped": self.skipped}
+
+
+def _may_match(zone, field, start, end, above, below):
+    """
+    :param zone: A block's zone map
+    :return: False if the block can't hold a match, from the range of its values
+    """
+    times, bounds = zone.get("dt"), zone.get(field)
+    if times is None or bounds is None:  # Empty, or the field is always missing
+        return False
+    if times[1] < start or times[0] >= end:
+        return False
+    return (above is None or bounds[1] > above) and (below is None or bounds[0] < below)
+
+
+def _read_checkpoint(latest_path, path):
+    """
+    :param latest_path: The checkpoint file
+    :param path: The archive's directory, for the error
+    :return: The rows the checkpoint covers, and a dictionary of city ID to a (newest row,
+     its dt) tuple.  0 and an empty dictionary if there isn't one
+    :raises ValueError: If the checkpoint is of another version
+    """
+    if not os.path.exists(latest_path):
+        return 0, {}
+    with open(latest_path, "rb") as latest_file:
+        checkpoint = latest_file.read()
+    version, rows = _CHECKPOINT_HEADER.unpack_from(checkpoint)
+    if version != VERSION:
+        raise ValueError(path + " is not an observation archive of version " + str(VERSION))
+    latest = {city: (row, observed) for city, row, observed in
+              _CHECKPOINT_CITY.iter_unpack(checkpoint[_CHECKPOINT_HEADER.size:])}
+    return rows, latest
+
+
+def _check_field(field):
+    if field not in FIELD_COLUMNS:
+        raise ValueError("Unknown field: " + str(field) + ".  The fields are " +
+                         ", ".join(FIELD_COLUMNS))
+
+
+def _scan(views, first, last, field, start, end, above, below):
+    """
+    Reads the matches from one block without NumPy
+    :return: A list of (city ID, dt, value) tuples
+    """
+    found = []
+    cities, dts, values = views["city"], views["dt"], views[field]
+    for row in range(first, last):
+        observed = dts[row]
+        if start <= observed < end:
+            value = values[row]
+            if not math.isnan(value) and (above is None or value > above) and \
+                    (below is None or value < below):
+                found.append((cities[row], observed, value))
+    return found
+
+
+if __name__ == "__main__":
+    import argparse
+    import datetime
+    import time
+
+    COMMAND_PARSER = argparse.ArgumentParser(description="Query an observation archive")
+    COMMAND_PARSER.add_argument("archive", help="The archive's directory, as given to [-archive]")
+    COMMAND_PARSER.add_argument("-field", required=True, choices=FIELD_COLUMNS)
+    COMMAND_PARSER.add_argument("-cid", type=int, help="One city's history")
+    COMMAND_PARSER.add_argument("-days", type=float, help="Only the last this many days")
+    COMMAND_PARSER.add_argument("-date", help="Only this day, in UTC, e.g. 2017-01-30")
+    COMMAND_PARSER.add_argument("-above", type=float, help="Only values greater than this")
+    COMMAND_PARSER.add_argument("-below", type=float, help="Only values less than this")
+    OPTIONS = COMMAND_PARSER.parse_args()
+
+    START, END = 0, 2 ** 62
+    if OPTIONS.date is not None:
+        DAY = datetime.datetime.strptime(OPTIONS.date, "%Y-%m-%d")
+        START = int((DAY - datetime.datetime(1970, 1, 1)).total_seconds())
+        END = START + 24 * 60 * 60
+    elif OPTIONS.days is not None:
+        START = int(time.time() - OPTIONS.days * 24 * 60 * 60)
+    ARCHIVE = ObservationArchive(OPTIONS.archive, read_only=True)
+    if OPTIONS.cid is not None:
+        for OBSERVED, VALUE in ARCHIVE.history(OPTIONS.cid, OPTIONS.field, START, END):
+            if VALUE is not None and (OPTIONS.above is None or VALUE > OPTIONS.above) and \
+                    (OPTIONS.below is None or VALUE < OPTIONS.below):
+                print(str(OBSERVED) + "\t" + repr(VALUE))
+    else:
+        for CITY, OBSERVED, VALUE in ARCHIVE.select(OPTIONS.field, START, END, OPTIONS.above,
+                                                    OPTIONS.below):
+            print(str(CITY) + "\t" + str(OBSERVED) + "\t" + repr(VALUE))
+    ARCHIVE.close()
@@ -0,0 +1,154 @@
+"""
+An asyncio engine for getting weather data.
+Hundreds of requests can be waiting on the network at once from a single thread,
+and the responses are checked and formatted exactly as InputParser.get_from_url does
+"""
+import asyncio
+import json
+import urllib.parse
+
+from weather_forecast import check_status, format_weather
+
+
+DEFAULT_CONCURRENCY = 100  # Requests allowed on the network at once
+DEFAULT_TIMEOUT = 10  # Seconds before a request is given up on
+
+
+class AsyncWeatherClient:
+    """
+    Fetches weather data with asyncio, limiting the number of requests in flight
+    """
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+        """
+        :param concurrency: The most requests that may be in flight at once
+        :param timeout: Seconds each request may take, or None to wait forever
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._semaphore = None  # Made on first use, so it belongs to the running loop
+
+    def _limit(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def fetch(self, url):
+        """
+        Gets the given URL, waiting for a free slot first
+        :param url: The URL to get the data from
+        :return: A (status code, decoded JSON or None) tuple
+        :raises asyncio.TimeoutError: If the request takes longer than the timeout
+        """
+        semaphore = self._limit()
+        async with semaphore:
+            return await asyncio.wait_for(_http_get(url), self.timeout)
+
+    async def get_from_url(self, url, user_input):
+        """
+        Gets the information from the given URL and constructs it into a valid string
+        :param url: The URL to get the data from
+        :param user_input: The arguments given, which say what information is wanted
+        :return: The same string or error get_from_url returns
+        :raises asyncio.TimeoutError: If the request takes longer than the timeout
+        """
+        status_code, weather_json = await self.fetch(url)
+        error = check_status(status_code)
+        if error is not None:
+            return error
+        return format_weather(weather_json, user_input)
+
+    async def get_many(self, queries):
+        """
+        Runs many queries at once.  Cancelling this cancels every query still in flight
+        :param queries: A list of (url, user_input) tuples
+        :return: A list of results in the same order, with "TIMEOUT" for any query that
+         took too long and "CONNECTION_ERROR" for any that couldn't reach the server or
+         had an answer that wasn't HTTP, as the blocking path gives
+        """
+        tasks = [asyncio.ensure_future(self._get_or_timeout(url, user_input))
+                 for url, user_input in queries]
+        try:
+            return await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def _get_or_timeout(self, url, user_input):
+        try:
+            return await self.get_from_url(url, user_input)
+        except asyncio.TimeoutError:  # Before OSError, which it is from python 3.11
+            return "TIMEOUT"
+        except (OSError, EOFError):  # EOFError if the connection closes part way through
+            return "CONNECTION_ERROR"
+
+
+def get_many(queries, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+    """
+    Runs many queries on a new event loop, for callers that aren't using asyncio
+    :param queries: A list of (url, user_input) tuples
+    :param concurrency: The most requests that may be in flight at once
+    :param timeout: Seconds each request may take
+    :return: A list of results in the same order as the queries
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        client = AsyncWeatherClient(concurrency, timeout)
+        return loop.run_until_complete(client.get_many(queries))
+    finally:
+        loop.close()
+
+
+async def _http_get(url):
+    """
+    A minimal HTTP/1.1 GET, enough for the open weather api
+    :param url: The URL to get
+    :return: A (status code, decoded JSON or None) tuple
+    :raises OSError: If the server can't be reached, or doesn't answer in HTTP
+    :raises EOFError: If the connection closes before the whole body has arrived
+    """
+    parts = urllib.parse.urlsplit(url)
+    secure = parts.scheme == "https"
+    port = parts.port or (443 if secure else 80)
+    target = urllib.parse.quote(parts.path or "/", safe="/%")
+    if parts.query:
+        target += "?" + urllib.parse.quote(parts.query, safe="=&,;:+%@!$'()*/?")
+
+    reader, writer = await asyncio.open_connection(parts.hostname, port, ssl=secure or None)
+    try:
+        writer.write(("GET " + target + " HTTP/1.1\r\n"
+                      "Host: " + parts.netloc + "\r\n"
+                      "Accept: application/json\r\n"
+                      "Connection: close\r\n\r\n").encode("latin-1"))
+        status_line = (await reader.readline()).split()
+        if len(status_line) < 2 or not status_line[1].isdigit():
+            raise ConnectionError("The answer from " + parts.netloc + " isn't HTTP")
+        status_code = int(status_line[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()  # The line break after each chunk
+        else:
+            body = await reader.read()
+    finally:
+        writer.close()
+
+    try:
+        return status_code, json.loads(body.decode("utf-8"))
+    except ValueError:  # Errors don't always come back as JSON
+        return status_code, None
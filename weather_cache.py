@@ -0,0 +1,173 @@
+"""
+A response cache kept in a single SQLite file, so that separate runs of the program
+(and separate processes running at the same time) share what has already been fetched.
+Entries expire after a time to live, and the least recently used are evicted once the
+cache is full.  An expired entry can still be served for a while as stale, so that a
+query isn't kept waiting on the server while the entry is refreshed
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".weather_forecast_cache.sqlite")
+DEFAULT_TTL = 600  # Open weather only updates about every 10 minutes
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_STALE = 0  # Expired responses aren't served unless asked for
+
+
+def cache_key(url, keep_api_key=False):
+    """
+    Normalises a URL from synthesise_request so the same query always gives the same key.
+    The api key is removed unless asked for, so every key shares the cached data
+    :param url: The URL to normalise
+    :param keep_api_key: Whether to keep the api key, for when the response may differ by key
+    :return: The key to cache the response under
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = sorted((name, value) for name, value
+                   in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                   if keep_api_key or name.lower() != "appid")
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path,
+                                    urllib.parse.urlencode(query), ""))
+
+
+class ResponseCache:
+    """
+    Caches decoded weather responses by URL in a SQLite file
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES, max_stale=DEFAULT_MAX_STALE):
+        """
+        :param path: The file to keep the cache in
+        :param ttl: Seconds a response stays fresh for
+        :param max_entries: The most responses kept before the least recently used go
+        :param max_stale: Seconds past the time to live a response may still be served
+         as stale by get_stale
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_stale = max_stale
+        self._local = threading.local()  # SQLite connections can't be shared by threads
+
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                               "key TEXT PRIMARY KEY, body TEXT NOT NULL, "
+                               "fetched REAL NOT NULL, used REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+            connection.execute("CREATE TABLE IF NOT EXISTS counters ("
+                               "name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            connection.executemany("INSERT OR IGNORE INTO counters VALUES (?, 0)",
+                                   [("hits",), ("misses",), ("evictions",), ("stale",)])
+
+    def _connection(self):
+        """
+        :return: This thread's connection to the cache file
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Wait for other processes rather than failing when the file is busy
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return _Transaction(connection)
+
+    def get(self, url):
+        """
+        Looks up a fresh response for the URL
+        :param url: The URL from synthesise_request
+        :return: The decoded JSON response, or None if there isn't a fresh one
+        """
+        key = cache_key(url)
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute("SELECT body FROM responses WHERE key = ? AND fetched > ?",
+                                     (key, now - self.ttl)).fetchone()
+            if row is None:
+                _count(connection, "misses")
+                return None
+            connection.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            _count(connection, "hits")
+        return json.loads(row[0])
+
+    def get_stale(self, url):
+        """
+        Looks up a response that is past its time to live, but by no more than max_stale,
+        to serve while a fresh one is fetched.  Call it after get has missed
+        :param url: The URL from synthesise_request
+        :return: A (decoded JSON response, seconds since it was fetched) tuple, or
+         (None, None) if there isn't one
+        """
+        if self.max_stale <= 0:
+            return None, None
+        key = cache_key(url)
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute("SELECT body, fetched FROM responses WHERE key = ? "
+                                     "AND fetched > ?",
+                                     (key, now - self.ttl - self.max_stale)).fetchone()
+            if row is None:
+                return None, None
+            connection.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            _count(connection, "stale")
+        return json.loads(row[0]), now - row[1]
+
+    def put(self, url, weather_json):
+        """
+        Stores a response, evicting the least recently used if the cache is full
+        :param url: The URL from synthesise_request
+        :param weather_json: The decoded JSON response
+        """
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                               (cache_key(url), json.dumps(weather_json), now, now))
+            excess = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0] \
+                - self.max_entries
+            if excess > 0:
+                connection.execute("DELETE FROM responses WHERE key IN (SELECT key FROM "
+                                   "responses ORDER BY used LIMIT ?)", (excess,))
+                _count(connection, "evictions", excess)
+
+    def stats(self):
+        """
+        The counters are kept in the file, so they cover every process using it
+        :return: A dictionary of hits, misses, evictions, stale responses served (which
+         are also counted as misses) and the number of entries
+        """
+        with self._connection() as connection:
+            stats = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+            stats["entries"] = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return stats
+
+    def clear(self):
+        """
+        Removes every response and resets the counters
+        """
+        with self._connection() as connection:
+            connection.execute("DELETE FROM responses")
+            connection.execute("UPDATE counters SET value = 0")
+
+
+class _Transaction:
+    """
+    Holds the write lock on the cache file for the length of a with block, so that
+    reading, updating and evicting happen as one step even with other processes running
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, *exc_info):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _count(connection, name, amount=1):
+    connection.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
@@ -0,0 +1,163 @@
+"""
+Renders many responses at once by collecting their numbers into NumPy arrays, so the unit
+conversions and time formatting run once over the whole batch instead of once per response.
+The strings are identical to format_weather's.
+
+NumPy is only needed for this file: pip install numpy
+"""
+import datetime
+
+try:
+    import numpy
+except ImportError:  # Optional, only bulk rendering needs it
+    numpy = None
+
+from weather_observation import FIELDS
+
+
+# Every "HH:MM " in a day, so times can be looked up by the minute of the day
+_CLOCK = ["%02d:%02d " % divmod(minute, 60) for minute in range(24 * 60)]
+
+# Columns that are only turned into strings are left as python values, so that ints and
+# floats are printed exactly as the api sent them
+_TEXT_COLUMNS = ["pressure", "clouds", "humidity", "wind_deg"]
+_TIME_COLUMNS = ["timezone", "sunrise", "sunset"]
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("Bulk rendering needs numpy: pip install numpy")
+
+
+def collect(responses, user_input):
+    """
+    Pulls the values the flags need out of many responses into columns
+    :param responses: A list of decoded JSON responses
+    :param user_input: The arguments given, which say what information is wanted
+    :return: A dictionary of column name to a NumPy array (or a list, for values that are
+     only printed)
+    """
+    _require_numpy()
+    columns = {}
+    for flag, wanted in FIELDS.items():
+        if flag not in user_input:
+            continue
+        for name, section, key in wanted:
+            if section is None:
+                values = [weather_json[key] for weather_json in responses]
+            else:
+                values = [weather_json[section][key] for weather_json in responses]
+            if name in _TEXT_COLUMNS:
+                columns[name] = values
+            elif name in _TIME_COLUMNS:
+                # Whole seconds are vectorised.  Anything else is rare, and printed
+                # differently, so it is left as python values for the slower path
+                columns[name] = numpy.array(values, dtype=numpy.int64) \
+                    if all(type(value) is int for value in values) else values
+            else:
+                columns[name] = numpy.array(values, dtype=numpy.float64)
+    return columns
+
+
+def round_1(values):
+    """
+    Rounds to one decimal place exactly as python's round(value, 1) does.
+    Scaling by 10 and rounding gives the same answer except on the rare values that land
+    on a tie after scaling, where python rounds the exact decimal value, so those are
+    rounded by python instead
+    :param values: A NumPy array of floats
+    :return: A NumPy array of the rounded floats
+    """
+    _require_numpy()
+    scaled = values * 10
+    rounded = numpy.rint(scaled) / 10
+    ties = numpy.abs(scaled - numpy.floor(scaled) - 0.5) <= \
+        1e-9 * numpy.maximum(1.0, numpy.abs(scaled))
+    for position in numpy.flatnonzero(ties):
+        rounded[position] = round(float(values[position]), 1)
+    return rounded
+
+
+def _clock_text(epochs):
+    """
+    :param epochs: Seconds since the epoch, as a NumPy array of ints or a list
+    :return: A list of the times of day in GMT, as 'HH:MM '
+    """
+    if not isinstance(epochs, list):
+        return [_CLOCK[minute] for minute in ((epochs // 60) % (24 * 60)).tolist()]
+    # Fractional seconds are rounded by datetime, so leave those to it
+    return [datetime.datetime.utcfromtimestamp(epoch).strftime("%H:%M ") for epoch in epochs]
+
+
+def render_columns(columns, user_input, count):
+    """
+    Renders collected columns, in the same order and words as format_weather
+    :param columns: Columns from collect
+    :param user_input: The arguments given, which say what information is wanted
+    :param count: The number of responses in the columns
+    :return: A list of the strings for each response
+    """
+    _require_numpy()
+    parts = []  # One list of strings per piece of information
+
+    if "time" in user_input:
+        timezones = columns["timezone"]
+        if isinstance(timezones, list):
+            offsets = [timezone // 3600 for timezone in timezones]
+        else:
+            offsets = (timezones // 3600).tolist()
+        parts.append(["The timezone is " + str(abs(offset)) +
+                      (" hour " if abs(offset) == 1 else " hours ") +
+                      ("past GMT.  " if offset > 0 else "before GMT.  ") for offset in offsets])
+
+    if "sunrise" in user_input:
+        parts.append(["The sun rises at " + clock + "GMT.  "
+                      for clock in _clock_text(columns["sunrise"])])
+
+    if "sunset" in user_input:
+        parts.append(["The sun sets at " + clock + "GMT.  "
+                      for clock in _clock_text(columns["sunset"])])
+
+    if "pressure" in user_input:
+        parts.append(["The pressure is " + str(value) + "hPa.  "
+                      for value in columns["pressure"]])
+
+    if "cloud" in user_input:
+        parts.append(["There is a " + str(value) + "% chance of clouds.  "
+                      for value in columns["clouds"]])
+
+    if "humidity" in user_input:
+        parts.append(["The humidity is at " + str(value) + "%.  "
+                      for value in columns["humidity"]])
+
+    if "wind" in user_input:
+        speeds = (columns["wind_speed"] * 3.6).tolist()  # m/s to km/h
+        parts.append(["The wind is moving at " + str(speed) + "km/h, in a direction of " +
+                      str(degrees) + " degrees.  "
+                      for speed, degrees in zip(speeds, columns["wind_deg"])])
+
+    if "temp" in user_input:
+        unit = user_input["temp"].lower()
+        temp_max = columns["temp_max"] - 273.15
+        temp_min = columns["temp_min"] - 273.15
+        if unit != "celsius":
+            temp_max = temp_max * 9/5 + 32
+            temp_min = temp_min * 9/5 + 32
+        ending = " degrees " + unit + ".  "
+        parts.append(["The temperature has a high of " + str(high) + " and a low of " +
+                      str(low) + ending for high, low
+                      in zip(round_1(temp_max).tolist(), round_1(temp_min).tolist())])
+
+    if not parts:
+        return [""] * count
+    return ["".join(row) for row in zip(*parts)]
+
+
+def render_bulk(responses, user_input):
+    """
+    Renders many responses with the same flags at once
+    :param responses: A list of decoded JSON responses
+    :param user_input: The arguments given, which say what information is wanted
+    :return: A list of the strings format_weather would give for each response
+    """
+    return render_columns(collect(responses, user_input), user_input, len(responses))
@@ -0,0 +1,154 @@
+"""
+Runs queries in one long lived process, so that each query skips starting python,
+importing requests and setting up the argument parser, and reuses the warm cache and
+connection pool.
+
+Start the server with: python weather_forecast.py -api [key] -serve [address]
+Then query it with: python weather_daemon.py [address] -cid 2643743 -temp
+where [address] is a unix socket path, or host:port to listen on TCP.
+
+This file only imports what the client needs, so the client starts quickly
+"""
+import errno
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+
+
+def parse_address(address):
+    """
+    Works out what kind of socket an address is for
+    :param address: A unix socket path, or 'host:port'
+    :return: A (socket family, address) tuple
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+class _QueryHandler(socketserver.StreamRequestHandler):
+    """
+    Answers each line of JSON arguments on a connection with a line of JSON output
+    """
+    def handle(self):
+        for line in self.rfile:
+            try:
+                args = json.loads(line.decode("utf-8"))["args"]
+            except (ValueError, KeyError, TypeError):
+                args = None
+            if not isinstance(args, list):
+                output = "ERROR: The request to the server could not be read"
+            else:
+                try:
+                    output = self.server.run_query(args)
+                except Exception as error:  # pylint: disable=broad-except
+                    # One query going wrong mustn't end the connection, or the server
+                    output = "ERROR: The query could not be run (" + \
+                        type(error).__name__ + ")"
+            self.wfile.write(json.dumps({"output": output}).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    run_query = None  # Set by make_server
+    inode = None  # The socket file's, so serve only removes the file if it is still its own
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    run_query = None  # Set by make_server
+
+
+def make_server(address, run_query):
+    """
+    Sets up a server that answers each client on its own thread
+    :param address: A unix socket path, or 'host:port'
+    :param run_query: A function taking a list of arguments and returning the output
+    :return: The server, ready for serve_forever
+    :raises OSError: With errno.EADDRINUSE if the address is taken, e.g. by a server
+     still running, or a unix socket path is a file that isn't a socket
+    """
+    family, bind_to = parse_address(address)
+    if family == socket.AF_UNIX:
+        _remove_stale_socket(bind_to)
+        server = _UnixServer(bind_to, _QueryHandler)
+        server.inode = os.stat(bind_to).st_ino
+    else:
+        server = _TCPServer(bind_to, _QueryHandler)
+    server.run_query = run_query
+    return server
+
+
+def _remove_stale_socket(path):
+    """
+    Removes a unix socket left over from a server that didn't exit cleanly.  Anything
+    else at the path, including the socket of a server still running, is left alone
+    :param path: The socket path
+    :raises OSError: With errno.EADDRINUSE if the path can't be used
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(errno.EADDRINUSE, "Address in use by a file that isn't a socket", path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:  # Nothing is listening on it any more
+            os.remove(path)
+            return
+    raise OSError(errno.EADDRINUSE, "Address in use by a server still running", path)
+
+
+def serve(address, run_query):
+    """
+    Answers queries until interrupted
+    :param address: A unix socket path, or 'host:port'
+    :param run_query: A function taking a list of arguments and returning the output
+    :raises OSError: With errno.EADDRINUSE if the address is taken
+    """
+    server = make_server(address, run_query)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server, _UnixServer):
+            try:
+                # Only if it is still this server's socket, and not a file put there since
+                if os.stat(server.server_address).st_ino == server.inode:
+                    os.remove(server.server_address)
+            except FileNotFoundError:
+                pass
+
+
+def forward(address, args, timeout=None):
+    """
+    Sends a query to a running server
+    :param address: A unix socket path, or 'host:port'
+    :param args: The arguments for the query, as given on the command line
+    :param timeout: Seconds to wait for the answer, or None to wait as long as it takes
+    :return: The output of the query
+    """
+    family, connect_to = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(connect_to)
+        connection.sendall(json.dumps({"args": args}).encode("utf-8") + b"\n")
+        with connection.makefile("rb") as answer:
+            return json.loads(answer.readline().decode("utf-8"))["output"]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python weather_daemon.py [address] [query arguments]")
+    else:
+        print(forward(sys.argv[1], sys.argv[2:]))
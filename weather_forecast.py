@@ -2,94 +2,838 @@
 The file to be tested.
 It gets weather data, and provides it to the user based on arguments
 """
-import argparse  # Gets the input data from the user
-import datetime  # To handle the sunrise, etc. conversion
-import requests  # Used to receive web page data
+import atexit  # Writes out the archive when the program ends
+import collections
+import random  # Spreads out retries
+import sys
+import threading  # Lets concurrent fetches of the same URL share one request
+import time
+import urllib.parse  # Finds the api key in a URL
+import weather_quota  # Keeps calls under the api key's limit
+import weather_metrics  # Times each phase of a query
+# The values that are printed
+from weather_observation import FIELDS, Observation, ResponseView
+# A query as a value, and the rules it is checked by
+from weather_query import BASE_URL, InvalidArgumentException, WeatherQuery, check_input
 
+# These are only imported by _load when they are first used, so that help, argument errors
+# and simple queries don't wait for modules they never use.  requests alone takes longer
+# to import than the rest of a query
+# pylint: disable=invalid-name
+argparse = None  # Gets the input data from the user, when the quick parser can't
+requests = None  # Used to receive web page data
+futures = None  # concurrent.futures, runs batch queries on a pool of threads
+datetime = None  # To handle sunrise, etc. times that aren't whole seconds
+shlex = None  # Splits batch lines the same way the shell splits arguments
+weather_cache = None  # Keeps responses between runs
+weather_index = None  # Looks up city IDs offline
+weather_spatial = None  # Snaps coordinates to the nearest city
+weather_daemon = None  # Answers queries from other processes
+weather_watch = None  # Refreshes locations and shows what changed
+weather_archive = None  # Keeps every observation fetched
+queue = None  # Hands stale responses to the threads refreshing them
+# pylint: enable=invalid-name
+_LAZY_MODULES = {"argparse": "argparse", "requests": "requests",
+                 "futures": "concurrent.futures", "datetime": "datetime", "shlex": "shlex",
+                 "weather_cache": "weather_cache", "weather_index": "weather_index",
+                 "weather_spatial": "weather_spatial", "weather_daemon": "weather_daemon",
+                 "weather_watch": "weather_watch", "weather_archive": "weather_archive",
+                 "queue": "queue"}
 
-# Exception for when the arguments are invalid
-class InvalidArgumentException(Exception):
+
+def _load(name):
     """
-    An error class to raise if the user inputs something incorrectly
+    Imports one of the modules left until it is needed, the first time it is used
+    :param name: The name it is kept under in this module, e.g. "requests"
+    :return: The module
     """
-    def __init__(self, to_display="The arguments entered were invalid"):
-        Exception.__init__(self)
-        self.message = to_display
+    module = globals()[name]
+    if module is None:
+        # An import statement rather than importlib, so -X importtime still lists it
+        __import__(_LAZY_MODULES[name])
+        module = globals()[name] = sys.modules[_LAZY_MODULES[name]]
+    return module
 
-    def __str__(self):
-        return self.message
 
+# Arguments that control how the program runs rather than what is being asked for.
+# These are ignored when the query itself is validated
+RUNTIME_OPTIONS = ["batch", "serve", "workers", "nogroup", "cache", "ttl", "cachesize", "index",
+                   "spatial", "snap", "timeout", "retries", "rate", "burst", "quotafile",
+                   "quotawait", "stats", "watch", "jsonl", "stale", "hedge",
+                   "hedgebudget", "archive"]
 
-class InputParser:
+DEFAULT_WORKERS = 8  # Number of threads used by batch mode
+
+CONNECT_TIMEOUT = 3.05  # Seconds to wait for a connection
+READ_TIMEOUT = 10  # Seconds to wait for the server to answer
+DEFAULT_RETRIES = 3  # Times a throttled or failed request is tried again
+RETRY_STATUSES = [429, 500, 502, 503, 504]  # Statuses that are worth trying again
+MAX_RETRY_WAIT = 30  # The longest wait before a retry.  A server asking for longer isn't retried
+HEDGE_P95 = "p95"  # Hedge after the slowest 5% of recent requests' time, not a fixed delay
+DEFAULT_HEDGE_BUDGET = 0.05  # The share of requests that may be sent twice
+HEDGE_WINDOW = 200  # Recent request times the p95 is worked out from
+HEDGE_MIN_SAMPLES = 20  # Request times needed before the p95 is trusted
+
+UNREADABLE_RESPONSE = "ERROR: The response could not be read"
+# What a response that isn't what was expected can raise, e.g. a body that isn't JSON, or
+# one without a section the flags need
+BAD_RESPONSE_ERRORS = (ValueError, KeyError, TypeError, AttributeError)
+
+GROUP_URL = "http://api.openweathermap.org/data/2.5/group?"  # Many city IDs in one call
+GROUP_SIZE = 20  # The most cities the api allows in one group call
+
+
+def check_status(status_code):
     """
-    This class facilitates receiving a command line argument and using that to get relevant
-    weather data for the user
+    Checks the status code of a response from the open weather api
+    :param status_code: The HTTP status code of the response
+    :return: None if the response can be used, otherwise the error to return to the user
+    """
+    if status_code == 401:  # Handle different errors
+        return "BAD_API"
+    if status_code == 404:
+        return "LOCATION_UNKNOWN"
+    if status_code != 200:  # Otherwise, return the error
+        return status_code
+    return None
+
+
+def _render_time(observation):
+    # Get the timezone difference from UTC in hours
+    time_offset = observation.timezone//3600
+    return "The timezone is " + str(abs(time_offset)) + \
+           (" hour " if abs(time_offset) == 1 else " hours ") + \
+           ("past" if time_offset > 0 else "before") + " GMT.  "
+
+
+def _clock(timestamp):
+    """
+    :param timestamp: Seconds since the epoch
+    :return: The time of day in GMT, as 'HH:MM '
+    """
+    if isinstance(timestamp, int):  # Whole seconds can skip building a datetime
+        return "%02d:%02d " % (timestamp // 3600 % 24, timestamp // 60 % 60)
+    return _load("datetime").datetime.utcfromtimestamp(timestamp).strftime("%H:%M ")
+
+
+def _render_sunrise(observation):
+    return "The sun rises at " + _clock(observation.sunrise) + "GMT.  "
+
+
+def _render_sunset(observation):
+    return "The sun sets at " + _clock(observation.sunset) + "GMT.  "
+
+
+def _render_pressure(observation):
+    # The pressure is in hPa
+    return "The pressure is " + str(observation.pressure) + "hPa.  "
+
+
+def _render_cloud(observation):
+    # The percentage chance of clouds
+    return "There is a " + str(observation.clouds) + "% chance of clouds.  "
+
+
+def _render_humidity(observation):
+    return "The humidity is at " + str(observation.humidity) + "%.  "
+
+
+def _render_wind(observation):
+    # Convert the wind from m/s to k/h
+    return "The wind is moving at " + str(observation.wind_speed*3.6) + "km/h, " + \
+           "in a direction of " + str(observation.wind_deg) + " degrees.  "
+
+
+def _temperature_renderer(unit):
+    """
+    :param unit: "celsius" or "fahrenheit"
+    :return: A function rendering the temperature in that unit
+    """
+    ending = " degrees " + unit + ".  "
+    if unit == "celsius":
+        def render_temperature(observation):
+            return "The temperature has a high of " + \
+                   str(round(observation.temp_max - 273.15, 1)) + \
+                   " and a low of " + str(round(observation.temp_min - 273.15, 1)) + ending
+    else:
+        def render_temperature(observation):
+            return "The temperature has a high of " + \
+                   str(round((observation.temp_max - 273.15) * 9/5 + 32, 1)) + \
+                   " and a low of " + \
+                   str(round((observation.temp_min - 273.15) * 9/5 + 32, 1)) + ending
+    return render_temperature
+
+
+# The order the information is given in, and how each piece is rendered
+RENDERERS = [("time", _render_time), ("sunrise", _render_sunrise), ("sunset", _render_sunset),
+             ("pressure", _render_pressure), ("cloud", _render_cloud),
+             ("humidity", _render_humidity), ("wind", _render_wind)]
+
+_RENDER_PLANS = {}  # Plans already compiled, by the flags they were compiled for
+
+
+def compile_render_plan(user_input):
+    """
+    Works out once which pieces of information a set of flags asks for, so that many
+    responses can be rendered without checking the flags each time
+    :param user_input: The arguments given, which say what information is wanted
+    :return: A tuple of functions, each rendering one piece of a response
+    """
+    plan = [renderer for flag, renderer in RENDERERS if flag in user_input]
+    if "temp" in user_input:
+        plan.append(_temperature_renderer(user_input["temp"].lower()))
+    return tuple(plan)
+
+
+def render_plan_for(user_input):
+    """
+    Gets the render plan for a set of flags, compiling it the first time it is needed
+    :param user_input: The arguments given, which say what information is wanted
+    :return: The render plan
+    """
+    flags = (tuple(flag for flag, _ in RENDERERS if flag in user_input), user_input.get("temp"))
+    plan = _RENDER_PLANS.get(flags)
+    if plan is None:
+        plan = _RENDER_PLANS[flags] = compile_render_plan(user_input)
+    return plan
+
+
+def render(plan, weather):
+    """
+    Renders one response with a compiled plan
+    :param plan: A plan from compile_render_plan
+    :param weather: An Observation, or the decoded JSON response
+    :return: The string with all the data the user wants
+    """
+    if isinstance(weather, dict):
+        weather = ResponseView(weather)
+    return "".join([render_part(weather) for render_part in plan])
+
+
+def format_weather(weather, user_input):
+    """
+    Constructs the string for the user from the weather data the api returned
+    :param weather: An Observation, or the decoded JSON response
+    :param user_input: The arguments given, which say what information is wanted
+    :return: The string with all the data the user wants
+    """
+    return render(render_plan_for(user_input), weather)
+
+
+class SingleFlight:
+    """
+    Lets only one caller at a time do the work for a key.  Anyone asking for the same key
+    while it is in progress waits for that caller's result instead of repeating the work
     """
     def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # Key to the Future of the work in progress
+        self.coalesced = 0  # Callers that shared another caller's result
+
+    def do(self, key, work):
+        """
+        Does the work, or waits for the same work already in progress
+        :param key: What identifies the work, e.g. the URL being fetched
+        :param work: A function with no arguments that does the work
+        :return: What the work returned
+        :raises: Whatever the work raised
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _load("futures").Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.result()
+
+        try:
+            result = work()
+        except BaseException as error:
+            flight.set_exception(error)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+
+def fetch(url, client=None, cache=None, priority=weather_quota.INTERACTIVE):
+    """
+    Gets a response from the open weather api and checks its status.
+    If the client is already fetching the same URL for someone else, that result is shared
+    :param url: The URL to get the data from
+    :param client: The WeatherClient to fetch with.  Without one, a new connection is opened
+    :param cache: A response cache to store a successful response in, if any
+    :param priority: weather_quota.INTERACTIVE or BACKGROUND, for when calls have to queue
+     for the api key's limit
+    :return: An (error, decoded JSON) tuple, where only one of the two is not None
+    """
+    if client is not None and client.flights is not None:
+        return client.flights.do(_load("weather_cache").cache_key(url, keep_api_key=True),
+                                 lambda: _fetch(url, client, cache, priority))
+    return _fetch(url, client, cache, priority)
+
+
+def _fetch(url, client, cache, priority):
+    http = _load("requests")
+    started = weather_metrics.start()
+    try:
+        if client is None:
+            my_response = http.get(url=url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        else:
+            my_response = client.get(url, priority)
+    except http.exceptions.Timeout:
+        weather_metrics.record("request", started, "TIMEOUT")
+        return "TIMEOUT", None
+    except http.exceptions.ConnectionError:
+        weather_metrics.record("request", started, "CONNECTION_ERROR")
+        return "CONNECTION_ERROR", None
+    except weather_quota.QuotaExceeded:
+        weather_metrics.record("request", started, "QUOTA_EXCEEDED")
+        return "QUOTA_EXCEEDED", None
+    weather_metrics.record("request", started, my_response.status_code)
+    if started is not None:
+        # From sending the last attempt until its headers arrived, so connecting and the
+        # server's time, without retries or reading the body
+        weather_metrics.active().observe("response", my_response.elapsed.total_seconds(),
+                                         my_response.status_code)
+    error = check_status(my_response.status_code)
+    if error is not None:
+        return error, None
+    started = weather_metrics.start()
+    weather_json = my_response.json()
+    weather_metrics.record("decode", started)
+    if cache is not None:
+        cache.put(url, weather_json)
+    if client is not None and client.archive is not None:
+        started = weather_metrics.start()
+        client.archive.add(weather_json)
+        weather_metrics.record("archive", started)
+    return None, weather_json
+
+
+def plan_groups(city_ids, group_size=GROUP_SIZE):
+    """
+    Packs city IDs into as few group calls as possible, leaving out repeats
+    :param city_ids: The city IDs wanted, as strings
+    :param group_size: The most cities the api allows in one group call
+    :return: A list of lists of city IDs, one list per call
+    """
+    unique_ids = list(collections.OrderedDict.fromkeys(city_ids))
+    return [unique_ids[start:start + group_size]
+            for start in range(0, len(unique_ids), group_size)]
+
+
+def group_url(city_ids, api_key):
+    """
+    Produces the URL for one group call
+    :param city_ids: The city IDs to get, at most GROUP_SIZE of them
+    :param api_key: The key for the api
+    :return: The URL
+    """
+    return GROUP_URL + "id=" + ",".join(city_ids) + "&APPID=" + api_key
+
+
+def split_group(group_json):
+    """
+    Splits a group response back into one response per city, in the same shape as
+    a single /weather response so that format_weather can read it
+    :param group_json: The decoded JSON of a group call
+    :return: A dictionary of city ID (as a string) to that city's weather
+    """
+    responses = {}
+    for weather_json in group_json.get("list", []):
+        # Group responses keep the timezone with the sunrise and sunset
+        if "timezone" not in weather_json and "timezone" in weather_json.get("sys", {}):
+            weather_json["timezone"] = weather_json["sys"]["timezone"]
+        responses[str(weather_json["id"])] = weather_json
+    return responses
+
+
+class WeatherClient:
+    """
+    Fetches from the open weather api over a pool of kept alive connections, with timeouts,
+    and retries throttled or failed requests with exponential backoff.
+    A request that is slow to answer can be hedged: sent again on another connection, with
+    whichever answers first used
+    """
+    def __init__(self, pool_size=DEFAULT_WORKERS, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, retries=DEFAULT_RETRIES, backoff=0.5, coalesce=True,
+                 quota=None, hedge_delay=None, hedge_budget=DEFAULT_HEDGE_BUDGET, archive=None):
+        """
+        :param pool_size: The most connections kept open to each host
+        :param connect_timeout: Seconds to wait for a connection
+        :param read_timeout: Seconds to wait for the server to answer
+        :param retries: Times a request is tried again after a status in RETRY_STATUSES
+        :param backoff: Seconds waited before the first retry, doubling each time after
+        :param coalesce: Whether callers fetching a URL already being fetched share that
+         result, rather than each sending their own request
+        :param quota: A weather_quota.QuotaScheduler every request (and retry) waits on,
+         or None to send requests as soon as they are made
+        :param hedge_delay: Seconds to wait for an answer before sending the request
+         again, HEDGE_P95 to wait as long as the slowest 5% of recent requests took, or
+         None to never hedge
+        :param hedge_budget: The most requests that may be hedges, as a share of all
+         requests sent, so the api key's calls stay bounded
+        :param archive: A weather_archive.ObservationArchive every response fetched is
+         added to, or None to keep nothing
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        http = _load("requests")
+        self.session = http.Session()
+        self._adapter = http.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                      pool_maxsize=pool_size)
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        self.request_count = 0
+        self.retry_count = 0
+        self.flights = SingleFlight() if coalesce else None
+        self.quota = quota
+        self.hedge_delay = hedge_delay
+        self.hedge_budget = hedge_budget
+        self.hedge_count = 0
+        self.hedge_wins = 0  # Hedges that answered before the request they duplicated
+        self._latencies = collections.deque(maxlen=HEDGE_WINDOW)  # Recent request times
+        self._hedge_lock = threading.Lock()
+        self._hedge_pool = None  # Threads the requests wait on, made on the first hedge
+        self.archive = archive
+
+    def get(self, url, priority=weather_quota.INTERACTIVE):
+        """
+        Gets the URL, retrying while the server says it is busy or has failed.
+        A server that asks for a wait longer than MAX_RETRY_WAIT isn't retried
+        :param url: The URL to get the data from
+        :param priority: weather_quota.INTERACTIVE or BACKGROUND, for when requests have
+         to queue for the api key's limit
+        :return: The last response received
+        :raises requests.exceptions.RequestException: If the server can't be reached
+        :raises weather_quota.QuotaExceeded: If the api key's limit won't allow the
+         request in time
+        """
+        api_key = url_api_key(url)
+        attempt = 0
+        while True:
+            if self.quota is not None:
+                self.quota.acquire(api_key, priority)
+            self.request_count += 1
+            response = self._send(url, api_key)
+            if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                return response
+            # Wait longer each time, with jitter so many clients don't retry together
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                if int(retry_after) > MAX_RETRY_WAIT:
+                    return response  # Waiting that long would hang the caller
+                delay = max(delay, int(retry_after))
+            delay = min(delay, MAX_RETRY_WAIT)
+            response.close()
+            attempt += 1
+            self.retry_count += 1
+            time.sleep(delay)
+
+    def _send(self, url, api_key):
+        """
+        Sends one attempt, hedging it if it is slow and hedging is on
+        :param url: The URL to get the data from
+        :param api_key: The key the request is made with, for the quota
+        :return: The first response received
+        :raises requests.exceptions.RequestException: If neither request reached the server
+        """
+        delay = self._hedge_after()
+        started = time.monotonic()
+        if delay is None:
+            response = self.session.get(url=url, timeout=self.timeout)
+        else:
+            response = self._send_hedged(url, api_key, delay)
+        if self.hedge_delay == HEDGE_P95:
+            self._latencies.append(time.monotonic() - started)
+        return response
+
+    def _hedge_after(self):
+        """
+        :return: Seconds to wait before hedging a request, or None to not hedge it
         """
-        Define the argument parser that will be used to facilitate user input
+        if self.hedge_delay != HEDGE_P95:
+            return self.hedge_delay
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None  # Not enough seen yet to know what slow is
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def _send_hedged(self, url, api_key, delay):
+        """
+        Sends the request on another thread, and sends it again on another connection if
+        it hasn't been answered after the delay, while the budget and quota allow.
+        requests can't stop a request part way, so the slower of the two is left to finish
+        on its own and its response is closed
+        :return: The first response received, or the other if the first failed
+        :raises requests.exceptions.RequestException: If neither request reached the server
+        """
+        futures_module = _load("futures")
+        if self._hedge_pool is None:
+            with self._hedge_lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = futures_module.ThreadPoolExecutor(
+                        max_workers=self.pool_size * 2)
+        first = self._hedge_pool.submit(self.session.get, url=url, timeout=self.timeout)
+        done, _ = futures_module.wait([first], timeout=delay)
+        if done or not self._may_hedge(api_key):
+            return first.result()
+
+        started = weather_metrics.start()
+        second = self._hedge_pool.submit(self.session.get, url=url, timeout=self.timeout)
+        done, _ = futures_module.wait([first, second],
+                                      return_when=futures_module.FIRST_COMPLETED)
+        winner = second if second in done and first not in done else first
+        if winner.exception() is not None:  # Failed, so the other one is the answer
+            winner = second if winner is first else first
+        loser = second if winner is first else first
+        loser.add_done_callback(_close_response)
+        if winner is second:
+            self.hedge_wins += 1
+        weather_metrics.record("hedge", started, "win" if winner is second else "loss")
+        return winner.result()
+
+    def _may_hedge(self, api_key):
+        """
+        Counts a hedge against the budget and the api key's limit, if both allow it
+        :param api_key: The key the hedge would be made with
+        :return: Whether to send the hedge
+        """
+        with self._hedge_lock:
+            # Counting the hedge itself, so even the first slow request keeps to the budget
+            if self.hedge_count + 1 > self.hedge_budget * (self.request_count + 1):
+                return False
+            if self.quota is not None:
+                try:  # A hedge is only worth sending if it can go straight away
+                    self.quota.acquire(api_key, weather_quota.BACKGROUND, max_wait=0)
+                except weather_quota.QuotaExceeded:
+                    return False
+            self.hedge_count += 1
+            self.request_count += 1
+        return True
+
+    def stats(self):
+        """
+        Shows how well the connections are being reused
+        :return: A dictionary of requests sent, retries, connections opened, requests
+         that reused a connection, fetches that shared another's result, hedges sent and
+         hedges that answered first
+        """
+        pools = self._adapter.poolmanager.pools
+        connections = sum(pools[key].num_connections for key in pools.keys())
+        return {"requests": self.request_count, "retries": self.retry_count,
+                "connections": connections, "reused": self.request_count - connections,
+                "coalesced": 0 if self.flights is None else self.flights.coalesced,
+                "hedged": self.hedge_count, "hedge_wins": self.hedge_wins}
+
+    def close(self):
         """
-        self.command_parser = argparse.ArgumentParser(description="Weather Commands",
-                                                      argument_default=argparse.SUPPRESS,
-                                                      add_help=False)
-
-        # Help OR API key are required
-        # Add mutually exclusive group
-        help_api_group = self.command_parser.add_mutually_exclusive_group(required=True)
-
-        # The key for the api, must be present
-        help_api_group.add_argument("-api", help="The api key to access the weather."
-                                                 "  Mandatory if [help] is not present")
-        # Help should only be displayed if alone
-        help_api_group.add_argument("-help", action='store_true',
-                                    help="Display this help menu.  "
-                                         "Mandatory if [api] is not present")
-
-        # Some other commands needed
-
-        # Location
-        self.command_parser.add_argument("-city", help="Uses a city name as the location. Enter "
-                                                       "'[city]' or '[city],[country code]' ")
-        self.command_parser.add_argument("-cid", help="Uses a city ID as the location")
-        self.command_parser.add_argument("-gc",
-                                         help="Uses a geographical coordinates as the location."
-                                              "Enter '[latitude],[longitude]")
-        self.command_parser.add_argument("-z", help="Uses a zip as the location. Enter '[zip],"
-                                                    "[country code]' or it will default to US")
-
-        # Optional temperature argument
-
-        self.command_parser.add_argument("-temp", nargs="?", const='celsius',
-                                         help="Display the temperature in [celsius]"
-                                              " or [fahrenheit].  Default is celsius")
-
-        #  Other optional flags
-        self.command_parser.add_argument("-time", action='store_true',
-                                         help="Display the timezone")
-        self.command_parser.add_argument("-pressure", action='store_true',
-                                         help="Display the pressure")
-        self.command_parser.add_argument("-cloud", action='store_true',
-                                         help="Display the cloud levels")
-        self.command_parser.add_argument("-humidity", action='store_true',
-                                         help="Display the humidity")
-        self.command_parser.add_argument("-wind", action='store_true',
-                                         help="Display the wind")
-        self.command_parser.add_argument("-sunset", action='store_true',
-                                         help="Display the sunset time")
-        self.command_parser.add_argument("-sunrise", action='store_true',
-                                         help="Display the sunrise time")
+        Closes every connection in the pool, and writes out the archive
+        """
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        self.session.close()
+        if self.archive is not None:
+            self.archive.close()
+
+
+def _close_response(future):
+    """
+    Closes the response of a request that lost to its hedge, once it arrives
+    :param future: The Future of the request
+    """
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def parse_hedge_delay(text):
+    """
+    Reads the value of [-hedge]
+    :param text: Seconds, or "p95"
+    :return: The seconds as a float, or HEDGE_P95
+    :raises ValueError: If it is neither
+    """
+    return HEDGE_P95 if text == HEDGE_P95 else float(text)
+
+
+def _build_command_parser():
+    """
+    Defines the arguments the program takes
+    :return: The argparse parser
+    """
+    started = weather_metrics.start()
+    parsing = _load("argparse")
+    cache_module, spatial_module = _load("weather_cache"), _load("weather_spatial")
+    parser = parsing.ArgumentParser(description="Weather Commands",
+                                    argument_default=parsing.SUPPRESS, add_help=False)
+
+    # Help OR API key are required
+    # Add mutually exclusive group
+    help_api_group = parser.add_mutually_exclusive_group(required=True)
+
+    # The key for the api, must be present
+    help_api_group.add_argument("-api", help="The api key to access the weather."
+                                             "  Mandatory if [help] is not present")
+    # Help should only be displayed if alone
+    help_api_group.add_argument("-help", action='store_true',
+                                help="Display this help menu.  "
+                                     "Mandatory if [api] is not present")
+
+    # Some other commands needed
+
+    # Location
+    parser.add_argument("-city", help="Uses a city name as the location. Enter "
+                                      "'[city]' or '[city],[country code]' ")
+    parser.add_argument("-cid", help="Uses a city ID as the location")
+    parser.add_argument("-gc",
+                        help="Uses a geographical coordinates as the location."
+                             "Enter '[latitude],[longitude]")
+    parser.add_argument("-z", help="Uses a zip as the location. Enter '[zip],"
+                                   "[country code]' or it will default to US")
+
+    # Optional temperature argument
+
+    parser.add_argument("-temp", nargs="?", const='celsius',
+                        help="Display the temperature in [celsius]"
+                             " or [fahrenheit].  Default is celsius")
 
+    #  Other optional flags
+    parser.add_argument("-time", action='store_true',
+                        help="Display the timezone")
+    parser.add_argument("-pressure", action='store_true',
+                        help="Display the pressure")
+    parser.add_argument("-cloud", action='store_true',
+                        help="Display the cloud levels")
+    parser.add_argument("-humidity", action='store_true',
+                        help="Display the humidity")
+    parser.add_argument("-wind", action='store_true',
+                        help="Display the wind")
+    parser.add_argument("-sunset", action='store_true',
+                        help="Display the sunset time")
+    parser.add_argument("-sunrise", action='store_true',
+                        help="Display the sunrise time")
 
+    # Batch mode
+    parser.add_argument("-batch",
+                        help="Read one location query per line from a file "
+                             "(or '-' for stdin) instead of the command line")
+    parser.add_argument("-workers", type=int,
+                        help="The number of queries fetched at once in batch "
+                             "mode.  Default is " + str(DEFAULT_WORKERS))
+    parser.add_argument("-serve",
+                        help="Keep running and answer queries sent with "
+                             "weather_daemon.py to this unix socket path or "
+                             "host:port")
+    parser.add_argument("-nogroup", action='store_true',
+                        help="Fetch every [-cid] in batch mode on its own, "
+                             "rather than up to " + str(GROUP_SIZE) +
+                             " in one call")
+    parser.add_argument("-watch", type=float,
+                        help="Keep running, refresh the location (or every "
+                             "[-batch] location) this many seconds apart and "
+                             "show only what changed")
+    parser.add_argument("-jsonl", action='store_true',
+                        help="Show the changes found by [-watch] as lines of "
+                             "JSON instead of text")
+
+    # Response cache
+    parser.add_argument("-cache", nargs="?",
+                        const=cache_module.DEFAULT_CACHE_PATH,
+                        help="Reuse responses saved in a cache file.  "
+                             "Default is " + cache_module.DEFAULT_CACHE_PATH)
+    parser.add_argument("-ttl", type=float,
+                        help="Seconds a cached response is used for.  "
+                             "Default is " + str(cache_module.DEFAULT_TTL))
+    parser.add_argument("-cachesize", type=int,
+                        help="The most responses kept in the cache.  Default is "
+                             + str(cache_module.DEFAULT_MAX_ENTRIES))
+    parser.add_argument("-stale", type=float,
+                        help="Seconds past [-ttl] a cached response is still "
+                             "shown, marked as out of date, while it is "
+                             "refreshed in the background")
+
+    # Offline city index
+    parser.add_argument("-index",
+                        help="A city index made by weather_index.py, used to "
+                             "look up [-city] names without the server")
+    parser.add_argument("-spatial",
+                        help="A spatial index made by weather_spatial.py, used "
+                             "to snap [-gc] to the nearest city")
+    parser.add_argument("-snap", type=float,
+                        help="How many km from a city [-gc] may be and still "
+                             "snap to it.  Default is "
+                             + str(spatial_module.DEFAULT_RADIUS_KM))
+
+    # Network
+    parser.add_argument("-timeout", type=float,
+                        help="Seconds to wait for the server to answer.  "
+                             "Default is " + str(READ_TIMEOUT))
+    parser.add_argument("-retries", type=int,
+                        help="Times a throttled or failed request is tried "
+                             "again.  Default is " + str(DEFAULT_RETRIES))
+    parser.add_argument("-hedge", type=parse_hedge_delay,
+                        help="Send a request again on another connection if "
+                             "it hasn't been answered after this many seconds, "
+                             "or after the slowest 5%% of recent requests' time "
+                             "with 'p95', and use whichever answers first")
+    parser.add_argument("-hedgebudget", type=float,
+                        help="The most requests that may be sent again by "
+                             "[-hedge], as a percentage of all requests.  "
+                             "Default is " + str(int(DEFAULT_HEDGE_BUDGET * 100)))
+    parser.add_argument("-stats", nargs="?", const="json",
+                        choices=["json", "prometheus"],
+                        help="Time each phase of the run and print the timings "
+                             "to stderr at the end, as [json] or [prometheus] "
+                             "text.  Default is json")
+    parser.add_argument("-rate", type=float,
+                        help="Keep to this many calls a minute for each api "
+                             "key, e.g. " + str(weather_quota.DEFAULT_RATE) +
+                             " for a free key")
+    parser.add_argument("-burst", type=int,
+                        help="The most calls made at once under [-rate].  "
+                             "Default is " + str(weather_quota.DEFAULT_BURST))
+    parser.add_argument("-quotafile",
+                        help="A file that shares the [-rate] limit with other "
+                             "processes using the same file")
+    parser.add_argument("-quotawait", type=float,
+                        help="Seconds a call may wait under [-rate] before "
+                             "giving up.  Default is " +
+                             str(weather_quota.DEFAULT_MAX_WAIT))
+
+    # Keeping observations
+    parser.add_argument("-archive",
+                        help="A directory to add every observation fetched to, "
+                             "for queries over their history with "
+                             "weather_archive.py")
+
+    weather_metrics.record("parser_setup", started)
+    return parser
+
+
+_COMMAND_PARSER = {}  # The parser, and the argparse module it was built with
+
+
+def command_parser():
+    """
+    The parser is the same for every query, so it is only built the first time it is
+    needed in a process.  It is built again if argparse has been replaced, e.g. by a test
+    :return: The argparse parser
+    """
+    parsing = _load("argparse")
+    if _COMMAND_PARSER.get("argparse") is not parsing:
+        _COMMAND_PARSER["parser"] = _build_command_parser()
+        _COMMAND_PARSER["argparse"] = parsing
+    return _COMMAND_PARSER["parser"]
+
+
+# What quick_parse needs to know about each argument of the full parser
+_QUICK_FLAGS = {"help", "time", "pressure", "cloud", "humidity", "wind", "sunset", "sunrise",
+                "nogroup", "jsonl"}  # Take no value
+_QUICK_VALUES = {"api": str, "city": str, "cid": str, "gc": str, "z": str, "batch": str,
+                 "workers": int, "serve": str, "ttl": float, "cachesize": int, "index": str,
+                 "spatial": str, "snap": float, "timeout": float, "retries": int, "rate": float,
+                 "burst": int, "quotafile": str, "quotawait": float,
+                 "watch": float, "stale": float, "hedge": parse_hedge_delay,
+                 "hedgebudget": float, "archive": str}  # Take one value
+_QUICK_OPTIONAL = {"temp": ("celsius", None), "stats": ("json", ("json", "prometheus")),
+                   "cache": (None, None)}  # Value when left out, and the allowed values
+
+
+def quick_parse(args):
+    """
+    Reads arguments in the plain form almost every query uses, without argparse.
+    Anything else, including every mistake, is left to the full parser, which knows
+    how to report it
+    :param args: The arguments, as a list of strings
+    :return: The arguments given as a dictionary, or None if the full parser is needed
+    """
+    parsed = {}
+    position = 0
+    while position < len(args):
+        name = args[position][1:]
+        if not args[position].startswith("-") or name in parsed:
+            return None
+        following = args[position + 1] if position + 1 < len(args) else None
+        takes_value = following is not None and not following.startswith("-")
+        if name in _QUICK_FLAGS:
+            parsed[name] = True
+        elif name in _QUICK_VALUES and takes_value:
+            try:
+                parsed[name] = _QUICK_VALUES[name](following)
+            except ValueError:
+                return None
+            position += 1
+        elif name in _QUICK_OPTIONAL:
+            left_out, allowed = _QUICK_OPTIONAL[name]
+            value = following if takes_value else left_out
+            if value is None or (allowed is not None and value not in allowed):
+                return None
+            parsed[name] = value
+            position += 1 if takes_value else 0
+        else:
+            return None
+        position += 1
+    if ("api" in parsed) == ("help" in parsed):  # Exactly one of them is required
+        return None
+    return parsed
+
+
+class InputParser:
+    """
+    This class facilitates receiving a command line argument and using that to get relevant
+    weather data for the user
+    """
+    def __init__(self, cache=None, client=None, city_index=None, spatial_index=None):
+        """
+        Holds one query and what is shared for fetching it
+        :param cache: A weather_cache.ResponseCache to check before going to the network
+        :param client: A WeatherClient to fetch with.  Without one, each fetch opens
+         its own connection
+        :param city_index: A weather_index.CityIndex used to turn city names into IDs
+        :param spatial_index: A weather_spatial.SpatialIndex used to snap coordinates to
+         the nearest city
+        """
         self.user_input = {}  # The default input to be parsed in
+        self.query = None  # The WeatherQuery made from it by synthesise_request
+        self.cache = cache
+        self.client = client
+        self.city_index = city_index
+        self.spatial_index = spatial_index
+        # Where this query's calls queue for the api key's limit
+        self.priority = weather_quota.INTERACTIVE
 
-    def get_input(self):
+    @property
+    def command_parser(self):
+        """
+        :return: The argparse parser, shared by every InputParser
+        """
+        return command_parser()
+
+    def get_input(self, args=None):
         """
         Use the parser to obtain input, then convert the returned Namespace
         into a python dictionary for easy reading
+        :param args: The arguments to parse, defaults to the command line
         :return: the arguments given as a dictionary
         :raises:
         """
-        request_as_dict = vars(self.command_parser.parse_args())
+        started = weather_metrics.start()
+        request_as_dict = quick_parse(sys.argv[1:] if args is None else args)
+        if request_as_dict is None:
+            request_as_dict = vars(self.command_parser.parse_args(args))
+        if request_as_dict.get("workers") is not None and request_as_dict["workers"] < 1:
+            # Reported, and exited, the same way as argparse's own errors
+            self.command_parser.error("argument -workers: must be at least 1")
+        weather_metrics.record("parse_args", started)
         # DEBUG
         # print(type(self.command_parser))
         self.user_input = request_as_dict
@@ -102,45 +846,9 @@ class InputParser:
         :raises InvalidArgumentException: If the given arguments are bad
         """
 
-        # Sanitise the thing for multiple commands
-        if "help" in self.user_input:
-            if len(self.user_input) > 1:
-                raise InvalidArgumentException("[-help] should not be present with other arguments")
-            return True  # Help on its own is valid, so if here, the input is acceptable
-
-        group_one = ["city", "cid", "gc", "z"]  # One of these should be present.  No more, no less
-        group_one_count = 0  # Store the number of group one keys
-        for arg in self.user_input:
-            if arg in group_one:
-                group_one_count += 1
-
-        if group_one_count > 1:  # Too many location args
-            raise InvalidArgumentException("Only one instance of [-city],"
-                                           " [-cid], [-gc], or [-z] permitted")
-        if group_one_count == 0:  # Not enough location args
-            raise InvalidArgumentException("One instance of [-city], [-cid],"
-                                           " [-gc], or [-z] must be present")
-
-        # Test if user has input one location but no other information been asked
-        if group_one_count == 1 and len(self.user_input) == 0:
-            raise InvalidArgumentException("Only location and there is no "
-                                           "chosen information e.g., time or temperature ")
-
-        # Ensure actual information is asked for by the user
-        if "api" in self.user_input and len(self.user_input) < 3:
-            raise InvalidArgumentException("No chosen information flags (e.g. [-time],"
-                                           " [-sunrise], etc. See [-help]")
-        # Ensure the temp flag was either left at the default or changed to fahrenheit
-        if "temp" in self.user_input:
-            if self.user_input["temp"].lower() != "celsius" and \
-                    self.user_input["temp"].lower() != "fahrenheit":
-                raise InvalidArgumentException("Temperature must be in either celsius "
-                                               "or fahrenheit!")
-
-
-        # If no exception is raised, this must be valid!
-
-        return True
+        # Options such as [-batch] don't change the query, so leave them out of the checks
+        return check_input({arg: value for arg, value in self.user_input.items()
+                            if arg not in RUNTIME_OPTIONS})
 
     def synthesise_request(self):
         """
@@ -149,40 +857,25 @@ class InputParser:
         :return: Either the URL to get the information the user wants,
          or ERROR, or HELP (if help is called)
         """
+        started = weather_metrics.start()
         try:  # Test for any errors
-            self.is_valid()
+            if "help" in self.user_input:
+                self.is_valid()
+            else:
+                self.query = WeatherQuery.from_input(self.user_input)
         except InvalidArgumentException as arg_except:
+            weather_metrics.record("is_valid", started, "invalid")
             return ["ERROR", "ERROR: " + str(arg_except)]  # Get the message stored in the exception
+        weather_metrics.record("is_valid", started)
 
         if "help" in self.user_input:
             # At this point, it must be valid and so only the help arg is present
             return ["HELP", self.command_parser.format_help()]  # Get the help string
 
-        base_string = "http://api.openweathermap.org/data/2.5/weather?"  # The string the arguments
-        #  are added to
-        api_key = self.user_input['api']  # Get the api key for lookup
-
-        location = ""
-
-        # The following for loop looks for the one instance of the location
-        # argument and gives it to "location"
-        for location_arg in ["city", "cid", "gc", "z"]:
-            if location_arg in self.user_input:
-                if location_arg == "gc":  # This requires a little extra work to split
-                    lat_lon = self.user_input[location_arg].split(',')
-                    location += "lat=" + lat_lon[0] + "&" + "lon=" + lat_lon[1]
-                else:
-                    # Everything else is okay, as the arguments can be instantly applied.
-                    if location_arg == "cid":
-                        location += "id="
-                    elif location_arg == "z":
-                        location += "zip="
-                    elif location_arg == "city":
-                        location += "q="
-
-                    location += self.user_input[location_arg]
-
-        return ["SUCCESS", base_string + location + "&APPID=" + api_key]
+        started = weather_metrics.start()
+        url = self.query.url(self.city_index, self.spatial_index)
+        weather_metrics.record("synthesise_request", started)
+        return ["SUCCESS", url]
 
     def get_from_url(self, url):
         """
@@ -191,88 +884,529 @@ class InputParser:
         :return: The string with all the data the user wants
         """
 
-        my_response = requests.get(url=url)
-        if my_response.status_code == 401:  # Handle different errors
-            return "BAD_API"
-        if my_response.status_code == 404:
-            return "LOCATION_UNKNOWN"
-        if my_response.status_code != 200:  # Otherwise, return the error
-            return my_response.status_code
+        weather_json = age = None
+        if self.cache is not None:
+            started = weather_metrics.start()
+            weather_json = self.cache.get(url)
+            if weather_json is None:  # Expired entries can still be shown while refreshed
+                weather_json, age = self.cache.get_stale(url)
+            weather_metrics.record("cache", started, "miss" if weather_json is None else
+                                   "hit" if age is None else "stale")
+        if weather_json is None:  # Not cached, so it has to be fetched
+            error, weather_json = fetch(url, self.client, self.cache, self.priority)
+            if error is not None:
+                return error
+        elif age is not None:  # Stale, so show it now and fetch a fresh one for next time
+            revalidate(url, self.client, self.cache)
 
         # Everything is okay, we can proceed
-        weather_json = my_response.json()
+        started = weather_metrics.start()
+        output = format_weather(weather_json, self.user_input)
+        if age is not None:
+            output += describe_age(age)
+        weather_metrics.record("render", started)
+        return output
 
-        output_string = ""
 
-        # Get the timezone difference from UTC in hours
-        if "time" in self.user_input:
-            time_offset = weather_json["timezone"]//3600
-            # The following statement contains "ternary" operations (or as close as can
-            # get in python, which is just for the grammar of the response
-            output_string += "The timezone is " + str(abs(time_offset)) + " hour" \
-                             + ["s ", " "][abs(time_offset) == 1] + \
-                             ["before", "past"][time_offset > 0] + " GMT.  "
+def describe_age(age):
+    """
+    :param age: Seconds since a stale response was fetched
+    :return: The sentence added to the output to say it is out of date
+    """
+    minutes = int(age // 60)
+    return "This is from " + str(minutes) + (" minute" if minutes == 1 else " minutes") + \
+        " ago and is being updated.  "
 
-        if "sunrise" in self.user_input:
-            time_up = weather_json["sys"]["sunrise"]
-            output_string += "The sun rises at " \
-                             + str(datetime.datetime.utcfromtimestamp(time_up).strftime("%H:%M "))\
-                             + "GMT.  "
 
-        if "sunset" in self.user_input:
-            time_dn = weather_json["sys"]["sunset"]
-            output_string += "The sun sets at " \
-                             + str(datetime.datetime.utcfromtimestamp(time_dn).strftime("%H:%M ")) \
-                             + "GMT.  "
+_REVALIDATING = {}  # URLs of stale responses being fetched again to the Future of the fetch
+_REVALIDATING_LOCK = threading.Lock()
+MAX_REVALIDATING = 4  # Stale responses fetched again at once.  The rest wait their turn
+MAX_REVALIDATE_QUEUE = 200  # Refreshes waiting, past which a stale response isn't refreshed
+REVALIDATE_EXIT_WAIT = 0.5  # Seconds the program waits at exit for refreshes to finish
+_REVALIDATE_QUEUE = []  # The refreshes waiting for a thread, once one is needed
 
-        if "pressure" in self.user_input:
-            pressure = weather_json["main"]["pressure"]  # Get the pressure (in hPa)
-            output_string += "The pressure is " + str(pressure) + "hPa.  "
 
-        if "cloud" in self.user_input:
-            cloudiness = weather_json["clouds"]["all"]  # Get the percentage chance of clouds
-            output_string += "There is a " + str(cloudiness) + "% chance of clouds.  "
+def revalidate(url, client=None, cache=None):
+    """
+    Fetches a fresh response for a stale cached one on a few shared threads in the
+    background, where it is stored in the cache, unless the URL is already being fetched
+    that way.  If too many are already waiting it isn't fetched, and is refreshed the next
+    time it is asked for.  The threads don't keep the program from exiting: it only waits
+    REVALIDATE_EXIT_WAIT for them, so a single query updates the cache if the refresh is
+    quick, and otherwise it is left until the next
+    :param url: The URL to fetch
+    :param client: The WeatherClient to fetch with
+    :param cache: The cache to store the response in
+    :return: The Future of the fetch, or None if it already was being fetched or too many
+     are waiting
+    """
+    with _REVALIDATING_LOCK:
+        if url in _REVALIDATING or len(_REVALIDATING) >= MAX_REVALIDATE_QUEUE:
+            return None
+        future = _REVALIDATING[url] = _load("futures").Future()
+        if not _REVALIDATE_QUEUE:
+            _REVALIDATE_QUEUE.append(_load("queue").Queue())
+            for _ in range(MAX_REVALIDATING):
+                threading.Thread(target=_revalidate_forever, daemon=True).start()
+            atexit.register(_finish_revalidating)
+    _REVALIDATE_QUEUE[0].put((future, url, client, cache))
+    return future
 
-        if "humidity" in self.user_input:
-            humidity = weather_json["main"]["humidity"]
-            output_string += "The humidity is at " + str(humidity) + "%.  "
 
-        if "wind" in self.user_input:
-            wind = weather_json["wind"]
-            # Get the wind, convert it from m/s to k/h
-            output_string += "The wind is moving at " + str(wind["speed"]*3.6) + "km/h, "
-            output_string += "in a direction of " + str(wind["deg"]) + " degrees.  "
+def _revalidate_forever():
+    """
+    Fetches the refreshes from the queue, one at a time, until the program exits
+    """
+    while True:
+        future, url, client, cache = _REVALIDATE_QUEUE[0].get()
+        future.set_running_or_notify_cancel()
+        result = error = None
+        try:
+            result = fetch(url, client, cache, weather_quota.BACKGROUND)
+        except Exception as fetch_error:  # pylint: disable=broad-except
+            error = fetch_error  # Kept for whoever waits on the Future
+        with _REVALIDATING_LOCK:
+            del _REVALIDATING[url]
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
 
-        if "temp" in self.user_input:
-            temp_max = (weather_json["main"]["temp_max"] - 273.15)
-            temp_min = (weather_json["main"]["temp_min"] - 273.15)
 
-            temp_max = [(lambda temperature: temperature * 9/5 + 32)(temp_max),
-                        temp_max][self.user_input["temp"].lower() == "celsius"]
-            temp_min = [(lambda temperature: temperature * 9 / 5 + 32)(temp_min),
-                        temp_min][self.user_input["temp"].lower() == "celsius"]
+def _finish_revalidating():
+    """
+    Waits at exit, for no more than REVALIDATE_EXIT_WAIT, for the refreshes still running
+    """
+    with _REVALIDATING_LOCK:
+        running = list(_REVALIDATING.values())
+    _load("futures").wait(running, timeout=REVALIDATE_EXIT_WAIT)
 
 
-            output_string += "The temperature has a high of " + str(round(temp_max, 1)) + \
-                             " and a low of "+  str(round(temp_min, 1)) + " degrees " + \
-                             self.user_input["temp"].lower() + ".  "
+def describe_result(result):
+    """
+    Turns the value returned by get_from_url into the message shown to the user
+    :param result: The string or status code returned by get_from_url
+    :return: The message to display
+    """
+    if result == "BAD_API":
+        return "The api key is invalid!"
+    if result == "LOCATION_UNKNOWN":
+        return "The location entered cannot be found!"
+    if result == "TIMEOUT":
+        return "The weather service took too long to respond!"
+    if result == "CONNECTION_ERROR":
+        return "The weather service could not be reached!"
+    if result == "QUOTA_EXCEEDED":
+        return "The api key's call limit has been reached, try again later!"
+    if not isinstance(result, str) or result.isalpha():  # A status code is another
+        # miscellaneous error
+        return "A value was entered incorrectly"
+    return result  # Otherwise, it is the wanted results
 
-        return output_string
+
+def make_cache(user_input):
+    """
+    Opens the response cache asked for with [-cache], if any
+    :param user_input: The arguments given
+    :return: A weather_cache.ResponseCache, or None if no cache was asked for
+    """
+    if "cache" not in user_input:
+        return None
+    cache_module = _load("weather_cache")
+    return cache_module.ResponseCache(
+        user_input["cache"], user_input.get("ttl", cache_module.DEFAULT_TTL),
+        user_input.get("cachesize", cache_module.DEFAULT_MAX_ENTRIES),
+        user_input.get("stale", cache_module.DEFAULT_MAX_STALE))
+
+
+def make_city_index(user_input):
+    """
+    Opens the city index given with [-index], if any
+    :param user_input: The arguments given
+    :return: A weather_index.CityIndex, or None if no index was given
+    """
+    if "index" not in user_input:
+        return None
+    return _load("weather_index").CityIndex(user_input["index"])
+
+
+def make_spatial_index(user_input):
+    """
+    Loads the spatial index given with [-spatial], if any
+    :param user_input: The arguments given
+    :return: A weather_spatial.SpatialIndex, or None if no index was given
+    """
+    if "spatial" not in user_input:
+        return None
+    spatial_module = _load("weather_spatial")
+    return spatial_module.SpatialIndex.load(
+        user_input["spatial"], user_input.get("snap", spatial_module.DEFAULT_RADIUS_KM))
+
+
+def make_client(user_input):
+    """
+    Sets up the pooled connections, sized for the number of batch workers
+    :param user_input: The arguments given
+    :return: A WeatherClient
+    """
+    return WeatherClient(pool_size=user_input.get("workers", DEFAULT_WORKERS),
+                         read_timeout=user_input.get("timeout", READ_TIMEOUT),
+                         retries=user_input.get("retries", DEFAULT_RETRIES),
+                         quota=make_quota(user_input), hedge_delay=user_input.get("hedge"),
+                         hedge_budget=user_input.get("hedgebudget",
+                                                     DEFAULT_HEDGE_BUDGET * 100) / 100,
+                         archive=make_archive(user_input))
+
+
+def make_archive(user_input):
+    """
+    Opens the observation archive asked for with [-archive], if any.  It is written out
+    when the program exits, after any refreshes still running have finished.
+    If another process is writing to it, the query still runs, but without being archived
+    :param user_input: The arguments given
+    :return: A weather_archive.ObservationArchive, or None if no archive was asked for or
+     it can't be written to
+    """
+    if "archive" not in user_input:
+        return None
+    archive_module = _load("weather_archive")
+    try:
+        archive = archive_module.ObservationArchive(user_input["archive"])
+    except archive_module.ArchiveLocked as locked:
+        print(str(locked) + ", so this run's observations aren't being kept", file=sys.stderr)
+        return None
+    atexit.register(archive.close)
+    return archive
+
+
+def make_quota(user_input):
+    """
+    Sets up the call limit asked for with [-rate], if any
+    :param user_input: The arguments given
+    :return: A weather_quota.QuotaScheduler, or None if no limit was asked for
+    """
+    if "rate" not in user_input:
+        return None
+    return weather_quota.QuotaScheduler(
+        user_input["rate"], user_input.get("burst", weather_quota.DEFAULT_BURST),
+        user_input.get("quotafile"),
+        user_input.get("quotawait", weather_quota.DEFAULT_MAX_WAIT))
+
+
+def add_api_key(args, api_key):
+    """
+    Adds a default api key to a query that doesn't have its own
+    :param args: The arguments for the query, as a list of strings
+    :param api_key: The api key to add, or None to leave the arguments alone
+    :return: The arguments, with the key added if needed
+    """
+    if api_key is not None and "-api" not in args and "-help" not in args:
+        return args + ["-api", api_key]
+    return args
+
+
+def split_line(line):
+    """
+    Splits a batch line into arguments the way the shell would
+    :param line: The line, e.g. '-city "New York" -pressure'
+    :return: A list of the arguments, or None if the line can't be split, e.g. because of
+     a quote that isn't closed
+    """
+    try:
+        return _load("shlex").split(line)
+    except ValueError:
+        return None
+
+
+def prepare_query(args, shared=None):
+    """
+    Reads the arguments for a query and produces its URL
+    :param args: The arguments for the query, as a list of strings
+    :param shared: An InputParser whose cache, client and indexes the query uses
+    :return: The InputParser holding the query, and the result of synthesise_request
+    """
+    parser = InputParser() if shared is None else \
+        InputParser(shared.cache, shared.client, shared.city_index, shared.spatial_index)
+    try:
+        parser.get_input(args)
+    except SystemExit:  # argparse exits when it can't understand the arguments
+        return parser, ["ERROR", "ERROR: The arguments could not be read"]
+    return parser, parser.synthesise_request()
+
+
+def get_weather(query, shared=None):
+    """
+    Runs a query given as a value rather than as arguments, for programs that use this
+    one without its command line
+    :param query: A weather_query.WeatherQuery
+    :param shared: An InputParser whose cache, client and indexes the query uses
+    :return: The string with all the data asked for, or the error get_from_url gives
+    """
+    parser = InputParser() if shared is None else \
+        InputParser(shared.cache, shared.client, shared.city_index, shared.spatial_index)
+    parser.query = query
+    parser.user_input = query.to_input()
+    return parser.get_from_url(query.url(parser.city_index, parser.spatial_index))
+
+
+def run_query(args, shared=None):
+    """
+    Runs one query from start to finish, the same way the command line does
+    :param args: The arguments for the query, as a list of strings
+    :param shared: An InputParser whose cache, client and indexes the query uses
+    :return: The message to display for the query
+    """
+    parser, url_arr = prepare_query(args, shared)
+    if url_arr[0] != "SUCCESS":
+        return url_arr[1]  # The error, OR help
+    return describe_result(parser.get_from_url(url_arr[1]))
+
+
+def url_city_id(url):
+    """
+    Finds the city ID in a URL from synthesise_request, e.g. for [-cid], or a [-city]
+    the offline index knew
+    :param url: The URL
+    :return: The city ID as a string, or None if the URL isn't for a city ID, or its ID
+     isn't a number, e.g. [-cid abc], which is sent on its own so that it can't spoil a
+     group call
+    """
+    if not url.startswith(BASE_URL + "id="):
+        return None
+    city_id = url[len(BASE_URL + "id="):].partition("&")[0]
+    return city_id if city_id.isdigit() else None
+
+
+def url_api_key(url):
+    """
+    :param url: A URL for the open weather api
+    :return: The api key in the URL, or an empty string if there isn't one
+    """
+    for name, value in urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query):
+        if name.lower() == "appid":
+            return value
+    return ""
+
+
+def run_group(queries):
+    """
+    Runs city ID queries that share an api key using group calls, so that up to
+    GROUP_SIZE cities cost one request
+    :param queries: A list of (line, InputParser, url) tuples, for the same api key
+    :return: A list of (line, message) tuples
+    """
+    cache, client = queries[0][1].cache, queries[0][1].client
+    responses = {}  # City ID to its Observation, or the error from fetching it
+    for _, _, url in queries:
+        weather_json = None if cache is None else cache.get(url)
+        if weather_json is not None:
+            responses[url_city_id(url)] = Observation.from_json(weather_json)
+
+    api_key = queries[0][1].user_input["api"]
+    for city_ids in plan_groups([url_city_id(url) for _, _, url in queries
+                                 if url_city_id(url) not in responses]):
+        try:
+            error, group_json = fetch(group_url(city_ids, api_key), client,
+                                      priority=weather_quota.BACKGROUND)
+            found = {} if error is not None else split_group(group_json)
+        except BAD_RESPONSE_ERRORS:  # An error for this group's lines only
+            error, found = UNREADABLE_RESPONSE, {}
+        for city_id in city_ids:
+            # A city missing from the group response is unknown, like a 404 on its own
+            responses[city_id] = Observation.from_json(found[city_id]) if city_id in found \
+                else error or "LOCATION_UNKNOWN"
+        if cache is not None:
+            for _, _, url in queries:
+                if url_city_id(url) in found:
+                    cache.put(url, found[url_city_id(url)])
+
+    results = []
+    for line, parser, url in queries:
+        response = responses[url_city_id(url)]
+        if isinstance(response, Observation):
+            # The observation holds whatever the response had, so check this line's flags
+            if any(getattr(response, name) is None for flag in parser.user_input
+                   for name, _, _ in FIELDS.get(flag, ())):
+                response = UNREADABLE_RESPONSE
+            else:
+                try:
+                    response = format_weather(response, parser.user_input)
+                except BAD_RESPONSE_ERRORS:
+                    response = UNREADABLE_RESPONSE
+        results.append((line, describe_result(response)))
+    return results
+
+
+def read_batch(batch_file):
+    """
+    Yields the queries in a batch file, skipping blank lines and # comments
+    :param batch_file: An open file (or stdin) with one query per line
+    :return: A generator of the stripped lines
+    """
+    for line in batch_file:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def run_batch(lines, api_key=None, workers=DEFAULT_WORKERS, shared=None, group=True):
+    """
+    Runs many queries on a pool of threads, yielding each result as soon as it is ready.
+    Only a few queries per worker are read ahead, so the lines can be streamed from stdin.
+    City ID queries are held back until GROUP_SIZE different cities (or the end of the
+    input) are waiting, then fetched with one group call
+    :param lines: The queries, one string of arguments each e.g. '-cid 5 -temp'
+    :param api_key: The api key added to any line that doesn't have its own [-api]
+    :param workers: The number of queries fetched at once
+    :param shared: An InputParser whose cache, client and indexes every query uses
+    :param group: Whether to use group calls for city ID queries
+    :return: A generator of (line, message) tuples, in the order they finish
+    """
+    lines = iter(lines)
+    with _load("futures").ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}  # Futures that give a list of (line, message) tuples
+        groups = {}  # The city ID queries waiting for a group call, by api key
+        while True:
+            # Keep the pool busy without reading the whole input up front
+            for line in lines:
+                args = split_line(line)
+                if args is None:
+                    yield line, "ERROR: The arguments could not be read"
+                    continue
+                parser, url_arr = prepare_query(add_api_key(args, api_key), shared)
+                parser.priority = weather_quota.BACKGROUND  # Single queries go first
+                if url_arr[0] != "SUCCESS":
+                    yield line, url_arr[1]  # The error, OR help
+                    continue
+                if group and url_city_id(url_arr[1]) is not None:
+                    waiting = groups.setdefault(parser.user_input["api"], [])
+                    waiting.append((line, parser, url_arr[1]))
+                    if len({url_city_id(query[2]) for query in waiting}) < GROUP_SIZE:
+                        continue
+                    del groups[parser.user_input["api"]]
+                    pending[executor.submit(run_group, waiting)] = line
+                else:
+                    pending[executor.submit(_run_prepared, line, parser, url_arr[1])] = line
+                if len(pending) >= workers * 4:
+                    break
+            else:  # The input has run out, so send any groups that aren't full
+                for waiting in groups.values():
+                    pending[executor.submit(run_group, waiting)] = waiting[0][0]
+                groups.clear()
+            if not pending:
+                return
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                yield from future.result()
+
+
+def _run_prepared(line, parser, url):
+    try:
+        return [(line, describe_result(parser.get_from_url(url)))]
+    except BAD_RESPONSE_ERRORS:  # An error for this line, rather than the end of the batch
+        return [(line, UNREADABLE_RESPONSE)]
+
+
+def watch_targets(shared, lines=None):
+    """
+    Prepares the locations for [-watch]: each query in a batch, or the command line's
+    :param shared: The InputParser holding the command line's query, and the cache,
+     client and indexes every query uses
+    :param lines: The batch's queries, one string of arguments each, or None to watch
+     the command line's query
+    :return: A list of (label, url, user_input) tuples, and a list of the messages for
+     queries that couldn't be prepared
+    """
+    targets, errors = [], []
+    if lines is None:
+        url_arr = shared.synthesise_request()
+        if url_arr[0] != "SUCCESS":
+            return targets, [url_arr[1]]
+        return [(shared.query.location, url_arr[1], shared.user_input)], errors
+    for line in lines:
+        args = split_line(line)
+        if args is None:
+            errors.append(line + "\tERROR: The arguments could not be read")
+            continue
+        parser, url_arr = prepare_query(add_api_key(args, shared.user_input.get("api")),
+                                        shared)
+        if url_arr[0] == "SUCCESS":
+            targets.append((line, url_arr[1], parser.user_input))
+        else:
+            errors.append(line + "\t" + url_arr[1])
+    return targets, errors
+
+
+def fetch_described(url, shared):
+    """
+    Fetches for [-watch], describing any error the way it is shown to the user
+    :param url: The URL to get the data from
+    :param shared: The InputParser whose cache and client are used
+    :return: An (error message, decoded JSON) tuple, where only one of the two is not None
+    """
+    error, weather_json = fetch(url, shared.client, shared.cache, shared.priority)
+    return (None if error is None else describe_result(error)), weather_json
 
 
 if __name__ == "__main__":
+    if "-stats" in sys.argv:  # Before anything is set up, so that the set up is timed too
+        weather_metrics.enable()
     PARSER = InputParser()
     PARSER.get_input()
-    URL_ARR = PARSER.synthesise_request()
-    if URL_ARR[0] == "SUCCESS":  # Ensure that the URL is a valid URL
-        RESULT = PARSER.get_from_url(URL_ARR[1])
-        if RESULT == "BAD_API":
-            print("The api key is invalid!")
-        elif RESULT == "LOCATION_UNKNOWN":
-            print("The location entered cannot be found!")
-        elif RESULT.isalpha():  # If it is a number, it is another miscellaneous error
-            print("A value was entered incorrectly")
-        else:  # Otherwise, print the wanted results
-            print(RESULT)
+    if "stats" in PARSER.user_input and weather_metrics.active() is None:
+        # Given in a form the check above can't see, e.g. -stats=json or -stat, so only
+        # what comes after parsing is timed
+        weather_metrics.enable()
+    PARSER.cache = make_cache(PARSER.user_input)
+    PARSER.city_index = make_city_index(PARSER.user_input)
+    PARSER.spatial_index = make_spatial_index(PARSER.user_input)
+    if "watch" in PARSER.user_input:  # Keep refreshing, and show what changes
+        if "batch" in PARSER.user_input:
+            BATCH = PARSER.user_input["batch"]
+            with sys.stdin if BATCH == "-" else open(BATCH, encoding="utf-8") as BATCH_FILE:
+                TARGETS, ERRORS = watch_targets(PARSER, list(read_batch(BATCH_FILE)))
+        else:
+            TARGETS, ERRORS = watch_targets(PARSER)
+        for ERROR in ERRORS:
+            print(ERROR)
+        if TARGETS:
+            PARSER.client = make_client(PARSER.user_input)
+            try:
+                _load("weather_watch").Watcher(
+                    TARGETS, lambda url: fetch_described(url, PARSER), format_weather,
+                    "json" if "jsonl" in PARSER.user_input else "text").run(
+                        PARSER.user_input["watch"])
+            except KeyboardInterrupt:  # The way a watch is stopped
+                pass
+    elif "batch" in PARSER.user_input:  # Many queries, one per line
+        PARSER.client = make_client(PARSER.user_input)
+        BATCH = PARSER.user_input["batch"]
+        BATCH_FILE = sys.stdin if BATCH == "-" else open(BATCH, encoding="utf-8")
+        with BATCH_FILE:
+            for LINE, MESSAGE in run_batch(read_batch(BATCH_FILE),
+                                           PARSER.user_input.get("api"),
+                                           PARSER.user_input.get("workers", DEFAULT_WORKERS),
+                                           PARSER, "nogroup" not in PARSER.user_input):
+                print(LINE + "\t" + MESSAGE, flush=True)
+    elif "serve" in PARSER.user_input:  # Answer queries from other processes
+        PARSER.client = make_client(PARSER.user_input)
+        try:
+            _load("weather_daemon").serve(PARSER.user_input["serve"],
+                                          lambda args: run_query(
+                                              add_api_key(args, PARSER.user_input.get("api")),
+                                              PARSER))
+        except OSError as SERVE_ERROR:  # Most likely the address is taken
+            print("ERROR: Could not serve on " + PARSER.user_input["serve"] + ": " +
+                  str(SERVE_ERROR))
     else:
-        print(URL_ARR[1])  # Display the error, OR help, depending on what the user put
+        URL_ARR = PARSER.synthesise_request()
+        if URL_ARR[0] == "SUCCESS":  # Ensure that the URL is a valid URL
+            # Only now is the HTTP stack needed, so help and errors are shown without it
+            PARSER.client = make_client(PARSER.user_input)
+            # Flushed, so a stale answer is seen before its refresh finishes
+            print(describe_result(PARSER.get_from_url(URL_ARR[1])), flush=True)
+        else:
+            print(URL_ARR[1])  # Display the error, OR help, depending on what the user put
+    if "stats" in PARSER.user_input:
+        print(weather_metrics.active().export(PARSER.user_input["stats"]), file=sys.stderr)
@@ -0,0 +1,225 @@
+"""
+An offline index of open weather's city list, so that [-city] queries can be turned into
+city IDs without asking the server.
+The index is built once from city.list.json into a compact binary file, which is memory
+mapped and binary searched, so nothing has to be parsed when the program starts.
+
+Build it with: python weather_index.py city.list.json[.gz] city.index
+"""
+import array
+import bisect
+import gzip
+import json
+import mmap
+import struct
+import sys
+import unicodedata
+
+
+MAGIC = b"WFCI"
+VERSION = 1
+HEADER = struct.Struct("<4sII")  # Magic, version, number of cities
+SEPARATOR = "\x00"  # Between the name and country in a key, sorting before any letter
+
+
+def normalise(text):
+    """
+    Makes names compare the same regardless of case, accents or spacing
+    :param text: A city name or country code
+    :return: The normalised text
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+
+def split_city(city_arg):
+    """
+    Splits a [-city] argument of '[city]' or '[city],[country code]'
+    :param city_arg: The argument given
+    :return: A (name, country or None) tuple
+    """
+    name, _, country = city_arg.rpartition(",")
+    if not name:  # No country was given
+        return city_arg, None
+    return name, country
+
+
+def build_index(cities, index_path):
+    """
+    Writes the binary index.  The file is a header, then four arrays of the same length
+    (key offsets, city IDs, latitudes, longitudes) sorted by key, then the keys themselves
+    :param cities: The decoded city list, a list of dictionaries with id, name, country
+     and coord
+    :param index_path: The file to write the index to
+    :return: The number of cities written
+    """
+    entries = sorted(((normalise(city["name"]) + SEPARATOR + normalise(city["country"]))
+                      .encode("utf-8"), city["id"], city["coord"]["lat"], city["coord"]["lon"])
+                     for city in cities if city.get("name"))
+    offsets, city_ids = array.array("I", [0]), array.array("I")
+    latitudes, longitudes = array.array("f"), array.array("f")
+    keys = bytearray()
+    for key, city_id, latitude, longitude in entries:
+        keys += key
+        offsets.append(len(keys))
+        city_ids.append(city_id)
+        latitudes.append(latitude)
+        longitudes.append(longitude)
+
+    with open(index_path, "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, VERSION, len(city_ids)))
+        for column in (offsets, city_ids, latitudes, longitudes):
+            if sys.byteorder != "little":
+                column.byteswap()
+            column.tofile(index_file)
+        index_file.write(keys)
+    return len(city_ids)
+
+
+def build_index_from_file(city_list_path, index_path):
+    """
+    Builds the index from open weather's city.list.json, which may be gzipped
+    :param city_list_path: The path to city.list.json or city.list.json.gz
+    :param index_path: The file to write the index to
+    :return: The number of cities written
+    """
+    opener = gzip.open if city_list_path.endswith(".gz") else open
+    with opener(city_list_path, "rt", encoding="utf-8") as city_list:
+        return build_index(json.load(city_list), index_path)
+
+
+class CityIndex:
+    """
+    Looks up city IDs by name from a memory mapped index file
+    """
+    def __init__(self, index_path):
+        """
+        :param index_path: A file made by build_index
+        :raises ValueError: If the file isn't an index
+        """
+        with open(index_path, "rb") as index_file:
+            self._map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(index_path + " is not a city index")
+        self._offsets = HEADER.size
+        self._ids = self._offsets + (self.count + 1) * 4
+        self._latitudes = self._ids + self.count * 4
+        self._longitudes = self._latitudes + self.count * 4
+        self._keys = self._longitudes + self.count * 4
+        self._sorted_keys = _Keys(self)
+
+    def __len__(self):
+        return self.count
+
+    def key(self, position):
+        """
+        :param position: The position of a city in the index
+        :return: The key of the city, as bytes
+        """
+        start, end = struct.unpack_from("<II", self._map, self._offsets + position * 4)
+        return self._map[self._keys + start:self._keys + end]
+
+    def city_id(self, position):
+        """
+        :param position: The position of a city in the index
+        :return: The open weather ID of the city
+        """
+        return struct.unpack_from("<I", self._map, self._ids + position * 4)[0]
+
+    def column(self, name):
+        """
+        Copies a whole column out of the index, which is much faster than reading it one
+        city at a time
+        :param name: "ids", "latitudes" or "longitudes"
+        :return: An array of the column
+        """
+        start = {"ids": self._ids, "latitudes": self._latitudes,
+                 "longitudes": self._longitudes}[name]
+        column = array.array("I" if name == "ids" else "f")
+        column.frombytes(self._map[start:start + self.count * 4])
+        if sys.byteorder != "little":
+            column.byteswap()
+        return column
+
+    def _search(self, prefix):
+        """
+        :param prefix: The start of a key, as bytes
+        :return: A generator of the positions of every key starting with the prefix
+        """
+        position = bisect.bisect_left(self._sorted_keys, prefix)
+        while position < self.count:
+            key = self.key(position)
+            if not key.startswith(prefix):
+                return
+            yield position
+            position += 1
+
+    def lookup(self, name, country=None):
+        """
+        Finds cities whose name is exactly the one given
+        :param name: The name of the city
+        :param country: The country code, or None for any country
+        :return: A list of matching city IDs
+        """
+        prefix = (normalise(name) + SEPARATOR).encode("utf-8")
+        if country is None:
+            return [self.city_id(position) for position in self._search(prefix)]
+        key = prefix + normalise(country).encode("utf-8")
+        return [self.city_id(position) for position in self._search(key)
+                if self.key(position) == key]
+
+    def prefix(self, start, country=None, limit=10):
+        """
+        Finds cities whose name starts with the given text, e.g. for suggestions
+        :param start: The start of the name
+        :param country: The country code, or None for any country
+        :param limit: The most cities to return
+        :return: A list of (normalised name, country code, city ID) tuples
+        """
+        country = None if country is None else normalise(country)
+        results = []
+        for position in self._search(normalise(start).encode("utf-8")):
+            name, _, city_country = self.key(position).decode("utf-8").partition(SEPARATOR)
+            if country is None or city_country == country:
+                results.append((name, city_country, self.city_id(position)))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def resolve(self, city_arg):
+        """
+        Turns a [-city] argument into a city ID, if there is exactly one city it could be
+        :param city_arg: '[city]' or '[city],[country code]'
+        :return: The city ID, or None if the city is unknown or ambiguous
+        """
+        city_ids = set(self.lookup(*split_city(city_arg)))
+        return city_ids.pop() if len(city_ids) == 1 else None
+
+    def close(self):
+        """
+        Unmaps the index file
+        """
+        self._map.close()
+
+
+class _Keys:
+    """
+    Lets bisect search the keys in the index file without reading them all
+    """
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.count
+
+    def __getitem__(self, position):
+        return self.index.key(position)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python weather_index.py city.list.json[.gz] city.index")
+    else:
+        print("Indexed " + str(build_index_from_file(sys.argv[1], sys.argv[2])) + " cities")
@@ -0,0 +1,151 @@
+"""
+Times each phase of a query, such as setting up the argument parser, waiting for the
+server, decoding the JSON and rendering the output, so that a slow query shows where its
+time went.  Timings are kept as a count, a total and a histogram for each phase and
+status code, and can be exported in the Prometheus text format or as JSON.
+
+Timing is off until enable is called.  While it is off, start returns None and record
+returns straight away, so the hooks cost next to nothing
+"""
+import json
+import threading
+import time
+
+
+# Upper bounds of the histogram buckets, in seconds.  Parsing takes microseconds and
+# fetching takes up to the read timeout, so the buckets cover both
+BUCKETS = (0.00001, 0.0001, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+           10.0)
+
+_ACTIVE = None  # The Metrics being recorded into, or None while timing is off
+
+
+class Metrics:
+    """
+    Collects the timings of each phase, by phase and status code
+    """
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: Upper bounds of the histogram buckets, in seconds, in order
+        """
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._phases = {}  # (phase, status) to a [count, total seconds, bucket counts] list
+
+    def observe(self, phase, seconds, status=None):
+        """
+        Adds one timing
+        :param phase: The name of the phase, e.g. "render"
+        :param seconds: How long it took
+        :param status: The HTTP status code or error it ended with, if it has one
+        """
+        key = (phase, None if status is None else str(status))
+        with self._lock:
+            timing = self._phases.get(key)
+            if timing is None:
+                timing = self._phases[key] = [0, 0.0, [0] * len(self.buckets)]
+            timing[0] += 1
+            timing[1] += seconds
+            for position, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    timing[2][position] += 1
+                    break
+
+    def snapshot(self):
+        """
+        :return: A dictionary of phase to a dictionary of status (or "" for phases without
+         one) to the count, total seconds and the cumulative count in each bucket
+        """
+        with self._lock:
+            phases = {}
+            for (phase, status), (count, total, buckets) in sorted(
+                    self._phases.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+                cumulative, running = [], 0
+                for bucket_count in buckets:
+                    running += bucket_count
+                    cumulative.append(running)
+                phases.setdefault(phase, {})[status or ""] = {
+                    "count": count, "sum": total, "buckets": cumulative}
+        return phases
+
+    def to_json(self):
+        """
+        :return: The timings as a JSON string, with the bucket bounds they were counted in
+        """
+        return json.dumps({"buckets": list(self.buckets), "phases": self.snapshot()},
+                          indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        :return: The timings in the Prometheus text exposition format
+        """
+        lines = ["# HELP weather_phase_seconds Time spent in each phase of a query",
+                 "# TYPE weather_phase_seconds histogram"]
+        for phase, statuses in self.snapshot().items():
+            for status, timing in statuses.items():
+                labels = 'phase="' + phase + '"' + (',status="' + status + '"' if status else "")
+                for bound, count in zip([repr(bound) for bound in self.buckets] + ["+Inf"],
+                                        timing["buckets"] + [timing["count"]]):
+                    lines.append("weather_phase_seconds_bucket{" + labels + ',le="' + bound +
+                                 '"} ' + str(count))
+                lines.append("weather_phase_seconds_sum{" + labels + "} " + repr(timing["sum"]))
+                lines.append("weather_phase_seconds_count{" + labels + "} " +
+                             str(timing["count"]))
+        return "\n".join(lines) + "\n"
+
+    def export(self, style="json"):
+        """
+        :param style: "json" or "prometheus"
+        :return: The timings in that format
+        :raises ValueError: If the format is unknown
+        """
+        if style == "json":
+            return self.to_json()
+        if style == "prometheus":
+            return self.to_prometheus()
+        raise ValueError("Unknown stats format: " + style)
+
+
+def enable(metrics=None):
+    """
+    Turns timing on
+    :param metrics: The Metrics to record into, or None for a new one
+    :return: The Metrics being recorded into
+    """
+    global _ACTIVE  # pylint: disable=global-statement
+    _ACTIVE = Metrics() if metrics is None else metrics
+    return _ACTIVE
+
+
+def disable():
+    """
+    Turns timing off
+    """
+    global _ACTIVE  # pylint: disable=global-statement
+    _ACTIVE = None
+
+
+def active():
+    """
+    :return: The Metrics being recorded into, or None while timing is off
+    """
+    return _ACTIVE
+
+
+def start():
+    """
+    Marks the start of a phase
+    :return: The time now, or None while timing is off
+    """
+    return None if _ACTIVE is None else time.monotonic()
+
+
+def record(phase, started, status=None):
+    """
+    Marks the end of a phase started with start
+    :param phase: The name of the phase
+    :param started: What start returned
+    :param status: The HTTP status code or error it ended with, if it has one
+    """
+    if started is not None and _ACTIVE is not None:
+        _ACTIVE.observe(phase, time.monotonic() - started, status)
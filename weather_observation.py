@@ -0,0 +1,111 @@
+"""
+A compact record of one weather response, holding only the values the program prints.
+A decoded response is a tree of dictionaries that is mostly fields nobody asked for, so
+observations are kept instead wherever many responses are held at once.
+A response that is rendered once and thrown away is read in place with a ResponseView
+"""
+
+
+# The fields each flag needs, as (field, section, key) tuples, where the value is
+# response[section][key], or response[key] if there is no section
+FIELDS = {
+    "time": [("timezone", None, "timezone")],
+    "sunrise": [("sunrise", "sys", "sunrise")],
+    "sunset": [("sunset", "sys", "sunset")],
+    "pressure": [("pressure", "main", "pressure")],
+    "cloud": [("clouds", "clouds", "all")],
+    "humidity": [("humidity", "main", "humidity")],
+    "wind": [("wind_speed", "wind", "speed"), ("wind_deg", "wind", "deg")],
+    "temp": [("temp_max", "main", "temp_max"), ("temp_min", "main", "temp_min")],
+}
+
+_ALL_FIELDS = [field for wanted in FIELDS.values() for field in wanted]
+
+
+class Observation:
+    """
+    The values from one response.  A field is None if it wasn't extracted
+    """
+    __slots__ = ("timezone", "sunrise", "sunset", "pressure", "clouds", "humidity",
+                 "wind_speed", "wind_deg", "temp_max", "temp_min")
+
+    def __init__(self, timezone=None, sunrise=None, sunset=None, pressure=None, clouds=None,
+                 humidity=None, wind_speed=None, wind_deg=None, temp_max=None, temp_min=None):
+        self.timezone = timezone
+        self.sunrise = sunrise
+        self.sunset = sunset
+        self.pressure = pressure
+        self.clouds = clouds
+        self.humidity = humidity
+        self.wind_speed = wind_speed
+        self.wind_deg = wind_deg
+        self.temp_max = temp_max
+        self.temp_min = temp_min
+
+    @classmethod
+    def from_json(cls, weather_json, user_input=None):
+        """
+        Pulls the values out of a decoded response, skipping the sections the flags don't
+        need
+        :param weather_json: The decoded JSON response
+        :param user_input: The arguments given, which say what information is wanted.
+         Without them every section the response has is extracted
+        :return: The observation
+        :raises KeyError: If the response is missing something the flags ask for
+        """
+        observation = cls()
+        if user_input is None:
+            for name, section, key in _ALL_FIELDS:
+                source = weather_json if section is None else weather_json.get(section, ())
+                if key in source:  # Only take what is there
+                    setattr(observation, name, source[key])
+            return observation
+        for flag in user_input:
+            for name, section, key in FIELDS.get(flag, ()):
+                source = weather_json if section is None else weather_json[section]
+                setattr(observation, name, source[key])
+        return observation
+
+    def __eq__(self, other):
+        if not isinstance(other, Observation):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return "Observation(" + ", ".join(name + "=" + repr(getattr(self, name))
+                                          for name in self.__slots__
+                                          if getattr(self, name) is not None) + ")"
+
+
+def _view_field(section, key):
+    """
+    :return: A property reading response[section][key], or response[key] without a section
+    """
+    if section is None:
+        return property(lambda view: view.weather_json[key])
+    return property(lambda view: view.weather_json[section][key])
+
+
+class ResponseView:
+    """
+    Reads the same fields as an Observation straight from a decoded response, for a
+    response that is only rendered once and so isn't worth copying
+    """
+    __slots__ = ("weather_json",)
+
+    timezone = _view_field(None, "timezone")
+    sunrise = _view_field("sys", "sunrise")
+    sunset = _view_field("sys", "sunset")
+    pressure = _view_field("main", "pressure")
+    clouds = _view_field("clouds", "all")
+    humidity = _view_field("main", "humidity")
+    wind_speed = _view_field("wind", "speed")
+    wind_deg = _view_field("wind", "deg")
+    temp_max = _view_field("main", "temp_max")
+    temp_min = _view_field("main", "temp_min")
+
+    def __init__(self, weather_json):
+        """
+        :param weather_json: The decoded JSON response
+        """
+        self.weather_json = weather_json
@@ -0,0 +1,204 @@
+"""
+A query for the open weather api as a plain value, so that other programs can ask for
+the weather without going through the command line.  A WeatherQuery is checked by the
+same rules as the command line's arguments when it is made, can't be changed afterwards,
+and can be used as a dictionary key, e.g. to cache or share results by query
+"""
+import collections
+
+from weather_observation import FIELDS
+
+
+BASE_URL = "http://api.openweathermap.org/data/2.5/weather?"  # A single location
+
+LOCATIONS = ["city", "cid", "gc", "z"]  # The ways of giving a location.  One is needed
+INFORMATION = [flag for flag in FIELDS if flag != "temp"]  # Flags that take no value
+TEMPERATURE_UNITS = ["celsius", "fahrenheit"]
+
+
+# Exception for when the arguments are invalid
+class InvalidArgumentException(Exception):
+    """
+    An error class to raise if the user inputs something incorrectly
+    """
+    def __init__(self, to_display="The arguments entered were invalid"):
+        Exception.__init__(self)
+        self.message = to_display
+
+    def __str__(self):
+        return self.message
+
+
+def check_input(user_input):
+    """
+    Checks if the arguments for a query are valid for use with the open weather api
+    :param user_input: The arguments as a dictionary, without options such as [-batch]
+     that don't change the query
+    :return: True if the input is valid, otherwise raises an exception
+    :raises InvalidArgumentException: If the given arguments are bad
+    """
+    # Sanitise the thing for multiple commands
+    if "help" in user_input:
+        if len(user_input) > 1:
+            raise InvalidArgumentException("[-help] should not be present with other arguments")
+        return True  # Help on its own is valid, so if here, the input is acceptable
+
+    group_one_count = 0  # Store the number of location keys.  No more, no less than one
+    for arg in user_input:
+        if arg in LOCATIONS:
+            group_one_count += 1
+
+    if group_one_count > 1:  # Too many location args
+        raise InvalidArgumentException("Only one instance of [-city],"
+                                       " [-cid], [-gc], or [-z] permitted")
+    if group_one_count == 0:  # Not enough location args
+        raise InvalidArgumentException("One instance of [-city], [-cid],"
+                                       " [-gc], or [-z] must be present")
+
+    # Test if user has input one location but no other information been asked
+    if group_one_count == 1 and len(user_input) == 0:
+        raise InvalidArgumentException("Only location and there is no "
+                                       "chosen information e.g., time or temperature ")
+
+    # Ensure actual information is asked for by the user
+    if "api" in user_input and len(user_input) < 3:
+        raise InvalidArgumentException("No chosen information flags (e.g. [-time],"
+                                       " [-sunrise], etc. See [-help]")
+    # Ensure the temp flag was either left at the default or changed to fahrenheit
+    if "temp" in user_input:
+        if user_input["temp"].lower() not in TEMPERATURE_UNITS:
+            raise InvalidArgumentException("Temperature must be in either celsius "
+                                           "or fahrenheit!")
+
+    # If no exception is raised, this must be valid!
+
+    return True
+
+
+class WeatherQuery(collections.namedtuple("WeatherQuery",
+                                          ["api", "location_type", "location", "fields",
+                                           "temp"])):
+    """
+    One query: where, what information, and the temperature unit.
+    fields is a frozenset of flags from INFORMATION, and temp is the unit the temperature
+    is wanted in, or None if it isn't wanted
+    """
+    __slots__ = ()
+
+    def __new__(cls, api, location_type, location, fields=(), temp=None):
+        """
+        :param api: The api key
+        :param location_type: How the location is given: "city", "cid", "gc" or "z"
+        :param location: The city name, city ID, "latitude,longitude" or zip code
+        :param fields: The information wanted, e.g. ["time", "wind"]
+        :param temp: "celsius" or "fahrenheit" if the temperature is wanted
+        :raises InvalidArgumentException: If that isn't a valid query
+        """
+        query = _make_query(api, location_type, location, fields, temp)
+        check_input(query.to_input())
+        return query
+
+    @classmethod
+    def from_input(cls, user_input):
+        """
+        Makes a query from the arguments given on the command line.  Options that don't
+        change the query, such as [-batch], are ignored
+        :param user_input: The arguments given, as a dictionary
+        :return: The WeatherQuery
+        :raises InvalidArgumentException: If the arguments aren't a valid query, or only
+         ask for help
+        """
+        check_input({arg: value for arg, value in user_input.items()
+                     if arg in _QUERY_ARGS})
+        if "help" in user_input:
+            raise InvalidArgumentException("[-help] is not a query")
+        location_type = [arg for arg in LOCATIONS if arg in user_input][0]
+        # Already checked as arguments, so not checked again as a query
+        return _make_query(user_input.get("api"), location_type, user_input[location_type],
+                           [flag for flag in INFORMATION if flag in user_input],
+                           user_input.get("temp"))
+
+    @classmethod
+    def _make(cls, iterable):  # pylint: disable=arguments-differ
+        """
+        Makes a query from a sequence of its values, checked like any other, so _replace
+        (which uses this) can't make a query that isn't valid either
+        :raises InvalidArgumentException: If that isn't a valid query
+        """
+        return cls(*iterable)
+
+    def to_input(self):
+        """
+        :return: The query as the dictionary of arguments the command line would give
+        """
+        user_input = {"api": self.api, self.location_type: self.location}
+        for flag in self.fields:
+            user_input[flag] = True
+        if self.temp is not None:
+            user_input["temp"] = self.temp
+        return user_input
+
+    def url(self, city_index=None, spatial_index=None):
+        """
+        Produces the URL to get the information from the open weather api
+        :param city_index: A weather_index.CityIndex used to turn city names into IDs
+        :param spatial_index: A weather_spatial.SpatialIndex used to snap coordinates to
+         the nearest city
+        :return: The URL
+        """
+        if self.location_type == "gc":  # This requires a little extra work to split
+            lat_lon = self.location.split(',')
+            city_id = _snap(spatial_index, lat_lon)
+            if city_id is not None:  # Close enough to a known city to use it
+                location = "id=" + str(city_id)
+            else:
+                location = "lat=" + lat_lon[0] + "&" + "lon=" + lat_lon[1]
+        elif self.location_type == "city":
+            # Use the city's ID if the offline index knows exactly which it is
+            city_id = None if city_index is None else city_index.resolve(self.location)
+            location = "q=" + self.location if city_id is None else "id=" + str(city_id)
+        else:
+            location = ("id=" if self.location_type == "cid" else "zip=") + self.location
+        return BASE_URL + location + "&APPID=" + self.api
+
+
+# The arguments that make up a query, rather than say how the program runs
+_QUERY_ARGS = set(["api", "help", "temp"] + LOCATIONS + INFORMATION)
+
+
+def _make_query(api, location_type, location, fields, temp):
+    """
+    Checks the values that the rules for arguments don't cover, and makes the query
+    :return: The WeatherQuery
+    :raises InvalidArgumentException: If a value can't be used
+    """
+    if not api:
+        raise InvalidArgumentException("An api key must be given with [-api]")
+    if location_type not in LOCATIONS:
+        raise InvalidArgumentException("One instance of [-city], [-cid],"
+                                       " [-gc], or [-z] must be present")
+    if location_type == "gc" and str(location).count(",") != 1:
+        raise InvalidArgumentException("[-gc] must be a latitude and longitude, "
+                                       "e.g. 51.5,-0.12")
+    fields = frozenset(fields)
+    unknown = fields.difference(INFORMATION)
+    if unknown:
+        raise InvalidArgumentException("Unknown information flags: " +
+                                       ", ".join(sorted(unknown)))
+    return tuple.__new__(WeatherQuery, (api, location_type, str(location), fields,
+                                        None if temp is None else temp.lower()))
+
+
+def _snap(spatial_index, lat_lon):
+    """
+    Finds the known city nearest to a [-gc] location, using the spatial index
+    :param spatial_index: A weather_spatial.SpatialIndex, or None
+    :param lat_lon: The latitude and longitude, as strings
+    :return: The city ID, or None if there is no index or no city close enough
+    """
+    if spatial_index is None:
+        return None
+    try:
+        return spatial_index.snap(float(lat_lon[0]), float(lat_lon[1]))
+    except ValueError:  # Not numbers, so leave the api to report it
+        return None
@@ -0,0 +1,174 @@
+"""
+Keeps calls to the open weather api under the api key's limit, with a token bucket for
+each key.  Callers waiting for a token are served in priority order, so a query someone
+is waiting on goes ahead of batch work, and a call that would have to wait too long fails
+straight away instead of being throttled by the server.
+
+The buckets can be kept in a file, locked while they are updated, so that every process
+using the same file shares the same limit
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows, where buckets can only be shared by threads
+    fcntl = None
+
+
+INTERACTIVE = 0  # Someone is waiting for the answer
+BACKGROUND = 1  # Batch work, which can wait its turn
+
+DEFAULT_RATE = 60  # Calls a minute, the limit of a free api key
+DEFAULT_BURST = 10  # Calls that can be made at once after a quiet spell
+DEFAULT_MAX_WAIT = 30  # Seconds a call may wait for a token before failing
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when a call can't be made within the api key's limit in time
+    """
+    def __init__(self, wait):
+        Exception.__init__(self)
+        self.wait = wait  # Seconds until a token would have been free
+
+    def __str__(self):
+        return "The api key's call limit is used up for the next %.1f seconds" % self.wait
+
+
+class QuotaScheduler:
+    """
+    Hands out tokens for api calls, one bucket for each api key
+    """
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, path=None,
+                 max_wait=DEFAULT_MAX_WAIT):
+        """
+        :param rate: Calls allowed a minute
+        :param burst: The most tokens a bucket holds, so the most calls made at once
+        :param path: A file to keep the buckets in, shared with other processes, or None
+         to keep them in this process
+        :param max_wait: Seconds a call may wait for a token before QuotaExceeded is raised
+        :raises ValueError: If the buckets can't be shared on this system
+        """
+        if path is not None and fcntl is None:
+            raise ValueError("Sharing the api limit between processes needs fcntl")
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        self.max_wait = max_wait
+        self._buckets = {}  # Key hash to a [tokens, time last filled] list, without a file
+        self._waiting = {}  # Key hash to a heap of the (priority, order) of each waiter
+        self._order = itertools.count()  # Keeps waiters of the same priority in turn
+        self._condition = threading.Condition()
+        self.granted = 0
+        self.rejected = 0
+
+    def acquire(self, api_key, priority=INTERACTIVE, max_wait=None):
+        """
+        Waits for a token to make one call with
+        :param api_key: The key the call is made with
+        :param priority: INTERACTIVE or BACKGROUND.  Lower priorities are served first
+        :param max_wait: Seconds to wait at most, defaulting to the scheduler's
+        :raises QuotaExceeded: If a token won't be free in time
+        """
+        key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]  # Not the key itself
+        deadline = time.time() + (self.max_wait if max_wait is None else max_wait)
+        ticket = (priority, next(self._order))
+        with self._condition:
+            waiting = self._waiting.setdefault(key, [])
+            heapq.heappush(waiting, ticket)
+            try:
+                while True:
+                    ahead = sum(1 for other in waiting if other < ticket)
+                    wait = self._take(key, waiting[0] == ticket, ahead)
+                    if wait == 0:
+                        self.granted += 1
+                        return
+                    if time.time() + wait > deadline:
+                        self.rejected += 1
+                        raise QuotaExceeded(wait)
+                    self._condition.wait(wait)
+            finally:
+                waiting.remove(ticket)
+                heapq.heapify(waiting)
+                self._condition.notify_all()  # The next waiter may be able to go
+
+    def _take(self, key, take, ahead):
+        """
+        Fills the bucket for the time passed, then takes a token if asked and one is there
+        :param key: The hash of the api key
+        :param take: Whether to take a token
+        :param ahead: The number of waiters that go first
+        :return: 0 if a token was taken, otherwise the seconds until there is one for
+         this waiter
+        """
+        with self._bucket_store() as buckets:
+            now = time.time()
+            tokens, filled = buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + max(0, now - filled) * self.rate / 60)
+            if take and tokens >= 1:
+                buckets[key] = [tokens - 1, now]
+                return 0
+            buckets[key] = [tokens, now]
+        return max(ahead + 1 - tokens, 0.01) * 60 / self.rate
+
+    def _bucket_store(self):
+        if self.path is None:
+            return _MemoryBuckets(self._buckets)
+        return _FileBuckets(self.path)
+
+    def stats(self):
+        """
+        :return: A dictionary of the tokens granted and the calls rejected
+        """
+        return {"granted": self.granted, "rejected": self.rejected}
+
+
+class _MemoryBuckets:
+    """
+    The buckets of one process, which the scheduler's condition already protects
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def __enter__(self):
+        return self.buckets
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class _FileBuckets:
+    """
+    Holds an exclusive lock on the bucket file for the length of a with block, and writes
+    the buckets back at the end of it
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.buckets = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a+", encoding="utf-8")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        self.file.seek(0)
+        try:
+            self.buckets = json.loads(self.file.read() or "{}")
+        except ValueError:  # Left half written by a process that died, so start again
+            self.buckets = {}
+        return self.buckets
+
+    def __exit__(self, exc_type, *exc_info):
+        try:
+            if exc_type is None:
+                self.file.seek(0)
+                self.file.truncate()
+                self.file.write(json.dumps(self.buckets))
+                self.file.flush()
+        finally:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
@@ -0,0 +1,191 @@
+"""
+A spatial index over the cities in the offline city index, used to snap [-gc] coordinates
+to the nearest known city so that nearby queries share one request and one cache entry.
+Cities are bucketed into a grid of cells, so only the cells near a point are searched.
+
+Build it with: python weather_spatial.py city.index spatial.index
+"""
+import array
+import bisect
+import math
+import struct
+import sys
+
+import weather_index
+
+
+MAGIC = b"WFSI"
+VERSION = 1
+HEADER = struct.Struct("<4sIdII")  # Magic, version, cell size, number of cells and cities
+EARTH_RADIUS_KM = 6371.0
+DEFAULT_CELL_DEGREES = 0.25
+DEFAULT_RADIUS_KM = 10.0
+
+
+def distance_km(lat_a, lon_a, lat_b, lon_b):
+    """
+    The great circle distance between two points
+    :return: The distance in kilometres
+    """
+    lat_a, lon_a, lat_b, lon_b = map(math.radians, (lat_a, lon_a, lat_b, lon_b))
+    chord = math.sin((lat_b - lat_a) / 2) ** 2 + \
+        math.cos(lat_a) * math.cos(lat_b) * math.sin((lon_b - lon_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord)))
+
+
+class SpatialIndex:
+    """
+    Finds the nearest city to a point.  The cities are stored sorted by grid cell, with
+    a sorted list of the cells that have cities and where each cell's cities start
+    """
+    def __init__(self, cell_degrees, cells, starts, latitudes, longitudes, city_ids,
+                 radius_km=DEFAULT_RADIUS_KM):
+        """
+        Use build or load rather than calling this directly
+        """
+        self.cell_degrees = cell_degrees
+        self.columns = int(math.ceil(360 / cell_degrees))
+        self.cells = cells  # The cells with at least one city, sorted
+        self.starts = starts  # Where each cell's cities start, with the end on the end
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.city_ids = city_ids
+        self.radius_km = radius_km
+
+    @classmethod
+    def build(cls, latitudes, longitudes, city_ids, cell_degrees=DEFAULT_CELL_DEGREES):
+        """
+        Buckets the cities into grid cells
+        :param latitudes: The latitude of each city
+        :param longitudes: The longitude of each city
+        :param city_ids: The ID of each city
+        :param cell_degrees: The width and height of a grid cell, in degrees
+        :return: The index
+        """
+        columns = int(math.ceil(360 / cell_degrees))
+        points = sorted((cls._cell(latitude, longitude, cell_degrees, columns),
+                         latitude, longitude, city_id)
+                        for latitude, longitude, city_id in zip(latitudes, longitudes, city_ids))
+        cells, starts = array.array("i"), array.array("I")
+        sorted_latitudes, sorted_longitudes = array.array("f"), array.array("f")
+        sorted_ids = array.array("I")
+        for position, (cell, latitude, longitude, city_id) in enumerate(points):
+            if not cells or cells[-1] != cell:
+                cells.append(cell)
+                starts.append(position)
+            sorted_latitudes.append(latitude)
+            sorted_longitudes.append(longitude)
+            sorted_ids.append(city_id)
+        starts.append(len(points))
+        return cls(cell_degrees, cells, starts, sorted_latitudes, sorted_longitudes, sorted_ids)
+
+    @classmethod
+    def from_city_index(cls, city_index, cell_degrees=DEFAULT_CELL_DEGREES):
+        """
+        Builds the index from every city in a weather_index.CityIndex
+        :param city_index: The city index
+        :param cell_degrees: The width and height of a grid cell, in degrees
+        :return: The index
+        """
+        return cls.build(city_index.column("latitudes"), city_index.column("longitudes"),
+                         city_index.column("ids"), cell_degrees)
+
+    @staticmethod
+    def _cell(latitude, longitude, cell_degrees, columns):
+        row = int(math.floor((latitude + 90) / cell_degrees))
+        column = int(math.floor((longitude + 180) / cell_degrees)) % columns
+        return row * columns + column
+
+    def save(self, path):
+        """
+        Writes the index to a file that load can read back quickly
+        :param path: The file to write
+        """
+        with open(path, "wb") as index_file:
+            index_file.write(HEADER.pack(MAGIC, VERSION, self.cell_degrees, len(self.cells),
+                                         len(self.city_ids)))
+            for column in (self.cells, self.starts, self.latitudes, self.longitudes,
+                           self.city_ids):
+                column = array.array(column.typecode, column)
+                if sys.byteorder != "little":
+                    column.byteswap()
+                column.tofile(index_file)
+
+    @classmethod
+    def load(cls, path, radius_km=DEFAULT_RADIUS_KM):
+        """
+        Reads an index written by save
+        :param path: The file to read
+        :param radius_km: How far a point may be from a city and still snap to it
+        :return: The index
+        :raises ValueError: If the file isn't a spatial index
+        """
+        with open(path, "rb") as index_file:
+            magic, version, cell_degrees, cell_count, city_count = \
+                HEADER.unpack(index_file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(path + " is not a spatial index")
+            cells = _read_column(index_file, "i", cell_count)
+            starts = _read_column(index_file, "I", cell_count + 1)
+            latitudes = _read_column(index_file, "f", city_count)
+            longitudes = _read_column(index_file, "f", city_count)
+            city_ids = _read_column(index_file, "I", city_count)
+        return cls(cell_degrees, cells, starts, latitudes, longitudes, city_ids, radius_km)
+
+    def nearest(self, latitude, longitude, radius_km=None):
+        """
+        Finds the nearest city within the radius
+        :param latitude: The latitude of the point
+        :param longitude: The longitude of the point
+        :param radius_km: How far away a city may be, defaulting to the index's radius
+        :return: A (city ID, distance in km) tuple, or None if no city is close enough
+        """
+        radius_km = self.radius_km if radius_km is None else radius_km
+        # How many cells either side could hold a city within the radius
+        rows = int(math.ceil(math.degrees(radius_km / EARTH_RADIUS_KM) / self.cell_degrees))
+        shrink = max(math.cos(math.radians(min(abs(latitude) + rows * self.cell_degrees, 89.9))),
+                     1e-6)
+        across = min(int(math.ceil(rows / shrink)), self.columns // 2)
+
+        centre = self._cell(latitude, longitude, self.cell_degrees, self.columns)
+        centre_row, centre_column = divmod(centre, self.columns)
+        best_id, best_distance = None, radius_km
+        for row in range(centre_row - rows, centre_row + rows + 1):
+            for column in range(centre_column - across, centre_column + across + 1):
+                cell = row * self.columns + column % self.columns
+                found = bisect.bisect_left(self.cells, cell)
+                if found == len(self.cells) or self.cells[found] != cell:
+                    continue
+                for position in range(self.starts[found], self.starts[found + 1]):
+                    distance = distance_km(latitude, longitude, self.latitudes[position],
+                                           self.longitudes[position])
+                    if distance <= best_distance:
+                        best_id, best_distance = self.city_ids[position], distance
+        return None if best_id is None else (best_id, best_distance)
+
+    def snap(self, latitude, longitude, radius_km=None):
+        """
+        :param latitude: The latitude of the point
+        :param longitude: The longitude of the point
+        :param radius_km: How far away a city may be, defaulting to the index's radius
+        :return: The ID of the nearest city, or None if no city is close enough
+        """
+        nearest = self.nearest(latitude, longitude, radius_km)
+        return None if nearest is None else nearest[0]
+
+
+def _read_column(index_file, typecode, count):
+    column = array.array(typecode)
+    column.fromfile(index_file, count)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python weather_spatial.py city.index spatial.index")
+    else:
+        CITY_INDEX = weather_index.CityIndex(sys.argv[1])
+        SpatialIndex.from_city_index(CITY_INDEX).save(sys.argv[2])
+        print("Indexed the positions of " + str(len(CITY_INDEX)) + " cities")
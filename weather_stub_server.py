@@ -0,0 +1,220 @@
+"""
+A local stand in for the open weather api, used by the tests and benchmarks.
+It answers every request with a canned weather response, after an optional delay, and
+can fail a share of requests, or answer a share of them slowly, the way the real api does.
+
+Run it on its own with: python weather_stub_server.py [port]
+It also answers requests sent to it as an HTTP proxy, so the program can be pointed at
+it with HTTP_PROXY=http://127.0.0.1:[port]
+"""
+import http.server
+import json
+import random
+import socketserver
+import sys
+import threading
+import time
+
+
+# A realistic /data/2.5/weather response
+SAMPLE_WEATHER = {
+    "coord": {"lon": -0.13, "lat": 51.51},
+    "weather": [{"id": 300, "main": "Drizzle", "description": "light intensity drizzle",
+                 "icon": "09d"}],
+    "base": "stations",
+    "main": {"temp": 280.32, "pressure": 1012, "humidity": 81, "temp_min": 279.15,
+             "temp_max": 281.15},
+    "visibility": 10000,
+    "wind": {"speed": 4.1, "deg": 80},
+    "clouds": {"all": 90},
+    "dt": 1485789600,
+    "sys": {"type": 1, "id": 5091, "message": 0.0103, "country": "GB", "sunrise": 1485762037,
+            "sunset": 1485794875},
+    "timezone": 0,
+    "id": 2643743,
+    "name": "London",
+    "cod": 200
+}
+
+# What the api answers with when it fails, by status code
+ERROR_PAYLOADS = {
+    401: {"cod": 401, "message": "Invalid API key. Please see "
+                                 "http://openweathermap.org/faq#error401 for more info."},
+    404: {"cod": "404", "message": "city not found"},
+    429: {"cod": 429, "message": "Your account is temporary blocked due to exceeding of "
+                                 "requests limitation of your subscription type."},
+    500: {"cod": 500, "message": "Internal error"},
+}
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    An HTTP server that handles each connection on its own thread
+    """
+    daemon_threads = True
+    request_queue_size = 1024  # Many clients connect at once
+
+    def __init__(self, address, stub):
+        http.server.HTTPServer.__init__(self, address, _StubHandler)
+        self.stub = stub
+
+    def handle_error(self, request, client_address):
+        """
+        Clients that time out hang up before the answer is sent, which isn't an error here
+        """
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            http.server.HTTPServer.handle_error(self, request, client_address)
+
+
+class _StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers a GET with the response configured on the server
+    """
+    protocol_version = "HTTP/1.1"  # Keep connections alive between requests
+    # The headers and body are written separately, so don't hold the body back waiting
+    # for the client to acknowledge the headers
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Sends the configured response, after the configured delay
+        """
+        stub = self.server.stub
+        stub.record(self.path)
+        delay = stub.delay()
+        if delay:
+            time.sleep(delay)
+        status, body = stub.answer()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """
+        Keep the test output quiet
+        """
+
+
+class StubServer:
+    """
+    Runs the stub api on a free local port for as long as it is in use, e.g.
+    with StubServer(latency=0.1) as server: requests.get(server.url("id=5"))
+    """
+    def __init__(self, latency=0.0, status=200, payload=None, error_rates=None, padding=0,
+                 seed=None, port=0, tail_rate=0.0, tail_latency=0.0):
+        """
+        :param latency: Seconds to wait before answering
+        :param status: The status code to answer with
+        :param payload: The response to send, defaulting to SAMPLE_WEATHER
+        :param error_rates: The share of requests to fail with each status code instead,
+         e.g. {429: 0.05, 500: 0.01}
+        :param padding: Bytes of extra data added to each successful response, to test
+         larger payloads
+        :param seed: The random seed for which requests fail, so runs can be compared
+        :param port: The port to listen on, defaulting to any free one
+        :param tail_rate: The share of requests answered after tail_latency instead
+        :param tail_latency: Seconds the slow share of requests wait before answering
+        """
+        self.latency = latency
+        self.status = status
+        self.payload = SAMPLE_WEATHER if payload is None else payload
+        self.error_rates = error_rates or {}
+        self.padding = padding
+        self.port = port
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.paths = []  # Every path requested, in order
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._body = None
+
+    def delay(self):
+        """
+        Picks how long one request waits
+        :return: Seconds to wait before answering
+        """
+        if not self.tail_rate:
+            return self.latency
+        with self._lock:
+            roll = self._random.random()
+        return self.tail_latency if roll < self.tail_rate else self.latency
+
+    def answer(self):
+        """
+        Picks the answer for one request
+        :return: A (status code, body) tuple
+        """
+        with self._lock:
+            roll = self._random.random()
+        for status, rate in sorted(self.error_rates.items()):
+            if roll < rate:
+                return status, json.dumps(ERROR_PAYLOADS.get(status, {"cod": status})) \
+                    .encode("utf-8")
+            roll -= rate
+        if self._body is None:  # Built once, as it is the same every time
+            payload = self.payload
+            if self.padding:
+                payload = dict(payload, padding="x" * self.padding)
+            self._body = json.dumps(payload).encode("utf-8")
+        return self.status, self._body
+
+    def record(self, path):
+        """
+        Remembers a requested path
+        :param path: The path that was requested
+        """
+        with self._lock:
+            self.paths.append(path)
+
+    def start(self):
+        """
+        Starts answering requests on a background thread
+        :return: The server itself
+        """
+        self._server = _ThreadingServer(("127.0.0.1", self.port), self)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server and frees the port
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def url(self, query="id=2643743&APPID=test"):
+        """
+        Builds a URL on this server in the same shape as synthesise_request
+        :param query: The query string to add
+        :return: The URL
+        """
+        return self.address + "/data/2.5/weather?" + query
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def address(self):
+        """
+        :return: 'http://127.0.0.1:[port]', e.g. to use as HTTP_PROXY
+        """
+        return "http://127.0.0.1:" + str(self._server.server_address[1])
+
+
+if __name__ == "__main__":
+    with StubServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8080) as STUB:
+        print("Answering on " + STUB.address, flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,155 @@
+"""
+Keeps refreshing a set of locations, and writes out only what has changed since the
+last refresh, as text or as lines of JSON.
+
+Open weather only updates a location every few minutes, and each response says when its
+observation was made (dt).  A response whose observation is no newer than the last one is
+skipped without being decoded into an Observation or compared
+"""
+import json
+import sys
+import time
+
+from weather_observation import FIELDS, Observation
+
+
+UNREADABLE_RESPONSE = "The response could not be read"
+# Raised by a response that can't be decoded, or is missing a value that was asked for
+BAD_RESPONSE_ERRORS = (ValueError, KeyError, TypeError, AttributeError)
+
+
+class _Target:
+    """
+    One location being watched, and what was last seen for it
+    """
+    def __init__(self, label, url, user_input):
+        self.label = label
+        self.url = url
+        self.user_input = user_input
+        self.flags = [flag for flag in FIELDS if flag in user_input]
+        self.observed = None  # The time of the last observation, from its dt
+        self.observation = None  # The last Observation, or None before the first
+        self.error = None  # The last error, so it is only written when it changes
+
+
+class Watcher:
+    """
+    Refreshes the locations and works out which of the wanted values changed
+    """
+    def __init__(self, targets, fetch, render, style="text"):
+        """
+        :param targets: A list of (label, url, user_input) tuples, one for each location
+        :param fetch: A function of a URL that gives an (error message or None, decoded
+         JSON response) tuple
+        :param render: A function of an Observation and flags that gives the text for
+         them, e.g. weather_forecast.format_weather
+        :param style: "text" or "json"
+        """
+        self.targets = [_Target(label, url, user_input) for label, url, user_input in targets]
+        self.fetch = fetch
+        self.render = render
+        self.style = style
+        self.unchanged = 0  # Responses skipped because their observation was no newer
+
+    def poll(self):
+        """
+        Refreshes every location once.  Locations sharing a URL are fetched once
+        :return: A list of the lines to write for what changed
+        """
+        lines = []
+        responses = {}  # URL to what fetch gave for it, this round
+        for target in self.targets:
+            if target.url not in responses:
+                try:
+                    responses[target.url] = self.fetch(target.url)
+                except BAD_RESPONSE_ERRORS:  # The response couldn't be decoded
+                    responses[target.url] = (UNREADABLE_RESPONSE, None)
+            error, weather_json = responses[target.url]
+            if error is None:
+                try:
+                    line = self._refresh(target, weather_json)
+                except BAD_RESPONSE_ERRORS:  # Missing something this location asks for
+                    error = UNREADABLE_RESPONSE
+                else:
+                    target.error = None
+                    if line is not None:
+                        lines.append(line)
+                    continue
+            # Only this location's error is written, and the rest are still refreshed
+            if error != target.error:
+                target.error = error
+                lines.append(self._line(target, None, {}, error))
+        return lines
+
+    def _refresh(self, target, weather_json):
+        """
+        :param target: The location
+        :param weather_json: Its decoded JSON response
+        :return: The line to write for what changed, or None if nothing did
+        :raises KeyError: If the response is missing a value the location asks for
+        """
+        observed = weather_json.get("dt")
+        if observed is not None and target.observed is not None and \
+                observed <= target.observed:
+            self.unchanged += 1
+            return None
+        observation = Observation.from_json(weather_json, target.user_input)
+        changed = self.changed(target, observation)
+        target.observed = observed
+        target.observation = observation
+        return self._line(target, observed, changed, None) if changed else None
+
+    @staticmethod
+    def changed(target, observation):
+        """
+        :param target: The location, holding its last observation
+        :param observation: The new Observation
+        :return: A dictionary of each wanted flag whose values changed, to a dictionary
+         of field name to an (old value, new value) tuple
+        """
+        changed = {}
+        last = target.observation
+        for flag in target.flags:
+            fields = {}
+            for name, _, _ in FIELDS[flag]:
+                new = getattr(observation, name)
+                old = None if last is None else getattr(last, name)
+                if last is None or new != old:
+                    fields[name] = (old, new)
+            if fields:
+                changed[flag] = fields
+        return changed
+
+    def _line(self, target, observed, changed, error):
+        if self.style == "json":
+            record = {"location": target.label}
+            if error is not None:
+                record["error"] = error
+            else:
+                record["dt"] = observed
+                record["changes"] = {name: {"old": old, "new": new}
+                                     for fields in changed.values()
+                                     for name, (old, new) in fields.items()}
+            return json.dumps(record, sort_keys=True)
+        if error is not None:
+            return target.label + ": " + error
+        return target.label + ": " + self.render(
+            target.observation, {flag: target.user_input[flag] for flag in changed}).rstrip()
+
+    def run(self, interval, rounds=None, output=None):
+        """
+        Refreshes every interval, writing the changes as they are found
+        :param interval: Seconds from the start of one refresh to the start of the next
+        :param rounds: How many refreshes to make, or None to keep going
+        :param output: The file to write to, defaulting to stdout
+        """
+        output = sys.stdout if output is None else output
+        made = 0
+        while rounds is None or made < rounds:
+            started = time.monotonic()
+            for line in self.poll():
+                print(line, file=output, flush=True)
+            made += 1
+            if rounds is None or made < rounds:
+                # A refresh that took longer than the interval starts the next one at once
+                time.sleep(max(0, interval - (time.monotonic() - started)))